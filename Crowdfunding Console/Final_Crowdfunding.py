@@ -1,20 +1,354 @@
+import argparse
+import bisect
+import collections
+import contextlib
+import cProfile
 import datetime
+import functools
+import gc
+import hashlib
+import heapq
+import hmac
+import itertools
 import json
+import logging.handlers
+import os
+import pickle
 import re
+import secrets
+import signal
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+from array import array
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # not available on Windows
+
+USERS_FILE = 'users.json'
+PROJECTS_FILE = 'projects.json'
+# every change to the projects since projects.json was written, one JSON line per change
+JOURNAL_FILE = 'changes.log'
+# the journal of older versions, which only recorded donations
+LEGACY_DONATIONS_FILE = 'donations.log'
+# lock file taken (fcntl.flock) by every process that changes the JSON files
+LOCK_FILE = 'crowdfunding.lock'
+DATABASE_FILE = 'crowdfunding.db'
+SNAPSHOT_FILE = 'crowdfunding.snapshot'
+# binary snapshot header: magic, snapshot version, SHA-256 of the payload, length of the metadata pickle
+SNAPSHOT_HEADER = struct.Struct('>6sH32sQ')
+SNAPSHOT_MAGIC = b'CFSNAP'
+SNAPSHOT_VERSION = 4
+# number of journal entries after which they are compacted into projects.json
+COMPACT_EVERY = 1000
+# the write-behind saver writes changed files after this many seconds,
+# or sooner once this many changes are waiting
+FLUSH_INTERVAL = 1.0
+FLUSH_THRESHOLD = 100
+# projects shown on one page of the listings
+PAGE_SIZE = 10
+# entries shown in each leaderboard
+LEADERBOARD_SIZE = 10
+# orders of the paginated listings, 'listed' is the order of the list itself:
+# creation order, or best match first for title searches
+SORT_ORDERS = {
+    'listed': "creation order (best match first for searches)",
+    'title': "title",
+    'end_date': "end date",
+    'funded': "percentage funded",
+    'raised': "amount raised"
+}
+# version of the users.json and projects.json format written by save(),
+# version 1 files (a plain list with the creator record copied in every project) are upgraded when read
+FORMAT_VERSION = 2
+# characters read at a time by JsonRecordStream
+STREAM_CHUNK_SIZE = 1024 * 1024
+# passwords are stored as salted PBKDF2-SHA256 hashes with this many iterations
+PASSWORD_ITERATIONS = 600000
+PASSWORD_SCHEME = 'pbkdf2_sha256'
+# logins stay valid this many seconds after they were last used, at most MAX_SESSIONS at once
+SESSION_TTL = 3600
+MAX_SESSIONS = 100000
+# instrumentation, turned on with --profile or by setting this environment variable
+PROFILE_VARIABLE = 'CROWDFUNDING_PROFILE'
+# one JSON line per measured operation, rotated once it reaches METRICS_MAX_BYTES
+METRICS_FILE = 'metrics.jsonl'
+METRICS_MAX_BYTES = 5 * 1024 * 1024
+METRICS_BACKUPS = 3
+# written when a cProfile run started and stopped with SIGUSR1 ends
+PROFILE_FILE = 'crowdfunding.prof'
+
+
+# opt-in measurements of the menu actions and of every load and save: wall time, bytes read and
+# written, objects built and the memory allocated meanwhile (tracemalloc). each measurement is a
+# line of the rotating METRICS_FILE. while it is off, the wrapped functions are called directly.
+# the counters and the memory figures are process-wide, so a measurement also includes what the
+# saver thread did meanwhile. the wall time of a menu action includes the time spent at its prompts
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.counters = {'bytes_read': 0, 'bytes_written': 0, 'objects_built': 0}
+        self.local = threading.local()  # depth of the measurements running in this thread
+        self.logger = None
+        self.profiler = None
+
+    def enable(self, file_name=METRICS_FILE):
+        handler = logging.handlers.RotatingFileHandler(file_name, maxBytes=METRICS_MAX_BYTES,
+                                                       backupCount=METRICS_BACKUPS)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        self.logger = logging.getLogger('crowdfunding.metrics')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(handler)
+        tracemalloc.start()
+        # kill -USR1 <pid> starts a cProfile run, the next one stops it and writes PROFILE_FILE
+        if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.toggle_profiler())
+        self.enabled = True
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        if self.profiler is not None:
+            self.toggle_profiler()
+        tracemalloc.stop()
+        for handler in self.logger.handlers[:]:
+            self.logger.removeHandler(handler)
+            handler.close()
+
+    def toggle_profiler(self):
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.profiler.disable()
+            self.profiler.dump_stats(PROFILE_FILE)
+            self.profiler = None
+
+    def count(self, counter, amount):
+        if self.enabled:
+            self.counters[counter] += amount
+
+    # measure the code in the with block and write it as one line of the metrics file
+    @contextlib.contextmanager
+    def measure(self, operation):
+        if not self.enabled:
+            yield
+            return
+        depth = getattr(self.local, 'depth', 0)
+        self.local.depth = depth + 1
+        counters = dict(self.counters)
+        if depth == 0:
+            tracemalloc.reset_peak()
+        memory = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as exception:
+            error = type(exception).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            current, peak = tracemalloc.get_traced_memory()
+            self.local.depth = depth
+            record = {'time': datetime.datetime.now().isoformat(timespec='milliseconds'), 'operation': operation,
+                      'thread': threading.current_thread().name, 'seconds': round(seconds, 6),
+                      **{name: value - counters[name] for name, value in self.counters.items()},
+                      'memory_delta': current - memory}
+            # the peak is only meaningful for a measurement that isn't inside another one
+            if depth == 0:
+                record['memory_peak'] = peak
+            if error is not None:
+                record['error'] = error
+            self.logger.info(json.dumps(record))
+
+
+metrics = Metrics()
+
+
+# measure every call of the function while the instrumentation is on
+def instrumented(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not metrics.enabled:
+            return function(*args, **kwargs)
+        with metrics.measure(function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+# every email address used by users, creators and backers gets a small integer id.
+# projects keep these ids instead of repeating the same strings in every record,
+# and the files use the same ids to refer from projects to users.
+class UserIds:
+    def __init__(self):
+        self.emails = {}  # id -> email
+        self.ids = {}  # case-folded email -> id
+        self.next_id = 1
+
+    # id of an email address, a new one is given the first time the email is seen.
+    # users read from a file bring their own id
+    def intern(self, email, user_id=None):
+        key = email.casefold()
+        if user_id is None:
+            user_id = self.ids.get(key)
+            if user_id is not None:
+                return user_id
+            user_id = self.next_id
+        else:
+            # another process saved this id for someone else, the email that had it here gets a new one
+            previous = self.emails.get(user_id)
+            if previous is not None and previous.casefold() != key:
+                self.ids.pop(previous.casefold(), None)
+        self.emails[user_id] = sys.intern(email)
+        self.ids[key] = user_id
+        self.next_id = max(self.next_id, user_id + 1)
+        return user_id
+
+    # id of an email address that was already seen, or None
+    def find(self, email):
+        return self.ids.get(email.casefold())
+
+    def email(self, user_id):
+        return self.emails[user_id]
+
+
+user_ids = UserIds()
+
+
+# 'pbkdf2_sha256$<iterations>$<salt>$<hash>' for a password, with a new random salt every time
+def hash_password(password, iterations=PASSWORD_ITERATIONS):
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f"{PASSWORD_SCHEME}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def is_password_hash(stored):
+    return isinstance(stored, str) and stored.startswith(PASSWORD_SCHEME + '$')
+
+
+# compare in constant time, so the time taken doesn't tell how much of the password was right.
+# files of older versions hold the passwords themselves, they are still accepted.
+# a damaged hash (edited file, cut off import) matches no password instead of crashing the login
+def verify_password(stored, password):
+    if stored is None:
+        return False
+    if not is_password_hash(stored):
+        return hmac.compare_digest(stored.encode(), password.encode())
+    try:
+        _, iterations, salt, digest = stored.split('$')
+        candidate = hashlib.pbkdf2_hmac('sha256', password.encode(), bytes.fromhex(salt), int(iterations))
+        return hmac.compare_digest(candidate.hex(), digest)
+    except (ValueError, TypeError):
+        return False
+
+
+# passwords stored in plain text or with fewer iterations are hashed again at the next login
+def password_needs_rehash(stored):
+    if not is_password_hash(stored):
+        return True
+    try:
+        return int(stored.split('$')[1]) < PASSWORD_ITERATIONS
+    except (IndexError, ValueError):
+        return True
+
+
+# hash compared with the password when nobody has the email, so the answer takes as long as
+# for a wrong password and doesn't tell which emails are registered
+@functools.lru_cache(maxsize=1)
+def dummy_password_hash():
+    return hash_password(secrets.token_urlsafe(16))
+
+
+# the user with this email and password from the storage backend, or None
+def check_credentials(backend, email, password):
+    user = backend.find_user(email)
+    if user is None:
+        verify_password(dummy_password_hash(), password)
+        return None
+    if not verify_password(user.password, password):
+        return None
+    if password_needs_rehash(user.password):
+        backend.set_password(user, hash_password(password))
+    return user
+
+
+# login tokens -> email, so a logged-in client is checked with one dictionary lookup instead of
+# the password hash. a session expires SESSION_TTL seconds after it was last used, and the least
+# recently used sessions are dropped once there are more than MAX_SESSIONS
+class SessionCache:
+    def __init__(self, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL, clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.clock = clock
+        self.sessions = collections.OrderedDict()  # token -> (email, expiry), least recently used first
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    # a new token for the user with this email
+    def create(self, email):
+        token = secrets.token_urlsafe(24)
+        now = self.clock()
+        with self.lock:
+            # the least recently used sessions are the first to expire
+            while self.sessions and next(iter(self.sessions.values()))[1] <= now:
+                self.sessions.popitem(last=False)
+            self.sessions[token] = (email, now + self.ttl)
+            if len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        return token
+
+    # the email of a valid token, the session is kept alive for another SESSION_TTL seconds
+    def get(self, token):
+        now = self.clock()
+        with self.lock:
+            entry = self.sessions.get(token)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                del self.sessions[token]
+                return None
+            self.sessions[token] = (entry[0], now + self.ttl)
+            self.sessions.move_to_end(token)
+            return entry[0]
+
+    def remove(self, token):
+        with self.lock:
+            self.sessions.pop(token, None)
 
 
 # User class contain the registered users data
 class User:
-    def __init__(self, first_name, last_name, email, password, mobile_phone):
+    # __slots__ stores the attributes in fixed slots instead of a per-object dictionary
+    __slots__ = ('first_name', 'last_name', 'email', 'password', 'mobile_phone', 'user_id')
+
+    def __init__(self, first_name, last_name, email, password, mobile_phone, user_id=None):
         self.first_name = first_name
         self.last_name = last_name
         self.email = email
+        # salted hash from hash_password(), None for a user only known from old project records, who can't log in
         self.password = password
         self.mobile_phone = mobile_phone
+        self.user_id = user_ids.intern(email, user_id)
+
+    # build a user from a record of users.json
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
 
     # convert user attributes to a dictionary for easy storage or processing
     def to_dict(self):
         return {
+            'user_id': self.user_id,
             'first_name': self.first_name,
             'last_name': self.last_name,
             'email': self.email,
@@ -25,17 +359,52 @@ class User:
 
 # Project class contain the data of fundraising projects created by the users
 class Project:
-    def __init__(self, title, details, target_amount, start_date, end_date, creator, current_amount=0, backers=[], closed=False):
+    __slots__ = ('title', 'details', 'target_amount', 'start_date', 'end_date', 'creator_id',
+                 'current_amount', 'backers', 'closed', 'project_id', 'version')
+
+    def __init__(self, title, details, target_amount, start_date, end_date, creator, current_amount=0, backers=None, closed=False, project_id=None, version=0):
         self.title = title
         self.details = details
         self.target_amount = target_amount
         self.start_date = start_date
         self.end_date = end_date
-        self.creator = creator  # Email address of the user who created the project
+        # id of the user who created the project, the creator can be given as
+        # a user record dictionary, a User, an email address or an id
+        if isinstance(creator, int):
+            self.creator_id = creator
+        else:
+            self.creator_id = user_ids.intern(creator_email(creator))
         self.current_amount = current_amount
-        # List to store the emails of users who have contributed funds to the project
-        self.backers = backers
+        # ids of the users who have contributed funds to the project, in a compact array of integers
+        self.backers = array('i', (backer if isinstance(backer, int) else user_ids.intern(backer)
+                                   for backer in backers or ()))
         self.closed = closed  # A boolean indicating whether the project is closed
+        self.project_id = project_id  # unique number used by the journal
+        self.version = version  # counts the edits, for the optimistic check in update_project()
+
+    # Email address of the user who created the project
+    @property
+    def creator(self):
+        return user_ids.email(self.creator_id)
+
+    # a project that reached its end date is successful if it raised the target amount, it can't
+    # change afterwards because closed projects take no donations and can't be edited
+    @property
+    def successful(self):
+        return self.current_amount >= self.target_amount
+
+    def backer_emails(self):
+        return [user_ids.email(backer) for backer in self.backers]
+
+    def add_backer(self, email):
+        self.backers.append(user_ids.intern(email))
+
+    # build a project from a record of projects.json, where the creator is a user id
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data['creator'] = data.pop('creator_id')
+        return cls(**data)
 
     # convert project attributes to a dictionary for easy storage or processing
     def to_dict(self):
@@ -45,202 +414,2335 @@ class Project:
             'target_amount': self.target_amount,
             'start_date': self.start_date,
             'end_date': self.end_date,
-            'creator': self.creator,
+            'creator_id': self.creator_id,
             'current_amount': self.current_amount,
-            'backers': self.backers,
-            'closed': self.closed
+            'backers': self.backers.tolist(),
+            'closed': self.closed,
+            'project_id': self.project_id,
+            'version': self.version
         }
 
 
-# load user data from file
-def load_users_from_file():
-    try:
-        with open('users.json', 'r') as file:
-            # Check if the file is empty
-            if file.readable() and file.read() == '':
+# a project as exported: the creator is given by email and the backers are left out
+def project_record(project):
+    return {
+        'project_id': project.project_id,
+        'title': project.title,
+        'details': project.details,
+        'target_amount': project.target_amount,
+        'start_date': project.start_date,
+        'end_date': project.end_date,
+        'creator': project.creator,
+        'current_amount': project.current_amount,
+        'closed': project.closed
+    }
+
+
+# share of the target amount raised so far
+def funded_ratio(project):
+    return project.current_amount / project.target_amount if project.target_amount else 0.0
+
+
+# key functions of the sort orders, and whether the largest values come first
+SORT_KEYS = {
+    'title': (lambda project: project.title.lower(), False),
+    'end_date': (lambda project: project.end_date, False),
+    'funded': (funded_ratio, True),
+    'raised': (lambda project: project.current_amount, True)
+}
+
+
+# the projects of one page in the given order, without sorting or copying the whole list:
+# a slice for the listed order, and the first offset + limit projects of the order for the others
+def page_of(projects, sort, offset, limit):
+    if sort == 'listed':
+        return list(itertools.islice(projects, offset, offset + limit))
+    key, descending = SORT_KEYS[sort]
+    pick = heapq.nlargest if descending else heapq.nsmallest
+    return pick(offset + limit, projects, key=key)[offset:]
+
+
+# email address of a project creator, the file stores the creator as a dictionary
+# but a User object or the plain email address are accepted too
+def creator_email(creator):
+    if isinstance(creator, dict):
+        return creator['email']
+    if isinstance(creator, User):
+        return creator.email
+    return creator
+
+
+# the set of 3-character pieces of a text, used as keys of the search index
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# inverted trigram index over the project titles and details.
+# every search token of 3 or more characters only checks the projects that contain all of its
+# trigrams, and the lowercased texts are kept so titles are not lowercased again on each search.
+class TitleIndex:
+    def __init__(self):
+        self.postings = {}  # trigram -> set of project ids
+        self.documents = {}  # project id -> (lowercased title, lowercased details)
+
+    def add(self, project_id, title, details):
+        document = (title.lower(), (details or '').lower())
+        self.documents[project_id] = document
+        for gram in trigrams(document[0]) | trigrams(document[1]):
+            self.postings.setdefault(gram, set()).add(project_id)
+
+    def remove(self, project_id):
+        document = self.documents.pop(project_id, None)
+        if document is None:
+            return
+        for gram in trigrams(document[0]) | trigrams(document[1]):
+            ids = self.postings[gram]
+            ids.discard(project_id)
+            if not ids:
+                del self.postings[gram]
+
+    # re-index a project whose title or details were edited
+    def update(self, project_id, title, details):
+        self.remove(project_id)
+        self.add(project_id, title, details)
+
+    # ids of the projects containing this token in the title or details
+    def candidates(self, token):
+        grams = trigrams(token)
+        if not grams:
+            # shorter than a trigram, check the cached lowercased texts
+            return {project_id for project_id, (title, details) in self.documents.items()
+                    if token in title or token in details}
+        postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        ids = set(postings[0]).intersection(*postings[1:])
+        return {project_id for project_id in ids
+                if token in self.documents[project_id][0] or token in self.documents[project_id][1]}
+
+    # score of a matching project: title matches count more than details matches,
+    # and a title that starts with a token or contains the whole query ranks first
+    def rank(self, project_id, tokens, query):
+        title, details = self.documents[project_id]
+        score = 0
+        for token in tokens:
+            if token in title:
+                score += 3 if title.startswith(token) else 2
+            elif token in details:
+                score += 1
+        if query in title:
+            score += 3
+        return score
+
+    # ids of the projects matching every token of the query, best match first
+    def search(self, query):
+        query = query.lower().strip()
+        tokens = query.split()
+        if not tokens:
+            return list(self.documents)
+        ids = None
+        for token in sorted(tokens, key=len, reverse=True):
+            matches = self.candidates(token)
+            ids = matches if ids is None else ids & matches
+            if not ids:
                 return []
-            # If not empty, rewind the file and load the data
-            file.seek(0)  # sets the file position to the beginning
-            # reads the entire content of the file and returns a list of dictionaries, where each dictionary represents a user's data.
-            users_data = json.load(file)
-        users = [User(**user_data) for user_data in users_data]
-    except (FileNotFoundError, json.decoder.JSONDecodeError):
-        users = []
-    return users
+        return sorted(ids, key=lambda project_id: (-self.rank(project_id, tokens, query), project_id))
+
+
+# leaderboards kept up to date as projects are created, edited, deleted and donated to, so the
+# top k entries are read in O(k): sorted lists of (-share funded, project id), (-unique backers,
+# project id) and (-total raised, creator id), with the running totals of every creator
+class Leaderboards:
+    def __init__(self):
+        self.funded = []
+        self.backed = []
+        self.creators = []
+        self.keys = {}  # project id -> its (funded, backed) keys, to find the entries again
+        self.backers = {}  # project id -> ids of the users who donated to it
+        self.creator_totals = {}  # creator id -> amount raised by all their projects
+
+    # the leaderboards of a whole list of projects, sorted once instead of inserting one by one
+    def build(self, projects):
+        for project in projects:
+            backers = set(project.backers)
+            self.backers[project.project_id] = backers
+            keys = (-funded_ratio(project), -len(backers))
+            self.keys[project.project_id] = keys
+            self.funded.append((keys[0], project.project_id))
+            self.backed.append((keys[1], project.project_id))
+            self.creator_totals[project.creator_id] = (self.creator_totals.get(project.creator_id, 0.0)
+                                                       + project.current_amount)
+        self.funded.sort()
+        self.backed.sort()
+        self.creators = sorted((-total, creator_id) for creator_id, total in self.creator_totals.items())
+
+    def add(self, project):
+        self.backers[project.project_id] = set(project.backers)
+        self.insert(project)
+        self.add_to_creator(project.creator_id, project.current_amount)
+
+    def remove(self, project):
+        self.take_out(project.project_id)
+        del self.backers[project.project_id]
+        self.add_to_creator(project.creator_id, -project.current_amount)
+
+    # the target amount was edited
+    def changed(self, project):
+        self.take_out(project.project_id)
+        self.insert(project)
+
+    # called after the amount was added to the project
+    def donated(self, project, backer_id, amount):
+        self.take_out(project.project_id)
+        self.backers[project.project_id].add(backer_id)
+        self.insert(project)
+        self.add_to_creator(project.creator_id, amount)
+
+    def insert(self, project):
+        keys = (-funded_ratio(project), -len(self.backers[project.project_id]))
+        self.keys[project.project_id] = keys
+        bisect.insort(self.funded, (keys[0], project.project_id))
+        bisect.insort(self.backed, (keys[1], project.project_id))
+
+    def take_out(self, project_id):
+        funded, backed = self.keys.pop(project_id)
+        del self.funded[bisect.bisect_left(self.funded, (funded, project_id))]
+        del self.backed[bisect.bisect_left(self.backed, (backed, project_id))]
+
+    def add_to_creator(self, creator_id, amount):
+        total = self.creator_totals.get(creator_id)
+        if total is not None:
+            del self.creators[bisect.bisect_left(self.creators, (-total, creator_id))]
+        else:
+            total = 0.0
+        total += amount
+        self.creator_totals[creator_id] = total
+        bisect.insort(self.creators, (-total, creator_id))
+
+    # ids of the k projects with the largest share of their target raised
+    def top_funded(self, k):
+        return [project_id for _, project_id in self.funded[:k]]
+
+    # (project id, unique backers) of the k projects with the most backers
+    def top_backed(self, k):
+        return [(project_id, -backers) for backers, project_id in self.backed[:k]]
+
+    # (creator id, total raised) of the k creators who raised the most
+    def top_creators(self, k):
+        return [(creator_id, -total) for total, creator_id in self.creators[:k]]
+
+
+# sorted lists of (date, project id) for the start and end dates of the projects.
+# dates are 'YYYY-MM-DD' strings, so they sort in date order, and range queries are
+# answered with bisect in O(log N + k).
+class DateIndex:
+    def __init__(self):
+        self.by_start = []
+        self.by_end = []
+        self.dates = {}  # project id -> (start date, end date), to find the entries again
+
+    def add(self, project_id, start_date, end_date):
+        self.dates[project_id] = (start_date, end_date)
+        bisect.insort(self.by_start, (start_date, project_id))
+        bisect.insort(self.by_end, (end_date, project_id))
+
+    def remove(self, project_id):
+        dates = self.dates.pop(project_id, None)
+        if dates is None:
+            return
+        start_date, end_date = dates
+        del self.by_start[bisect.bisect_left(self.by_start, (start_date, project_id))]
+        del self.by_end[bisect.bisect_left(self.by_end, (end_date, project_id))]
+
+    # move a project whose dates were edited
+    def update(self, project_id, start_date, end_date):
+        if self.dates.get(project_id) != (start_date, end_date):
+            self.remove(project_id)
+            self.add(project_id, start_date, end_date)
+
+    # ids in a sorted list with a date between first and last (both included)
+    def between(self, entries, first, last):
+        low = bisect.bisect_left(entries, (first,))
+        high = bisect.bisect_right(entries, (last, float('inf')))
+        return [project_id for _, project_id in entries[low:high]]
+
+    def started_between(self, first, last):
+        return self.between(self.by_start, first, last)
+
+    def ending_between(self, first, last):
+        return self.between(self.by_end, first, last)
+
+    # projects with start date <= date <= end date. the two sorted lists can't answer this
+    # directly, so the side with fewer candidates is walked and checked against the other date.
+    def active_on(self, date):
+        started = bisect.bisect_right(self.by_start, (date, float('inf')))
+        not_ended = len(self.by_end) - bisect.bisect_left(self.by_end, (date,))
+        if started <= not_ended:
+            return [project_id for _, project_id in self.by_start[:started] if self.dates[project_id][1] >= date]
+        return [project_id for _, project_id in self.by_end[len(self.by_end) - not_ended:]
+                if self.dates[project_id][0] <= date]
+
+
+# held while the in-memory users and projects are changed or serialized,
+# so the background saver never writes half of a change
+data_lock = threading.RLock()
+
+
+# raised when a change can't be made because someone else changed the same data first,
+# for example another console edited or deleted the project in the meantime
+class ConflictError(Exception):
+    pass
+
+
+# advisory lock on a lock file (fcntl.flock), taken by every process that changes the files,
+# together with a thread lock so the threads of one process take turns as well.
+# a thread that already holds the lock can take it again. the lock is always taken before
+# data_lock, never while holding it. fcntl only exists on Unix, on other systems the
+# lock only works between the threads of one process.
+class FileLock:
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if self.depth == 0:
+            self.file = open(self.file_name, 'a')
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+        if self.depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+        self.thread_lock.release()
+
+
+file_lock = FileLock(LOCK_FILE)
+
+
+# write the chunks to a temporary file next to file_name and flush it to the disk (fsync)
+def write_temp_file(file_name, chunks, mode='w'):
+    temp_name = f"{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_name, mode) as file:
+        for chunk in chunks:
+            file.write(chunk)
+        file.flush()
+        os.fsync(file.fileno())
+        metrics.count('bytes_written', file.tell())
+    return temp_name
+
+
+# rename the temporary file over the old file
+def replace_file(temp_name, file_name):
+    os.replace(temp_name, file_name)
+    # make the rename itself durable (not possible on Windows)
+    if hasattr(os, 'O_DIRECTORY'):
+        directory = os.open(os.path.dirname(os.path.abspath(file_name)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+# write a file atomically: the chunks go to a temporary file that is flushed to the disk (fsync)
+# and then renamed over the old file, so a crash leaves either the old or the new file, never a mix
+def write_atomically(file_name, chunks, mode='w'):
+    replace_file(write_temp_file(file_name, chunks, mode), file_name)
+
+
+# JSON white space, and the start of a users.json or projects.json object
+STREAM_WHITESPACE = re.compile(r'[ \t\n\r]*')
+FILE_OBJECT_START = re.compile(r'\{[ \t\n\r]*"version"[ \t\n\r]*:')
+
+
+# the records of a users.json or projects.json file one at a time, read STREAM_CHUNK_SIZE
+# characters at a time, so the file is never held in memory as a whole. the file can be a version 1
+# list, a version 2 object (its other keys end up in header, also when they come after the list)
+# or JSON Lines with one record per line. each record is decoded on its own with raw_decode
+class JsonRecordStream:
+    def __init__(self, file, records_key, chunk_size=STREAM_CHUNK_SIZE):
+        self.file = file
+        self.records_key = records_key
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+        self.end_of_file = False
+        self.layout = None  # 'list', 'object' or 'lines', known once the first record was read
+        self.header = {}  # the keys of a version 2 object besides the records
+
+    def __iter__(self):
+        first = self.peek()
+        if first is None:
+            return  # an empty file has no records
+        if first == '[':
+            self.layout = 'list'
+            yield from self.items()
+        elif first == '{' and self.starts_file_object():
+            self.layout = 'object'
+            yield from self.members()
+        else:
+            self.layout = 'lines'
+            while self.peek() is not None:
+                yield self.value()
+
+    # read the next chunk after what is left of the buffer, False at the end of the file
+    def fill(self):
+        if self.end_of_file:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.end_of_file = True
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    # the next character that is not white space, None at the end of the file
+    def peek(self):
+        while True:
+            self.position = STREAM_WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                return None
+
+    def error(self, message):
+        return json.decoder.JSONDecodeError(message, self.buffer, self.position)
+
+    # skip one of these characters and return it
+    def expect(self, characters):
+        character = self.peek()
+        if character is None or character not in characters:
+            raise self.error(f"Expecting one of {characters!r}")
+        self.position += 1
+        return character
+
+    # decode the value at the next character. a value that ends with the buffer may go on in the
+    # next chunk (a number cut in two), so it is only taken once more text follows it
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                if end < len(self.buffer) or self.end_of_file:
+                    self.position = end
+                    return value
+            except json.decoder.JSONDecodeError:
+                if self.end_of_file:
+                    raise
+            self.fill()
+
+    # users.json and projects.json objects start with the version, JSON Lines records don't
+    def starts_file_object(self):
+        while len(self.buffer) - self.position < 64 and self.fill():
+            pass
+        return FILE_OBJECT_START.match(self.buffer, self.position) is not None
+
+    # the values of the list at the next character
+    def items(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.position += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+    # the records of the file object at the next character, the other keys go to the header
+    def members(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.position += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise self.error("Expecting property name enclosed in double quotes")
+            self.expect(':')
+            if key == self.records_key and self.peek() == '[':
+                yield from self.items()
+            else:
+                self.header[key] = self.value()
+            if self.expect(',}') == '}':
+                return
 
-# users a list iterates over each dictionary (user_data) in the list users_data, and for each dictionary, it creates a new User object using the **user_data syntax.
-# The **user_data syntax is used for unpacking the dictionary and passing its key-value pairs as keyword arguments to the User class constructor.
-# The resulting list (users) contains instances of the User class created from the JSON data.
 
+# a donation waiting in a GroupCommitter
+class PendingDonation:
+    __slots__ = ('project_id', 'backer', 'amount', 'timestamp', 'done', 'error')
 
-# # load project data from file
-def load_projects_from_file():
-    try:
-        with open('projects.json', 'r') as file:
-            # Check if the file is empty
-            if file.readable() and file.read() == '':
+    def __init__(self, project_id, backer, amount, timestamp=None):
+        self.project_id = project_id
+        self.backer = backer
+        self.amount = amount
+        self.timestamp = timestamp  # now, unless the donation is imported with its own time
+        self.done = False
+        self.error = None  # the exception to raise when the donation was refused
+
+    def to_dict(self):
+        return {
+            'op': 'donate',
+            'project_id': self.project_id,
+            'backer': self.backer,
+            'amount': self.amount,
+            'timestamp': self.timestamp or datetime.datetime.now().isoformat(timespec='seconds')
+        }
+
+
+# group commit: donations made at the same time by several threads are written together, with
+# one journal write and one fsync (or one SQLite transaction). a thread that finds nobody writing
+# writes every donation waiting so far, the others wait for it, and the donations arriving
+# meanwhile form the next group. the commit function sets .error on the donations it refuses.
+class GroupCommitter:
+    def __init__(self, commit):
+        self.commit = commit
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.committing = False
+
+    def submit(self, donation):
+        with self.condition:
+            self.waiting.append(donation)
+            while not donation.done:
+                if self.committing:
+                    self.condition.wait()
+                    continue
+                group = self.waiting
+                self.waiting = []
+                self.committing = True
+                self.condition.release()
+                try:
+                    self.commit(group)
+                except Exception as error:
+                    for pending in group:
+                        pending.error = error
+                finally:
+                    self.condition.acquire()
+                    self.committing = False
+                    for pending in group:
+                        pending.done = True
+                    self.condition.notify_all()
+        if donation.error is not None:
+            raise donation.error
+
+
+# keeps the objects of one JSON file in memory for the life of the process.
+# the file is parsed again only when its modification time or size changes,
+# so the menu actions can ask for the data as often as they want.
+class Repository:
+    def __init__(self, file_name, model, records_key):
+        self.file_name = file_name
+        self.model = model  # User or Project, built from each dictionary in the file
+        self.records_key = records_key  # name of the list of records in the file
+        self.items = None
+        self.signature = None
+        self.header = {}  # the other keys of the file object, besides the version and the records
+        self.unsaved = False  # changed in memory and not written by the saver yet
+
+    # (modification time, size, inode) of the file, or None if the file does not exist.
+    # the modification time only changes once per clock tick, but every save renames a new
+    # file (a new inode) into place, so two saves in the same tick are still told apart
+    def file_signature(self):
+        try:
+            stat = os.stat(self.file_name)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    # return the cached list, reloading it if the file changed on disk.
+    # changes the saver has not written yet are newer than the file, so they are kept
+    def load(self):
+        with data_lock:
+            signature = self.file_signature()
+            if self.items is None or (signature != self.signature and not self.unsaved):
+                self.items = self.read()
+                self.signature = signature
+                self.build_indexes()
+            return self.items
+
+    # rebuild the lookup tables after the list is replaced, nothing to do by default
+    def build_indexes(self):
+        pass
+
+    # parse the whole file, a missing or empty file is treated as no data.
+    # the records are read one at a time, so only the objects built from them take up memory
+    def read(self):
+        self.header = {}
+        try:
+            with open(self.file_name, 'r') as file:
+                stream = JsonRecordStream(file, self.records_key)
+                # iterates over each dictionary in the file, and for each dictionary, it creates a new object with from_dict().
+                items = [self.model.from_dict(record) for record in self.records(stream)]
+                metrics.count('bytes_read', os.fstat(file.fileno()).st_size)
+        except FileNotFoundError:
+            return []
+        except json.decoder.JSONDecodeError:
+            # a damaged file is not treated as empty, the next save would overwrite what is left of it
+            raise ValueError(f"{self.file_name} is not valid JSON, repair or remove it before starting.")
+        self.check_version(stream.header)
+        stream.header.pop('version', None)
+        self.header = stream.header
+        metrics.count('objects_built', len(items))
+        return items
+
+    # the records of a stream in the current format. a version 1 file (a plain list of records) is
+    # upgraded while it is read, a file of a newer version is refused before its first record is used
+    def records(self, stream):
+        for record in stream:
+            if stream.layout == 'list':
+                record = self.upgrade(record)
+            else:
+                self.check_version(stream.header)
+            yield record
+
+    def check_version(self, header):
+        if header.get('version', 0) > FORMAT_VERSION:
+            raise ValueError(f"{self.file_name} uses format version {header['version']}, "
+                             f"this program only reads up to version {FORMAT_VERSION}.")
+
+    # turn a version 1 record into the current format, nothing changes by default
+    def upgrade(self, record):
+        return record
+
+    # the extra keys written at the start of the file, none by default
+    def file_header(self):
+        return {}
+
+    # the text of the file: {"version": 2, "<records_key>": [...]} with one record per line
+    def serialize(self, items):
+        header = ''.join(f'"{key}": {json.dumps(value)}, ' for key, value in self.file_header().items())
+        records = ',\n'.join(json.dumps(item.to_dict(), default=serializer) for item in items)
+        return [f'{{"version": {FORMAT_VERSION}, {header}"{self.records_key}": [\n', records, '\n]}\n']
+
+    # write the list (by default the cached one) to the file and remember it as the current state.
+    # the list is serialized under the data lock, the slow disk write happens outside of it.
+    # the file lock keeps another process from writing the same file at the same time
+    def save(self, items=None):
+        with file_lock:
+            with data_lock:
+                if items is None:
+                    items = self.items
+                chunks = self.serialize(items)
+                if items is not self.items:
+                    self.items = items
+                    self.build_indexes()
+                self.unsaved = False
+            write_atomically(self.file_name, chunks)
+            with data_lock:
+                self.signature = self.file_signature()
+
+    # take over a list that was read somewhere else (the binary snapshot) for the file with this signature
+    def use(self, items, signature):
+        self.items = items
+        self.signature = signature
+        self.build_indexes()
+
+
+# users cache with an index from the case-folded email to the User,
+# so login and registration checks don't scan every user
+class UserRepository(Repository):
+    def __init__(self, file_name, model, records_key):
+        super().__init__(file_name, model, records_key)
+        self.dirty = False  # users were upgraded or added while upgrading old project records
+
+    def build_indexes(self):
+        self.by_email = {user.email.casefold(): user for user in self.items}
+
+    # version 1 users had no id, they get one when they are read and the file
+    # is rewritten before projects refer to these ids
+    def upgrade(self, record):
+        self.dirty = True
+        return record
+
+    # id of the user behind a creator record or backer email of a version 1 project file.
+    # people who are missing from users.json are added so the projects can refer to them by id
+    def ensure_user(self, creator):
+        user = self.find_by_email(creator_email(creator))
+        if user is None:
+            if isinstance(creator, dict):
+                user = User(creator.get('first_name', ''), creator.get('last_name', ''), creator['email'],
+                            creator.get('password'), creator.get('mobile_phone', ''))
+            else:
+                user = User('', '', creator, None, '')
+            self.add(user)
+            self.dirty = True
+        return user.user_id
+
+    # write upgraded users and users added by ensure_user(), before projects referring to them are saved
+    def save_if_dirty(self):
+        if self.dirty:
+            self.save()
+            self.dirty = False
+
+    # the registered user with this email (case insensitive), or None
+    def find_by_email(self, email):
+        with data_lock:
+            self.load()
+            return self.by_email.get(email.casefold())
+
+    def add(self, user):
+        self.load()
+        self.items.append(user)
+        self.by_email[user.email.casefold()] = user
+
+    # register a user and write users.json right away, raises ConflictError if the email is taken
+    def register(self, user):
+        if self.register_many([user]):
+            raise ConflictError(f"Email '{user.email}' is already registered.")
+
+    # store a new password hash, users.json is written right away like for a registration
+    def set_password(self, user, password_hash):
+        with file_lock:
+            with data_lock:
+                self.load()
+                current = self.by_email.get(user.email.casefold())
+                if current is None:
+                    return
+                current.password = password_hash
+                user.password = password_hash
+            self.save()
+
+    # register users with a single write of users.json and return the ones refused because their
+    # email is already registered. under the file lock the file is read again first, so two
+    # processes can't register the same email or give out the same user id.
+    # the file is written before the lock is let go instead of by the saver: the saver writes its own
+    # list over the file and would drop the users other processes registered since, and a registration
+    # that was confirmed must not be lost in a crash. users.json has no journal, so this costs a
+    # rewrite of the whole file per registration (a bulk import registers a chunk per rewrite)
+    def register_many(self, users):
+        with file_lock:
+            with data_lock:
+                self.load()
+                refused = []
+                for user in users:
+                    if user.email.casefold() in self.by_email:
+                        refused.append(user)
+                        continue
+                    # the id given when the User was created may have been taken by another process since
+                    user.user_id = user_ids.intern(user.email)
+                    self.add(user)
+            # written without the data lock, readers don't wait for the disk
+            self.save()
+            return refused
+
+
+# projects cache with indexes by id and by creator. projects.json is a snapshot of the projects,
+# every change made after it (created, edited and deleted projects and donations) is appended
+# to a journal that is replayed on load and compacted into projects.json from time to time.
+# several processes can share the files: changes are made under the file lock after catching
+# up with the journal lines the other processes appended, and journal entries are numbered
+# (seq) so the ones already included in projects.json are skipped.
+# the open projects are kept in a dictionary, with a min-heap of their end dates that closes
+# each project once its end date has passed, O(log N) per project.
+class ProjectRepository(Repository):
+    def __init__(self, file_name, model, records_key, journal_file):
+        super().__init__(file_name, model, records_key)
+        self.journal_file = journal_file
+        self.journal_inode = None  # the journal is replaced by compaction, this tells the files apart
+        self.journal_offset = 0  # bytes of the journal already applied
+        self.journal_entries = 0  # lines of the journal, compacted once there are COMPACT_EVERY
+        self.journal_seq = 0  # sequence number of the last applied journal entry
+        # 'YYYY-MM-DD' -> amount donated that day. the donations are added up into the project
+        # totals when the journal is compacted, so the daily totals are kept in the file header
+        self.raised_by_day = {}
+        self.donations = GroupCommitter(self.commit_donations)
+
+    # return the projects, reading projects.json again if it was rewritten (by this or another
+    # process) and applying the journal lines appended since the last call. unlike the users,
+    # reloading loses nothing, every change is in the journal as soon as it is made
+    def load(self):
+        with data_lock:
+            journal = self.open_journal()
+            try:
+                journal_stat = os.fstat(journal.fileno()) if journal is not None else None
+                journal_inode = journal_stat.st_ino if journal is not None else None
+                journal_size = journal_stat.st_size if journal is not None else 0
+                signature = self.file_signature()
+                if (self.items is None or signature != self.signature or journal_inode != self.journal_inode
+                        or journal_size < self.journal_offset):
+                    self.items = self.read()
+                    self.signature = signature
+                    self.build_indexes()
+                    self.journal_inode = journal_inode
+                    self.journal_offset = 0
+                    self.journal_entries = 0
+                if journal_size > self.journal_offset:
+                    self.replay_journal(journal)
+            finally:
+                if journal is not None:
+                    journal.close()
+            return self.items
+
+    # the journal opened for reading, or None if there is none yet
+    def open_journal(self):
+        try:
+            return open(self.journal_file, 'rb')
+        except FileNotFoundError:
+            pass
+        # the donation journal of older versions is the start of the change journal
+        try:
+            os.replace(LEGACY_DONATIONS_FILE, self.journal_file)
+            return open(self.journal_file, 'rb')
+        except FileNotFoundError:
+            return None
+
+    # read the snapshot and give an id to projects saved before ids existed
+    def read(self):
+        # creator and backer ids refer to users, so the users are read first
+        users_repository.load()
+        projects = super().read()
+        next_id = max((p.project_id for p in projects if p.project_id is not None), default=0) + 1
+        for project in projects:
+            if project.project_id is None:
+                project.project_id = next_id
+                next_id += 1
+        # journal entries up to journal_seq are already included in the projects file,
+        # they can still be in the journal if the program stopped before clearing it
+        self.journal_seq = self.header.get('journal_seq', self.header.get('last_donation', 0))
+        self.raised_by_day = dict(self.header.get('raised_by_day', {}))
+        return projects
+
+    # apply the complete journal lines after journal_offset
+    def replay_journal(self, journal):
+        journal.seek(self.journal_offset)
+        metrics.count('bytes_read', os.fstat(journal.fileno()).st_size - self.journal_offset)
+        for line in journal:
+            if not line.endswith(b'\n'):
+                break  # another process is still writing this line
+            self.journal_offset += len(line)
+            self.journal_entries += 1
+            try:
+                entry = json.loads(line)
+            except json.decoder.JSONDecodeError:
+                continue  # a line cut short by a crash while appending
+            seq = entry.get('seq')
+            if seq is not None:
+                if seq <= self.journal_seq:
+                    continue
+                self.journal_seq = seq
+            self.apply(entry)
+
+    # apply one journal entry to the projects in memory, lines without 'op' are donations
+    def apply(self, entry):
+        operation = entry.get('op', 'donate')
+        if operation == 'create':
+            self.insert(Project.from_dict(entry['project']))
+            return
+        project = self.by_id.get(entry['project_id'])
+        if project is None:
+            return  # the project was deleted later
+        if operation == 'donate':
+            self.record_donation(project, entry['backer'], entry['amount'], entry.get('timestamp'))
+        elif operation == 'update':
+            self.change(project, entry['changes'], entry['version'])
+        elif operation == 'delete':
+            self.delete(project)
+        elif operation == 'close':
+            self.close(project)
+
+    # the projects one at a time straight from projects.json, with the journal applied to each of
+    # them on the way, without keeping them or building any index. memory stays bounded however
+    # big the file is, the journal is compacted every COMPACT_EVERY lines. for reading only: the
+    # projects given out are not the cached ones, changing them changes nothing
+    def stream(self):
+        # creator and backer ids refer to users, so the users are read first
+        users_repository.load()
+        entries = self.read_journal()
+        header = {}
+        pending = None
+        try:
+            with open(self.file_name, 'r') as file:
+                stream = JsonRecordStream(file, self.records_key)
+                header = stream.header
+                for record in self.records(stream):
+                    # journal_seq comes before the projects in the files written by save()
+                    if pending is None:
+                        pending = self.pending_changes(entries, header)
+                    project = self.model.from_dict(record)
+                    if self.apply_pending(project, pending[0]):
+                        yield project
+        except FileNotFoundError:
+            pass
+        except json.decoder.JSONDecodeError:
+            raise ValueError(f"{self.file_name} is not valid JSON, repair or remove it before starting.")
+        if pending is None:
+            pending = self.pending_changes(entries, header)
+        changes, created = pending
+        for project in created:
+            if self.apply_pending(project, changes):
+                yield project
+
+    # the entries of the complete journal lines, without applying them
+    def read_journal(self):
+        journal = self.open_journal()
+        if journal is None:
+            return []
+        entries = []
+        with journal:
+            for line in journal:
+                if not line.endswith(b'\n'):
+                    break  # another process is still writing this line
+                try:
+                    entries.append(json.loads(line))
+                except json.decoder.JSONDecodeError:
+                    continue  # a line cut short by a crash while appending
+        return entries
+
+    # the journal entries that are not in a file with this header: the changes by project id,
+    # and the projects created
+    def pending_changes(self, entries, header):
+        journal_seq = header.get('journal_seq', header.get('last_donation', 0))
+        changes = {}
+        created = []
+        for entry in entries:
+            seq = entry.get('seq')
+            if seq is not None:
+                if seq <= journal_seq:
+                    continue
+                journal_seq = seq
+            if entry.get('op') == 'create':
+                created.append(Project.from_dict(entry['project']))
+            else:
+                changes.setdefault(entry['project_id'], []).append(entry)
+        return changes, created
+
+    # apply the journaled changes to a streamed project, like apply() without the indexes.
+    # returns False if the project was deleted
+    def apply_pending(self, project, changes):
+        for entry in changes.get(project.project_id, ()):
+            operation = entry.get('op', 'donate')
+            if operation == 'donate':
+                project.current_amount += entry['amount']
+                project.add_backer(entry['backer'])
+            elif operation == 'update':
+                for field, value in entry['changes'].items():
+                    setattr(project, field, value)
+                project.version = entry['version']
+            elif operation == 'delete':
+                return False
+            elif operation == 'close':
+                project.closed = True
+        return True
+
+    # changes when projects.json is rewritten or the journal grows
+    def stream_signature(self):
+        try:
+            stat = os.stat(self.journal_file)
+            journal = (stat.st_ino, stat.st_size)
+        except FileNotFoundError:
+            journal = None
+        return self.file_signature(), journal
+
+    # version 1 projects copy the creator record and list backer emails, both become user ids
+    def upgrade(self, record):
+        record = dict(record)
+        record['creator_id'] = users_repository.ensure_user(record.pop('creator'))
+        record['backers'] = [users_repository.ensure_user(backer) for backer in record.get('backers', [])]
+        return record
+
+    # the title and date indexes are only built by the first search, and the leaderboards when they
+    # are first shown, so startup doesn't pay for them
+    def build_indexes(self):
+        self.by_creator = {}  # creator id -> projects
+        self.by_id = {}
+        self.title_index = None
+        self.date_index = None
+        self.leaderboards = None
+        self.open_by_id = {}  # project id -> open project, in creation order
+        self.deadlines = []  # heap of (end date, project id) of the open projects
+        self.next_id = max((p.project_id for p in self.items), default=0) + 1
+        for project in self.items:
+            self.index_project(project, False)
+        heapq.heapify(self.deadlines)
+
+    def index_project(self, project, push=True):
+        self.by_creator.setdefault(project.creator_id, []).append(project)
+        self.by_id[project.project_id] = project
+        if not project.closed:
+            self.open_by_id[project.project_id] = project
+            if push:
+                heapq.heappush(self.deadlines, (project.end_date, project.project_id))
+            else:
+                self.deadlines.append((project.end_date, project.project_id))
+        if self.leaderboards is not None:
+            self.leaderboards.add(project)
+        if self.title_index is not None:
+            self.title_index.add(project.project_id, project.title, project.details)
+            self.date_index.add(project.project_id, project.start_date, project.end_date)
+
+    # the search indexes are built the first time they are used. the caller holds the data lock, like for
+    # every read of the indexes: they are changed by the writers and replaced when the file is read again
+    def build_search_indexes(self):
+        self.load()
+        if self.title_index is None:
+            title_index = TitleIndex()
+            date_index = DateIndex()
+            for project in self.items:
+                title_index.add(project.project_id, project.title, project.details)
+                date_index.add(project.project_id, project.start_date, project.end_date)
+            self.title_index = title_index
+            self.date_index = date_index
+
+    def build_leaderboards(self):
+        self.load()
+        if self.leaderboards is None:
+            self.leaderboards = Leaderboards()
+            self.leaderboards.build(self.items)
+        return self.leaderboards
+
+    # the k projects with the largest share of their target raised
+    def top_funded(self, k):
+        with data_lock:
+            leaderboards = self.build_leaderboards()
+            return [self.by_id[project_id] for project_id in leaderboards.top_funded(k)]
+
+    # (project, unique backers) of the k projects with the most backers
+    def top_backed(self, k):
+        with data_lock:
+            leaderboards = self.build_leaderboards()
+            return [(self.by_id[project_id], backers) for project_id, backers in leaderboards.top_backed(k)]
+
+    # (creator email, total raised) of the k creators who raised the most
+    def top_creators(self, k):
+        with data_lock:
+            leaderboards = self.build_leaderboards()
+            return [(user_ids.email(creator_id), total) for creator_id, total in leaderboards.top_creators(k)]
+
+    # the amount raised by all the projects of the user with this email
+    def creator_total(self, email):
+        with data_lock:
+            return self.build_leaderboards().creator_totals.get(user_ids.find(email), 0.0)
+
+    # the amount donated on a 'YYYY-MM-DD' day
+    def raised_on(self, date):
+        with data_lock:
+            self.load()
+            return self.raised_by_day.get(date, 0.0)
+
+    def started_between(self, first, last):
+        with data_lock:
+            self.build_search_indexes()
+            return [self.by_id[project_id] for project_id in self.date_index.started_between(first, last)]
+
+    def ending_between(self, first, last):
+        with data_lock:
+            self.build_search_indexes()
+            return [self.by_id[project_id] for project_id in self.date_index.ending_between(first, last)]
+
+    def active_on(self, date):
+        with data_lock:
+            self.build_search_indexes()
+            return [self.by_id[project_id] for project_id in self.date_index.active_on(date)]
+
+    # one page in end date order, read straight from the sorted date index
+    def page_by_end_date(self, offset, limit):
+        with data_lock:
+            self.build_search_indexes()
+            return [self.by_id[project_id] for _, project_id in self.date_index.by_end[offset:offset + limit]]
+
+    # projects whose title or details match the query, best match first
+    def search(self, query):
+        with data_lock:
+            self.build_search_indexes()
+            return [self.by_id[project_id] for project_id in self.title_index.search(query)]
+
+    # the projects created by the user with this email, a copy of the list the writers change
+    def find_by_creator(self, email):
+        with data_lock:
+            self.load()
+            return list(self.by_creator.get(user_ids.find(email), []))
+
+    # the in-memory part of the changes, shared by the journal replay and the methods below
+    def insert(self, project):
+        self.next_id = max(self.next_id, project.project_id + 1)
+        self.items.append(project)
+        self.index_project(project)
+
+    def change(self, project, changes, version):
+        end_date = project.end_date
+        target_amount = project.target_amount
+        for field, value in changes.items():
+            setattr(project, field, value)
+        project.version = version
+        # the entry with the old end date is left in the heap and skipped when it comes up
+        if project.end_date != end_date and project.project_id in self.open_by_id:
+            heapq.heappush(self.deadlines, (project.end_date, project.project_id))
+        if project.target_amount != target_amount and self.leaderboards is not None:
+            self.leaderboards.changed(project)
+        if self.title_index is not None:
+            self.title_index.update(project.project_id, project.title, project.details)
+            self.date_index.update(project.project_id, project.start_date, project.end_date)
+
+    def delete(self, project):
+        self.items.remove(project)
+        self.by_creator[project.creator_id].remove(project)
+        del self.by_id[project.project_id]
+        self.open_by_id.pop(project.project_id, None)
+        if self.leaderboards is not None:
+            self.leaderboards.remove(project)
+        if self.title_index is not None:
+            self.title_index.remove(project.project_id)
+            self.date_index.remove(project.project_id)
+
+    def record_donation(self, project, backer, amount, timestamp):
+        project.current_amount += amount
+        project.add_backer(backer)
+        if timestamp:
+            day = timestamp[:10]
+            self.raised_by_day[day] = self.raised_by_day.get(day, 0.0) + amount
+        if self.leaderboards is not None:
+            self.leaderboards.donated(project, project.backers[-1], amount)
+
+    def close(self, project):
+        project.closed = True
+        self.open_by_id.pop(project.project_id, None)
+
+    # close the open projects whose end date is before today. entries of deleted, closed or
+    # moved projects are dropped from the heap on the way. the caller holds the file lock (not the
+    # data lock) and has caught up with the journal, the projects closed here are journaled with a single write
+    def close_due(self, today=None):
+        today = today or datetime.date.today().isoformat()
+        due = []
+        with data_lock:
+            while self.deadlines and self.deadlines[0][0] < today:
+                end_date, project_id = heapq.heappop(self.deadlines)
+                project = self.open_by_id.get(project_id)
+                if project is not None and project.end_date == end_date:
+                    due.append(project)
+        if due:
+            self.commit([{'op': 'close', 'project_id': project.project_id} for project in due])
+            with data_lock:
+                for project in due:
+                    self.close(project)
+        return due
+
+    # close the projects that reached their end date and return them. usually nothing is due and
+    # only the top of the heap is looked at, without taking the file lock
+    def close_expired(self, today=None):
+        today = today or datetime.date.today().isoformat()
+        self.load()
+        with data_lock:
+            if not self.deadlines or self.deadlines[0][0] >= today:
                 return []
-            # If not empty, rewind the file and load the data
-            file.seek(0)
-            projects_data = json.load(file)
-        projects = [Project(**project_data) for project_data in projects_data]
-    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        with file_lock:
+            self.load()
+            due = self.close_due(today)
+        self.compact_if_long()
+        return due
+
+    # the open projects, in creation order
+    def open_projects(self):
+        self.close_expired()
+        with data_lock:
+            return list(self.open_by_id.values())
+
+    # append entries to the journal with a single write flushed to the disk by a single fsync.
+    # the caller holds the file lock and has caught up with the journal, so the sequence
+    # numbers continue those of every other process. the caller does not hold the data lock:
+    # the lines are written under it, the fsync runs without it so readers don't wait for the disk.
+    # the journal offset already points past the new lines, readers don't apply them meanwhile,
+    # the caller applies the entries in memory once they are on the disk
+    def commit(self, entries):
+        with data_lock:
+            lines = []
+            for entry in entries:
+                self.journal_seq += 1
+                lines.append(json.dumps({'seq': self.journal_seq, **entry}) + '\n')
+            data = ''.join(lines).encode()
+            file = open(self.journal_file, 'ab+')
+            try:
+                file.seek(0, os.SEEK_END)
+                if file.tell() > 0:
+                    # a line cut short by a crash must not swallow the first new line
+                    file.seek(-1, os.SEEK_END)
+                    if file.read(1) != b'\n':
+                        data = b'\n' + data
+                file.write(data)
+                file.flush()
+                self.journal_offset = file.tell()
+                self.journal_inode = os.fstat(file.fileno()).st_ino
+                self.journal_entries += len(entries)
+            except BaseException:
+                file.close()
+                raise
+        with file:
+            os.fsync(file.fileno())
+        metrics.count('bytes_written', len(data))
+
+    # compact the journal into the projects file once it gets long. called after the entries are
+    # applied in memory and the locks are released: without the saver thread the compaction runs
+    # right away, and a file with the journal_seq of entries it doesn't include would lose them
+    def compact_if_long(self):
+        if self.journal_entries >= COMPACT_EVERY:
+            saver.mark_dirty(self)
+
+    def add(self, project):
+        self.add_many([project])
+
+    # add projects with a single journal write, a project without a free id gets the next one
+    def add_many(self, projects):
+        with file_lock:
+            with data_lock:
+                self.load()
+                next_id = self.next_id
+                taken = set()
+                for project in projects:
+                    if project.project_id is None or project.project_id in self.by_id or project.project_id in taken:
+                        project.project_id = next_id
+                    taken.add(project.project_id)
+                    next_id = max(next_id, project.project_id + 1)
+            self.commit([{'op': 'create', 'project': project.to_dict()} for project in projects])
+            with data_lock:
+                for project in projects:
+                    self.insert(project)
+        self.compact_if_long()
+
+    # optimistic version check: the edit is refused if the project changed since the user
+    # read it at base_version, instead of silently overwriting the other change
+    def update(self, project, changes, base_version):
+        with file_lock:
+            with data_lock:
+                self.load()
+                current = self.by_id.get(project.project_id)
+                if current is None:
+                    raise ConflictError("This project was deleted by someone else.")
+                if current.version != base_version:
+                    raise ConflictError("This project was changed by someone else while you were editing it, "
+                                        "please try again.")
+            self.commit([{'op': 'update', 'project_id': project.project_id, 'version': base_version + 1,
+                          'changes': changes}])
+            with data_lock:
+                self.change(current, changes, base_version + 1)
+                if project is not current:
+                    # the caller's copy is from before a reload, it isn't in the indexes: only its
+                    # fields are brought up to date, the indexes would take its old totals for current
+                    for field, value in changes.items():
+                        setattr(project, field, value)
+                    project.version = base_version + 1
+        self.compact_if_long()
+
+    def remove(self, project):
+        with file_lock:
+            with data_lock:
+                self.load()
+                current = self.by_id.get(project.project_id)
+                if current is None:
+                    raise ConflictError("This project was deleted by someone else.")
+            self.commit([{'op': 'delete', 'project_id': project.project_id}])
+            with data_lock:
+                self.delete(current)
+        self.compact_if_long()
+
+    # the file remembers the last journal entry it includes and the daily donation totals,
+    # called while serializing under the data lock
+    def file_header(self):
+        return {'journal_seq': self.journal_seq, 'raised_by_day': self.raised_by_day}
+
+    # compact the journal into projects.json. the file is written outside of the locks, so
+    # changes can still be journaled meanwhile, those lines stay in the journal afterwards.
+    # the files are then replaced under the file lock only, readers don't wait for the fsyncs.
+    # a list given as items replaces every project, and the whole journal with them
+    def save(self, items=None):
+        users_repository.save_if_dirty()
+        with file_lock, data_lock:
+            self.load()
+            if items is not None and items is not self.items:
+                self.items = items
+                self.build_indexes()
+            chunks = self.serialize(self.items)
+            compacted_offset = self.journal_offset
+            signature = self.signature
+            journal_inode = self.journal_inode
+            self.unsaved = False
+        temp_name = write_temp_file(self.file_name, chunks)
+        with file_lock:
+            try:
+                current_inode = os.stat(self.journal_file).st_ino
+            except FileNotFoundError:
+                current_inode = None
+            if self.file_signature() != signature or current_inode != journal_inode:
+                # another process compacted the journal first, its file is just as new
+                os.remove(temp_name)
+                return
+            replace_file(temp_name, self.file_name)
+            try:
+                with open(self.journal_file, 'rb') as file:
+                    file.seek(compacted_offset)
+                    tail = file.read()
+            except FileNotFoundError:
+                tail = b''
+            write_atomically(self.journal_file, [tail], 'wb')
+            with data_lock:
+                # a reader that came by meanwhile has seen the new files and read them again,
+                # its state is up to date (or is read once more on the next load)
+                if self.signature == signature and self.journal_inode == journal_inode:
+                    self.signature = self.file_signature()
+                    self.journal_inode = os.stat(self.journal_file).st_ino
+                    self.journal_offset -= compacted_offset
+                    self.journal_entries = tail[:self.journal_offset].count(b'\n')
+
+    # record one donation as a single journal line, the cost does not depend on how many projects
+    # there are. donations made at the same time by other threads share the write and the fsync
+    def donate(self, project, backer, amount):
+        self.donations.submit(PendingDonation(project.project_id, backer, amount))
+
+    # write a group of donations, refusing the ones to projects that were closed or deleted meanwhile,
+    # or that reached their end date since they were listed
+    def commit_donations(self, donations):
+        with file_lock:
+            self.load()
+            self.close_due()
+            with data_lock:
+                accepted = []
+                for donation in donations:
+                    project = self.by_id.get(donation.project_id)
+                    if project is None or project.closed:
+                        donation.error = ConflictError("This project was closed or deleted, "
+                                                       "the donation was not made.")
+                    else:
+                        accepted.append(donation)
+                entries = [donation.to_dict() for donation in accepted]
+            if entries:
+                self.commit(entries)
+                with data_lock:
+                    for entry in entries:
+                        self.record_donation(self.by_id[entry['project_id']], entry['backer'], entry['amount'],
+                                             entry['timestamp'])
+        self.compact_if_long()
+
+
+users_repository = UserRepository(USERS_FILE, User, 'users')
+projects_repository = ProjectRepository(PROJECTS_FILE, Project, 'projects', JOURNAL_FILE)
+
+
+# background thread that writes the changed repositories (write-behind). changes are collected
+# and written together every FLUSH_INTERVAL seconds, or as soon as FLUSH_THRESHOLD changes are
+# waiting, so the menu actions don't wait for the slow rewrites of whole files. when the thread is
+# not running (the module is used by another script) every change is written right away, as before.
+# it only writes what is safe to write late, the compaction of the journal. the changes
+# themselves wait for the disk, on purpose, since several processes share the files: a project
+# change waits for one append to the journal and its fsync, and a registration or a new password hash
+# waits for users.json to be rewritten (see UserRepository.register_many)
+class WriteBehindSaver:
+    def __init__(self, interval=FLUSH_INTERVAL, threshold=FLUSH_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.condition = threading.Condition()
+        self.changes = {}  # repository -> number of changes not written yet
+        self.thread = None
+        self.stopping = False
+
+    def start(self):
+        self.stopping = False
+        self.thread = threading.Thread(target=self.run, name='write-behind-saver', daemon=True)
+        self.thread.start()
+
+    # a repository was changed in memory and has to be written
+    def mark_dirty(self, repository):
+        repository.unsaved = True
+        if self.thread is None:
+            self.write([repository])
+            return
+        with self.condition:
+            self.changes[repository] = self.changes.get(repository, 0) + 1
+            if sum(self.changes.values()) >= self.threshold:
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.stopping or sum(self.changes.values()) >= self.threshold, self.interval)
+                repositories = list(self.changes)
+                self.changes = {}
+                stopping = self.stopping
+            self.write(repositories)
+            if stopping:
+                return
+
+    # users are written first because projects refer to user ids
+    def write(self, repositories):
+        for repository in sorted(repositories, key=lambda repository: repository is not users_repository):
+            try:
+                # the cached list is taken under the lock, it may be reloaded until then
+                with metrics.measure(f'save {repository.file_name}'):
+                    repository.save()
+            except OSError as error:
+                print(f"Could not save {repository.file_name}: {error}")
+                if self.thread is not None:
+                    with self.condition:
+                        self.changes[repository] = self.changes.get(repository, 0) + 1
+
+    # write everything that is waiting and stop the thread, main() calls this on exit
+    def stop(self):
+        if self.thread is None:
+            return
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.thread.join()
+        self.thread = None
+
+
+saver = WriteBehindSaver()
+
+
+# storage backend that keeps users and projects in the JSON files.
+# every backend offers the same methods, so the menu actions don't care where the data lives.
+# several processes can use the same files at once, see ProjectRepository.
+class JsonStorage:
+    def load_users(self):
+        return users_repository.load()
+
+    def load_projects(self):
+        return projects_repository.load()
+
+    def save_users(self, users):
+        users_repository.save(users)
+
+    def save_projects(self, projects):
+        projects_repository.save(projects)
+
+    def find_user(self, email):
+        return users_repository.find_by_email(email)
+
+    # raises ConflictError if another process registered the email first
+    def add_user(self, user):
+        users_repository.register(user)
+
+    def set_password(self, user, password_hash):
+        users_repository.set_password(user, password_hash)
+
+    # project changes are journaled right away, the saver compacts the journal later
+    def add_project(self, project):
+        projects_repository.add(project)
+
+    # raises ConflictError if the project changed after it was read at base_version
+    def update_project(self, project, changes, base_version):
+        projects_repository.update(project, changes, base_version)
+
+    def delete_project(self, project):
+        projects_repository.remove(project)
+
+    # the project with this id, or None
+    def find_project(self, project_id):
+        with data_lock:
+            projects_repository.load()
+            return projects_repository.by_id.get(project_id)
+
+    def projects_by_creator(self, email):
+        return projects_repository.find_by_creator(email)
+
+    # kept up to date by the repository instead of filtering every project
+    def open_projects(self):
+        return projects_repository.open_projects()
+
+    # close the projects whose end date has passed, returns them
+    def close_expired(self):
+        return projects_repository.close_expired()
+
+    # leaderboards, read from structures kept up to date by every change
+    def top_funded(self, k):
+        return projects_repository.top_funded(k)
+
+    def top_backed(self, k):
+        return projects_repository.top_backed(k)
+
+    def top_creators(self, k):
+        return projects_repository.top_creators(k)
+
+    def creator_total(self, email):
+        return projects_repository.creator_total(email)
+
+    def raised_on(self, date):
+        return projects_repository.raised_on(date)
+
+    # 'YYYY-MM-DD' -> amount donated that day, for every day with donations
+    def daily_totals(self):
+        projects_repository.load()
+        with data_lock:
+            return dict(projects_repository.raised_by_day)
+
+    # the projects of one page in a SORT_ORDERS order, and the number of projects
+    # the list is sorted under the data lock, the writers change it
+    def projects_page(self, sort, offset, limit):
+        with data_lock:
+            projects = projects_repository.load()
+            if sort == 'end_date':
+                return projects_repository.page_by_end_date(offset, limit), len(projects)
+            return page_of(projects, sort, offset, limit), len(projects)
+
+    def search_title(self, text):
+        return projects_repository.search(text)
+
+    def search_start_date(self, date):
+        return projects_repository.started_between(date, date)
+
+    def search_started_between(self, first, last):
+        return projects_repository.started_between(first, last)
+
+    def search_ending_between(self, first, last):
+        return projects_repository.ending_between(first, last)
+
+    def search_active_on(self, date):
+        return projects_repository.active_on(date)
+
+    def donate(self, project, backer, amount):
+        projects_repository.donate(project, backer, amount)
+
+    # the case-folded emails among these that belong to registered users
+    def registered_emails(self, emails):
+        with data_lock:
+            users_repository.load()
+            return {email.casefold() for email in emails if email.casefold() in users_repository.by_email}
+
+    # bulk changes for the importer, each list is written at once.
+    # returns the users refused because their email is already registered
+    def add_users(self, users):
+        return users_repository.register_many(users)
+
+    def add_projects(self, projects):
+        projects_repository.add_many(projects)
+
+    # the donations refused because the project is closed or deleted get .error set
+    def add_donations(self, donations):
+        projects_repository.commit_donations(donations)
+
+    # records for the exporter, one at a time
+    def export_users(self):
+        for user in users_repository.load():
+            yield user.to_dict()
+
+    def export_projects(self):
+        for project in projects_repository.load():
+            yield project_record(project)
+
+    # the amounts of single donations are added up into the project totals when the journal is
+    # compacted, only the backers are kept: rows without amounts couldn't be imported again
+    def export_donations(self):
+        raise ValueError("The JSON storage only keeps the donation totals of each project, not the single "
+                         "donations. Export the projects (with their totals) instead, or use the SQLite storage.")
+
+
+# the projects for which match(project) is true, read again from the files on every pass by
+# ProjectRepository.stream(). the console pages through it like through a list: len() counts
+# the projects once until the files change, and bool() stops at the first one
+class ProjectStream:
+    def __init__(self, match=None):
+        self.match = match
+        self.count = None
+        self.signature = None
+
+    def __iter__(self):
+        for project in projects_repository.stream():
+            if self.match is None or self.match(project):
+                yield project
+
+    def __len__(self):
+        signature = projects_repository.stream_signature()
+        if self.count is None or signature != self.signature:
+            self.count = sum(1 for _ in self)
+            self.signature = signature
+        return self.count
+
+    def __bool__(self):
+        return any(True for _ in self)
+
+
+# JSON storage for projects.json files too big for memory (console --stream): viewing and
+# searching read the projects from the files again for every page instead of keeping them.
+# titles are matched without the search index, so results come in file order. changes load
+# every project, like with JsonStorage
+class StreamingStorage(JsonStorage):
+    def __init__(self):
+        self.all_projects = ProjectStream()
+
+    def projects_page(self, sort, offset, limit):
+        return page_of(self.all_projects, sort, offset, limit), len(self.all_projects)
+
+    # projects containing every word of the text in the title or details
+    def search_title(self, text):
+        tokens = text.lower().split()
+
+        def match(project):
+            title = project.title.lower()
+            details = (project.details or '').lower()
+            return all(token in title or token in details for token in tokens)
+
+        return ProjectStream(match)
+
+    def search_start_date(self, date):
+        return ProjectStream(lambda project: project.start_date == date)
+
+    def search_started_between(self, first, last):
+        return ProjectStream(lambda project: first <= project.start_date <= last)
+
+    def search_ending_between(self, first, last):
+        return ProjectStream(lambda project: first <= project.end_date <= last)
+
+    def search_active_on(self, date):
+        return ProjectStream(lambda project: project.start_date <= date <= project.end_date)
+
+    def export_projects(self):
+        for project in projects_repository.stream():
+            yield project_record(project)
+
+
+# storage backend that keeps users, projects and donations in a local SQLite database.
+# lookups use the indexes on email, creator and dates, and changes are single-row updates.
+class SqliteStorage:
+    # ORDER BY clauses of the SORT_ORDERS, the project id keeps the pages stable
+    ORDER_BY = {
+        'listed': 'project_id',
+        'title': 'title COLLATE NOCASE, project_id',
+        'end_date': 'end_date, project_id',
+        'funded': 'current_amount / target_amount DESC, project_id',
+        'raised': 'current_amount DESC, project_id'
+    }
+
+    def __init__(self, database_file=DATABASE_FILE):
+        # the group committer writes from whichever thread is committing, one at a time
+        self.connection = sqlite3.connect(database_file, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.create_tables()
+        self.title_index = None
+        self.data_version = None
+        self.donations = GroupCommitter(self.commit_donations)
+
+    def create_tables(self):
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    first_name TEXT,
+                    last_name TEXT,
+                    email TEXT NOT NULL UNIQUE COLLATE NOCASE,
+                    password TEXT,
+                    mobile_phone TEXT
+                );
+                CREATE TABLE IF NOT EXISTS projects (
+                    project_id INTEGER PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    details TEXT,
+                    target_amount REAL NOT NULL,
+                    start_date TEXT NOT NULL,
+                    end_date TEXT NOT NULL,
+                    creator TEXT NOT NULL COLLATE NOCASE,
+                    current_amount REAL NOT NULL DEFAULT 0,
+                    closed INTEGER NOT NULL DEFAULT 0,
+                    version INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS projects_creator ON projects (creator);
+                CREATE INDEX IF NOT EXISTS projects_start_date ON projects (start_date);
+                CREATE INDEX IF NOT EXISTS projects_end_date ON projects (end_date);
+                CREATE INDEX IF NOT EXISTS projects_open ON projects (end_date) WHERE closed = 0;
+                CREATE INDEX IF NOT EXISTS projects_funded ON projects (current_amount / target_amount);
+                CREATE TABLE IF NOT EXISTS donations (
+                    donation_id INTEGER PRIMARY KEY,
+                    project_id INTEGER NOT NULL REFERENCES projects (project_id) ON DELETE CASCADE,
+                    backer TEXT NOT NULL,
+                    amount REAL,
+                    timestamp TEXT
+                );
+                CREATE INDEX IF NOT EXISTS donations_project ON donations (project_id);
+                CREATE INDEX IF NOT EXISTS donations_timestamp ON donations (timestamp);
+            """)
+            # databases created before projects had a version
+            columns = [row['name'] for row in self.connection.execute('PRAGMA table_info(projects)')]
+            if 'version' not in columns:
+                self.connection.execute('ALTER TABLE projects ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+
+    def row_to_user(self, row):
+        return User(row['first_name'], row['last_name'], row['email'], row['password'], row['mobile_phone'])
+
+    # build Project objects from project rows, then attach the backers
+    def rows_to_projects(self, rows):
         projects = []
+        for row in rows:
+            projects.append(Project(row['title'], row['details'], row['target_amount'], row['start_date'],
+                                    row['end_date'], row['creator'], row['current_amount'], [],
+                                    bool(row['closed']), row['project_id'], row['version']))
+
+        metrics.count('objects_built', len(projects))
+        by_id = {project.project_id: project for project in projects}
+        ids = list(by_id)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            for row in self.connection.execute(
+                    f'SELECT project_id, backer FROM donations WHERE project_id IN ({placeholders}) '
+                    'ORDER BY donation_id', chunk):
+                by_id[row['project_id']].add_backer(row['backer'])
+        return projects
+
+    def select_projects(self, where='', params=()):
+        rows = self.connection.execute(
+            f'SELECT * FROM projects {where} ORDER BY projects.project_id', params).fetchall()
+        return self.rows_to_projects(rows)
+
+    def load_users(self):
+        rows = self.connection.execute('SELECT * FROM users ORDER BY user_id')
+        return [self.row_to_user(row) for row in rows]
+
+    def load_projects(self):
+        return self.select_projects()
+
+    def save_users(self, users):
+        with self.connection:
+            self.connection.execute('DELETE FROM users')
+            self.insert_users(users)
+
+    def save_projects(self, projects):
+        with self.connection:
+            self.connection.execute('DELETE FROM projects')
+            self.title_index = None
+            self.insert_projects(projects)
+
+    def insert_users(self, users):
+        self.connection.executemany(
+            'INSERT OR IGNORE INTO users (first_name, last_name, email, password, mobile_phone) '
+            'VALUES (?, ?, ?, ?, ?)',
+            ((user.first_name, user.last_name, user.email, user.password, user.mobile_phone) for user in users))
+
+    def insert_projects(self, projects):
+        for project in projects:
+            self.insert_project(project)
+            # amounts of donations made before the database existed are unknown
+            self.connection.executemany(
+                'INSERT INTO donations (project_id, backer) VALUES (?, ?)',
+                ((project.project_id, backer) for backer in project.backer_emails()))
+
+    def insert_project(self, project):
+        cursor = self.connection.execute(
+            'INSERT INTO projects (project_id, title, details, target_amount, start_date, end_date, creator, '
+            'current_amount, closed, version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (project.project_id, project.title, project.details, project.target_amount, project.start_date,
+             project.end_date, project.creator, project.current_amount, int(project.closed), project.version))
+        project.project_id = cursor.lastrowid
+        if self.title_index is not None:
+            self.title_index.add(project.project_id, project.title, project.details)
+
+    # the search index is built on the first search and rebuilt when another
+    # connection has changed the database since (PRAGMA data_version)
+    def search_index(self):
+        data_version = self.connection.execute('PRAGMA data_version').fetchone()[0]
+        if self.title_index is None or data_version != self.data_version:
+            self.title_index = TitleIndex()
+            for row in self.connection.execute('SELECT project_id, title, details FROM projects'):
+                self.title_index.add(row['project_id'], row['title'], row['details'])
+            self.data_version = data_version
+        return self.title_index
+
+    def find_user(self, email):
+        row = self.connection.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+        return self.row_to_user(row) if row is not None else None
+
+    # the UNIQUE email column refuses an email another process registered first
+    def add_user(self, user):
+        try:
+            with self.connection:
+                self.connection.execute(
+                    'INSERT INTO users (first_name, last_name, email, password, mobile_phone) VALUES (?, ?, ?, ?, ?)',
+                    (user.first_name, user.last_name, user.email, user.password, user.mobile_phone))
+        except sqlite3.IntegrityError:
+            raise ConflictError(f"Email '{user.email}' is already registered.")
+
+    def set_password(self, user, password_hash):
+        with self.connection:
+            self.connection.execute('UPDATE users SET password = ? WHERE email = ?', (password_hash, user.email))
+        user.password = password_hash
+
+    def add_project(self, project):
+        with self.connection:
+            self.insert_project(project)
+
+    # optimistic version check: the row is only changed if its version is still base_version
+    def update_project(self, project, changes, base_version):
+        assignments = ''.join(f'{field} = ?, ' for field in changes)
+        with self.connection:
+            cursor = self.connection.execute(
+                f'UPDATE projects SET {assignments}version = version + 1 WHERE project_id = ? AND version = ?',
+                (*changes.values(), project.project_id, base_version))
+        if cursor.rowcount == 0:
+            raise ConflictError("This project was changed or deleted by someone else while you were editing it, "
+                                "please try again.")
+        for field, value in changes.items():
+            setattr(project, field, value)
+        project.version = base_version + 1
+        if self.title_index is not None:
+            self.title_index.update(project.project_id, project.title, project.details)
+
+    def delete_project(self, project):
+        with self.connection:
+            cursor = self.connection.execute('DELETE FROM projects WHERE project_id = ?', (project.project_id,))
+        if cursor.rowcount == 0:
+            raise ConflictError("This project was deleted by someone else.")
+        if self.title_index is not None:
+            self.title_index.remove(project.project_id)
+
+    def find_project(self, project_id):
+        projects = self.select_projects('WHERE projects.project_id = ?', (project_id,))
+        return projects[0] if projects else None
+
+    def projects_by_creator(self, email):
+        return self.select_projects('WHERE projects.creator = ?', (email,))
+
+    # the partial index on the open projects serves this and close_expired()
+    def open_projects(self):
+        self.close_expired()
+        return self.select_projects('WHERE projects.closed = 0')
+
+    def close_expired(self):
+        today = datetime.date.today().isoformat()
+        with self.connection:
+            due = self.select_projects('WHERE projects.closed = 0 AND projects.end_date < ?', (today,))
+            self.connection.execute('UPDATE projects SET closed = 1 WHERE closed = 0 AND end_date < ?', (today,))
+        for project in due:
+            project.closed = True
+        return due
+
+    # the leaderboards are queries: the share funded and the daily totals are read from indexes,
+    # the backers and the creator totals are grouped when they are asked for
+    def top_funded(self, k):
+        return self.select_projects_by_ids([row[0] for row in self.connection.execute(
+            'SELECT project_id FROM projects ORDER BY current_amount / target_amount DESC LIMIT ?', (k,))])
+
+    def top_backed(self, k):
+        rows = self.connection.execute(
+            'SELECT project_id, COUNT(DISTINCT backer) AS backers FROM donations '
+            'GROUP BY project_id ORDER BY backers DESC, project_id LIMIT ?', (k,)).fetchall()
+        projects = self.select_projects_by_ids([row['project_id'] for row in rows])
+        return list(zip(projects, [row['backers'] for row in rows]))
+
+    def top_creators(self, k):
+        rows = self.connection.execute(
+            'SELECT creator, SUM(current_amount) AS total FROM projects '
+            'GROUP BY creator ORDER BY total DESC, creator LIMIT ?', (k,))
+        return [(row['creator'], row['total']) for row in rows]
+
+    def creator_total(self, email):
+        return self.connection.execute(
+            'SELECT COALESCE(SUM(current_amount), 0.0) FROM projects WHERE creator = ?', (email,)).fetchone()[0]
+
+    def raised_on(self, date):
+        next_day = (datetime.date.fromisoformat(date) + datetime.timedelta(days=1)).isoformat()
+        return self.connection.execute(
+            'SELECT COALESCE(SUM(amount), 0.0) FROM donations WHERE timestamp >= ? AND timestamp < ?',
+            (date, next_day)).fetchone()[0]
+
+    def daily_totals(self):
+        rows = self.connection.execute(
+            'SELECT substr(timestamp, 1, 10) AS day, SUM(amount) FROM donations '
+            'WHERE timestamp IS NOT NULL AND amount IS NOT NULL GROUP BY day')
+        return {row[0]: row[1] for row in rows}
+
+    # only the rows of the page are read, the end date order uses the end_date index
+    def projects_page(self, sort, offset, limit):
+        total = self.connection.execute('SELECT COUNT(*) FROM projects').fetchone()[0]
+        rows = self.connection.execute(
+            f'SELECT * FROM projects ORDER BY {self.ORDER_BY[sort]} LIMIT ? OFFSET ?', (limit, offset)).fetchall()
+        return self.rows_to_projects(rows), total
+
+    # the ids come ranked from the search index, the rows are then fetched by primary key
+    def search_title(self, text):
+        return self.select_projects_by_ids(self.search_index().search(text))
+
+    # the projects with these ids, in the same order
+    def select_projects_by_ids(self, ids):
+        by_id = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            for project in self.select_projects(f'WHERE projects.project_id IN ({placeholders})', chunk):
+                by_id[project.project_id] = project
+        return [by_id[project_id] for project_id in ids if project_id in by_id]
+
+    def search_start_date(self, date):
+        return self.select_projects('WHERE projects.start_date = ?', (date,))
+
+    # date range queries run on the start_date and end_date indexes
+    def search_started_between(self, first, last):
+        return self.select_projects('WHERE projects.start_date BETWEEN ? AND ?', (first, last))
+
+    def search_ending_between(self, first, last):
+        return self.select_projects('WHERE projects.end_date BETWEEN ? AND ?', (first, last))
+
+    def search_active_on(self, date):
+        return self.select_projects('WHERE projects.start_date <= ? AND projects.end_date >= ?', (date, date))
+
+    # donation rows and single-row updates of the project totals, with the donations
+    # made at the same time by other threads in the same transaction
+    def donate(self, project, backer, amount):
+        self.donations.submit(PendingDonation(project.project_id, backer, amount))
+        project.current_amount += amount
+        project.add_backer(backer)
+
+    # projects that reached their end date since they were listed take no more donations
+    def commit_donations(self, donations):
+        today = datetime.date.today().isoformat()
+        with self.connection:
+            for donation in donations:
+                cursor = self.connection.execute(
+                    'UPDATE projects SET current_amount = current_amount + ? '
+                    'WHERE project_id = ? AND closed = 0 AND end_date >= ?',
+                    (donation.amount, donation.project_id, today))
+                if cursor.rowcount == 0:
+                    donation.error = ConflictError("This project was closed or deleted, the donation was not made.")
+                    continue
+                self.connection.execute(
+                    'INSERT INTO donations (project_id, backer, amount, timestamp) VALUES (?, ?, ?, ?)',
+                    (donation.project_id, donation.backer, donation.amount,
+                     donation.timestamp or datetime.datetime.now().isoformat(timespec='seconds')))
+
+    # the case-folded emails among these that belong to registered users, 500 per query
+    def registered_emails(self, emails):
+        emails = list(emails)
+        registered = set()
+        for start in range(0, len(emails), 500):
+            chunk = emails[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            for row in self.connection.execute(f'SELECT email FROM users WHERE email IN ({placeholders})', chunk):
+                registered.add(row['email'].casefold())
+        return registered
+
+    # bulk changes for the importer, each list in one transaction
+    def add_users(self, users):
+        refused = []
+        with self.connection:
+            for user in users:
+                cursor = self.connection.execute(
+                    'INSERT OR IGNORE INTO users (first_name, last_name, email, password, mobile_phone) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (user.first_name, user.last_name, user.email, user.password, user.mobile_phone))
+                if cursor.rowcount == 0:
+                    refused.append(user)
+        return refused
+
+    def add_projects(self, projects):
+        with self.connection:
+            for project in projects:
+                self.insert_project(project)
+
+    def add_donations(self, donations):
+        self.commit_donations(donations)
+
+    # records for the exporter, read from the cursor one row at a time
+    def export_users(self):
+        for row in self.connection.execute(
+                'SELECT user_id, first_name, last_name, email, password, mobile_phone FROM users ORDER BY user_id'):
+            yield dict(row)
+
+    def export_projects(self):
+        for row in self.connection.execute(
+                'SELECT project_id, title, details, target_amount, start_date, end_date, creator, current_amount, '
+                'closed FROM projects ORDER BY project_id'):
+            record = dict(row)
+            record['closed'] = bool(record['closed'])
+            yield record
+
+    def export_donations(self):
+        for row in self.connection.execute(
+                'SELECT project_id, backer, amount, timestamp FROM donations ORDER BY donation_id'):
+            yield dict(row)
+
+
+# users as columns, one list per attribute, for the binary snapshot
+def user_columns(users):
+    return {
+        'first_name': [user.first_name for user in users],
+        'last_name': [user.last_name for user in users],
+        'email': [user.email for user in users],
+        'password': [user.password for user in users],
+        'mobile_phone': [user.mobile_phone for user in users],
+        'user_id': array('q', (user.user_id for user in users))
+    }
+
+
+def users_from_columns(columns):
+    users = []
+    for first_name, last_name, email, password, mobile_phone, user_id in zip(
+            columns['first_name'], columns['last_name'], columns['email'], columns['password'],
+            columns['mobile_phone'], columns['user_id']):
+        user = User.__new__(User)
+        user.first_name = first_name
+        user.last_name = last_name
+        user.email = email
+        user.password = password
+        user.mobile_phone = mobile_phone
+        user.user_id = user_id
+        users.append(user)
+    return users
+
+
+# projects as columns for the binary snapshot. numbers go into arrays, and the backers of
+# every project are stored in one array with the offset where each project's backers end
+def project_columns(projects):
+    backers = array('i')
+    backer_ends = array('q')
+    for project in projects:
+        backers.extend(project.backers)
+        backer_ends.append(len(backers))
+    return {
+        'title': [project.title for project in projects],
+        'details': [project.details for project in projects],
+        'target_amount': array('d', (project.target_amount for project in projects)),
+        'start_date': [project.start_date for project in projects],
+        'end_date': [project.end_date for project in projects],
+        'creator_id': array('i', (project.creator_id for project in projects)),
+        'current_amount': array('d', (project.current_amount for project in projects)),
+        'backers': backers,
+        'backer_ends': backer_ends,
+        'closed': bytes(project.closed for project in projects),
+        'project_id': array('q', (project.project_id for project in projects)),
+        'version': array('q', (project.version for project in projects))
+    }
+
+
+# the objects are created without calling __init__, the columns already hold the final values
+def projects_from_columns(columns):
+    projects = []
+    backers = columns['backers']
+    backer_start = 0
+    for title, details, target_amount, start_date, end_date, creator_id, current_amount, backer_end, closed, \
+            project_id, version in zip(columns['title'], columns['details'], columns['target_amount'],
+                                       columns['start_date'], columns['end_date'], columns['creator_id'],
+                                       columns['current_amount'], columns['backer_ends'], columns['closed'],
+                                       columns['project_id'], columns['version']):
+        project = Project.__new__(Project)
+        project.title = title
+        project.details = details
+        project.target_amount = target_amount
+        project.start_date = start_date
+        project.end_date = end_date
+        project.creator_id = creator_id
+        project.current_amount = current_amount
+        project.backers = backers[backer_start:backer_end]
+        project.closed = closed == 1
+        project.project_id = project_id
+        project.version = version
+        projects.append(project)
+        backer_start = backer_end
     return projects
 
 
+# write the users and projects of the JSON backend as a binary snapshot, read back much faster
+# than the JSON files at startup. the file is a SNAPSHOT_HEADER followed by two pickles: small
+# metadata (the signatures of the JSON files the snapshot was made from) and the data, stored
+# column by column so loading is mostly copying arrays instead of parsing text.
+# the JSON files stay the real data and the format used to exchange it, the snapshot is only a cache.
+@instrumented
+def save_snapshot(file_name=SNAPSHOT_FILE):
+    with data_lock:
+        users = users_repository.load()
+        projects = projects_repository.load()
+        # the journal lines after journal_offset are replayed after loading the snapshot
+        metadata = pickle.dumps({
+            'users_signature': users_repository.signature,
+            'projects_signature': projects_repository.signature,
+            'journal_inode': projects_repository.journal_inode
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+        data = pickle.dumps({
+            'user_ids': (user_ids.emails, user_ids.next_id),
+            'users': user_columns(users),
+            'projects': project_columns(projects),
+            'journal_offset': projects_repository.journal_offset,
+            'journal_entries': projects_repository.journal_entries,
+            'journal_seq': projects_repository.journal_seq,
+            'raised_by_day': projects_repository.raised_by_day
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+    checksum = hashlib.sha256(metadata + data).digest()
+
+    # a crash never leaves half a snapshot
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, checksum, len(metadata))
+    write_atomically(file_name, [header, metadata, data], 'wb')
+
+
+# load the binary snapshot into the JSON backend if it was made from the current JSON files.
+# returns False (and nothing is loaded) when the snapshot is missing, damaged, from another
+# snapshot version or older than the JSON files. only load snapshots written by this program,
+# pickle data can run code when it is loaded.
+@instrumented
+def load_snapshot(file_name=SNAPSHOT_FILE):
+    try:
+        with open(file_name, 'rb') as file:
+            content = file.read()
+    except FileNotFoundError:
+        return False
+    metrics.count('bytes_read', len(content))
+    if len(content) < SNAPSHOT_HEADER.size:
+        return False
+    magic, version, checksum, metadata_length = SNAPSHOT_HEADER.unpack_from(content)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        return False
+
+    # nothing is unpickled before the checksum shows the snapshot is whole
+    payload = memoryview(content)[SNAPSHOT_HEADER.size:]
+    if hashlib.sha256(payload).digest() != checksum:
+        return False
+    try:
+        metadata = pickle.loads(payload[:metadata_length])
+    except (pickle.UnpicklingError, EOFError, ValueError):
+        return False
+    try:
+        journal_inode = os.stat(projects_repository.journal_file).st_ino
+    except FileNotFoundError:
+        journal_inode = None
+    if (metadata['users_signature'] != users_repository.file_signature()
+            or metadata['projects_signature'] != projects_repository.file_signature()
+            or metadata['journal_inode'] != journal_inode):
+        return False  # the JSON files were changed (or the journal compacted) after the snapshot was written
+
+    # the garbage collector would scan the growing heap again and again while
+    # hundreds of thousands of objects are created, none of them can be garbage yet
+    gc.disable()
+    try:
+        try:
+            data = pickle.loads(payload[metadata_length:])
+        except (pickle.UnpicklingError, EOFError, ValueError):
+            return False
+        user_ids.emails, user_ids.next_id = data['user_ids']
+        user_ids.ids = {email.casefold(): user_id for user_id, email in user_ids.emails.items()}
+        users_repository.use(users_from_columns(data['users']), metadata['users_signature'])
+        projects_repository.use(projects_from_columns(data['projects']), metadata['projects_signature'])
+        metrics.count('objects_built', len(users_repository.items) + len(projects_repository.items))
+        projects_repository.journal_inode = journal_inode
+        projects_repository.journal_offset = data['journal_offset']
+        projects_repository.journal_entries = data['journal_entries']
+        projects_repository.journal_seq = data['journal_seq']
+        projects_repository.raised_by_day = data['raised_by_day']
+    finally:
+        gc.enable()
+    return True
+
+
+# the backend used by the menu actions, JSON files unless main() is told otherwise
+storage = JsonStorage()
+
+
+# choose the storage backend used by the menu actions
+def use_storage(backend):
+    global storage
+    storage = backend
+
+
+# one-shot copy of users.json, projects.json and the change journal into a SQLite database
+def migrate_json_to_sqlite(database_file=DATABASE_FILE):
+    json_storage = JsonStorage()
+    users = json_storage.load_users()
+    projects = json_storage.load_projects()
+    sqlite_storage = SqliteStorage(database_file)
+    sqlite_storage.save_users(users)
+    sqlite_storage.save_projects(projects)
+    print(f"Migrated {len(users)} users and {len(projects)} projects to {database_file}.")
+    return sqlite_storage
+
+
+# load user data from the storage backend
+@instrumented
+def load_users_from_file():
+    return storage.load_users()
+
+
+# # load project data from the storage backend
+@instrumented
+def load_projects_from_file():
+    return storage.load_projects()
+
+
 # takes an object and returns a serializable version of it.
 def serializer(obj):
-    if isinstance(obj, User):
-        return obj.__dict__
-    elif isinstance(obj, Project):
-        return {
-            "title": obj.title,
-            "details": obj.details,
-            "total_money": obj.total_money,
-            "start_date": obj.start_date,
-            "end_date": obj.end_date,
-            "creator": {
-                "first_name": obj.creator.first_name,
-                "last_name": obj.creator.last_name,
-                "email": obj.creator.email,
-                "password": "no access",
-                "mobile_phone": obj.creator.mobile_phone
-            }
-
-        }
+    if isinstance(obj, (User, Project)):
+        return obj.to_dict()
     raise TypeError("Type not serializable")
 
 
-# We check if the object is an instance of the User class, and if so, we return its __dict__ attribute,
-# which is a dictionary containing all the instance variables. This allows us to serialize a User instance to JSON.
-# dump : convert Python objects (users list) to a JSON formatted string and write it to a file-like object.
-# file : users.json
-# we use a list comprehension to convert each User object to its dictionary representation (user.__dict__) and then use json.dump to write the list of dictionaries to the JSON file.
-# The default=serializer parameter ensures that the custom serialization method is used for each User object encountered during the serialization process.
-# indent=4 : This is an optional parameter that specifies the number of spaces to use for indentation in the resulting JSON file.
-# Adding indentation makes the JSON file more human-readable
+# We check if the object is an instance of the User or Project class, and if so, we return its to_dict(),
+# a dictionary containing the stored attributes (the classes use __slots__, so there is no __dict__).
+# dumps : convert one Python object (a record) to a JSON formatted string that is written to the file.
+# file : users.json or projects.json, a {"version": 2, "users": [...]} object with one record per line.
+# we convert each User object to its dictionary representation (user.to_dict()) and then use json.dumps to write it to the JSON file.
+# The default=serializer parameter ensures that the custom serialization method is used for each object encountered during the serialization process.
+# One record per line keeps the file readable and diff-friendly without the size of indent=4,
+# and projects only store the user id of the creator and backers instead of a copy of their records.
 
 
-# save user data to file
+# save user data to the storage backend
+@instrumented
 def save_users_to_file(users):
     try:
-        users_data = [user.__dict__ for user in users]
-        with open('users.json', 'w') as file:
-            json.dump(users_data, file, default=serializer, indent=4)
+        storage.save_users(users)
 
     except FileNotFoundError:
         return []
 
 
-# save project data to file
+# save project data to the storage backend
+@instrumented
 def save_projects_to_file(projects):
     try:
-        projects_data = [project.__dict__ for project in projects]
-        with open('projects.json', 'w') as file:
-            json.dump(projects_data, file, default=serializer, indent=4)
+        storage.save_projects(projects)
 
     except FileNotFoundError:
         return []
 
 
+# 'YYYY-MM-DD' with the month and day possibly not zero-padded, like strptime("%Y-%m-%d") accepts
+DATE_PATTERN = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})')
+
+
+# a date given as 'YYYY-MM-DD', checked and zero-padded, raises ValueError if it is not a valid date.
+# strptime looks up the locale on every call, the bulk importer parses millions of dates and
+# most of them repeat, so the pattern is checked directly and the results are cached
+@functools.lru_cache(maxsize=4096)
+def parse_date(date_str):
+    match = DATE_PATTERN.fullmatch(date_str)
+    if match is None:
+        raise ValueError(f"time data {date_str!r} does not match format '%Y-%m-%d'")
+    return datetime.date(*map(int, match.groups())).isoformat()
+
+
+# ask for a date until it is valid, returned as a 'YYYY-MM-DD' string.
+# an empty answer returns the default when one is given
+def input_date(prompt, default=None):
+    while True:
+        date_str = input(prompt)
+        if not date_str and default is not None:
+            return default
+        try:
+            return parse_date(date_str)
+        except ValueError:
+            print("Invalid date format. Please use YYYY-MM-DD.")
+
+
+# Egyptian mobile numbers, compiled once instead of on every check (the bulk importer checks millions)
+EGYPTIAN_NUMBER = re.compile(r'^\+20(10|11|12|15)\d{8}$')
+
+
 # check if a mobile phone number is a valid Egyptian number
 def is_valid_egyptian_number(mobile_phone):
-    return re.match(r'^\+20(10|11|12|15)\d{8}$', mobile_phone) is not None
+    return EGYPTIAN_NUMBER.match(mobile_phone) is not None
+
+
+# full name of the project creator, or the email if the creator is not a registered user
+def creator_name(project):
+    user = storage.find_user(project.creator)
+    if user is None:
+        return project.creator
+    return f"{user.first_name} {user.last_name}"
 
 
-# Check if the email is already registered
-def is_email_registered(email, users):
-    return any(user.email == email for user in users)
+# Check if the email is already registered (case insensitive)
+def is_email_registered(email):
+    return storage.find_user(email) is not None
 
 
-# user registration
+# a failed login can go on with a registration and an already registered email with a login.
+# each attempt returns (the logged-in user or None, the next attempt or None), and the attempts
+# follow each other around this loop instead of login and registration calling each other
+def sign_in(attempt):
+    user = None
+    while attempt is not None:
+        user, attempt = attempt()
+    return user
+
+
+# user registration, returns the user if it ends with a login
+@instrumented
 def register_user():
-    print("User Registration")
-    users = load_users_from_file()
+    return sign_in(registration_attempt)
 
-    while True:
-        email = input("Enter your email: ")
-        # ensure that the email is not registered before
-        if not is_email_registered(email, users):
-            first_name = input("Enter your first name: ")
-            last_name = input("Enter your last name: ")
-
-            # password confirmation
-            while True:
-                password = input("Enter your password: ")
-                confirm_password = input("Confirm your password: ")
-
-                if password == confirm_password:
-                    break
-                else:
-                    print("Passwords do not match. Please try again.")
-
-            # ensure a valid Egyptian mobile phone number
-            while True:
-                mobile_phone = input(
-                    "Enter your mobile phone number (+201---------): ")
-                if is_valid_egyptian_number(mobile_phone):
-                    break
-                else:
-                    print(
-                        "Invalid mobile phone number. Please enter a valid Egyptian number.")
-
-            # Continue with user registration if the email is not already registered
-            user = User(first_name, last_name, email, password, mobile_phone)
-            users.append(user)
-            save_users_to_file(users)
-            print("Registration successful!\n")
-            return
 
-        else:
-            print(f"Email '{email}' is already registered.")
+def registration_attempt():
+    print("User Registration")
+    email = input("Enter your email: ")
+    # ensure that the email is not registered before
+    if is_email_registered(email):
+        print(f"Email '{email}' is already registered.")
         choice = input(
             "Choose an option:\n1. Login\n2. Register with a new email\nEnter the option number: ")
         if choice == '1':
-            login_user()
-            return
-        elif choice == '2':
-            register_user()
-            return
+            return None, login_attempt
+        if choice == '2':
+            return None, registration_attempt
+        print("Invalid choice. Returning to the main menu.")
+        return None, None
+
+    first_name = input("Enter your first name: ")
+    last_name = input("Enter your last name: ")
+
+    # password confirmation
+    while True:
+        password = input("Enter your password: ")
+        confirm_password = input("Confirm your password: ")
+
+        if password == confirm_password:
+            break
         else:
-            print("Invalid choice. Returning to the main menu.")
-            return
+            print("Passwords do not match. Please try again.")
+
+    # ensure a valid Egyptian mobile phone number
+    while True:
+        mobile_phone = input(
+            "Enter your mobile phone number (+201---------): ")
+        if is_valid_egyptian_number(mobile_phone):
+            break
+        else:
+            print(
+                "Invalid mobile phone number. Please enter a valid Egyptian number.")
+
+    # Continue with user registration if the email is not already registered,
+    # only a salted hash of the password is stored
+    user = User(first_name, last_name, email, hash_password(password), mobile_phone)
+    try:
+        storage.add_user(user)
+    except ConflictError as error:
+        # someone registered the same email in another console meanwhile
+        print(f"{error}\n")
+        return None, None
+    print("Registration successful!\n")
+    return None, None
 
 
-# user login
+# user login, returns the logged-in user or None
+@instrumented
 def login_user():
+    return sign_in(login_attempt)
+
+
+def login_attempt():
     print("User Login")
     email = input("Enter your email: ")
     password = input("Enter your password: ")
 
-    users = load_users_from_file()
-
-# find the first User object in the users list that matches both the provided email and hashed password.
-    try:
-        user = next(u for u in users if u.email.lower() == email.lower())
-    except StopIteration:
-        user = None
+    # look up the user by email in the index, then check the password against its salted hash
+    user = check_credentials(storage, email, password)
 
-    if user.password == password:
+    if user is not None:
         print(f"Welcome, {user.first_name}!\n")
-        return user
-    else:
-        print("Invalid email or password. Please try again.\n")
-        choice = input(
-            "Choose an option:\n1. Login\n2. Register with a new email\nEnter the option number: ")
-        if choice == '1':
-            login_user()
-            return None
-        elif choice == '2':
-            register_user()
-            return None
-        else:
-            print("Invalid choice. Returning to the main menu.")
-            return None
+        return user, None
+    print("Invalid email or password. Please try again.\n")
+    choice = input(
+        "Choose an option:\n1. Login\n2. Register with a new email\nEnter the option number: ")
+    if choice == '1':
+        return None, login_attempt
+    if choice == '2':
+        return None, registration_attempt
+    print("Invalid choice. Returning to the main menu.")
+    return None, None
 
 
 # Allows a logged-in user to create a new fundraising project."""
+@instrumented
 def create_project(user):
     print("Create Project")
     title = input("Enter project title: ")
@@ -248,51 +2750,110 @@ def create_project(user):
     target_amount = float(input("Enter total targeted funds : "))
     sd = datetime.datetime.now()
     start_date = sd.strftime('%Y-%m-%d')
+    end_date = input_date("Enter end date (YYYY-MM-DD): ")
+
+    project = Project(title, details, target_amount,
+                      start_date, end_date, user.user_id)
+    storage.add_project(project)
+    print("Project created successfully!\n")
 
+
+def project_status(project):
+    if not project.closed:
+        return "Open"
+    return "Closed, successful" if project.successful else "Closed, failed"
+
+
+# the lines shown for one project, ending with the separator line
+def format_project(project, separator):
+    return (f"Title: {project.title}\n"
+            f"Details: {project.details}\n"
+            f"Target Amount: {project.target_amount}\n"
+            f"Start Date: {project.start_date}\n"
+            f"End Date: {project.end_date}\n"
+            f"Creator: {creator_name(project)}\n"
+            f"Current Amount: {project.current_amount}\n"
+            f"Status: {project_status(project)}\n"
+            f"{separator}\n")
+
+
+# print a page of projects with a single write, instead of a print() call for every line
+def render_projects(projects, separator):
+    sys.stdout.write(''.join(format_project(project, separator) for project in projects))
+    sys.stdout.flush()
+
+
+# ask for one of the SORT_ORDERS
+def choose_sort():
+    orders = list(SORT_ORDERS)
+    for i, sort in enumerate(orders, start=1):
+        print(f"{i}. {SORT_ORDERS[sort]}")
     while True:
         try:
-            end_date_str = input("Enter end date (YYYY-MM-DD): ")
-            ed = datetime.datetime.strptime(
-                end_date_str, "%Y-%m-%d").date()
-            end_date = ed.strftime('%Y-%m-%d')
-
-            break
+            choice = int(input("Sort by: "))
+            if 1 <= choice <= len(orders):
+                return orders[choice - 1]
+            print("Invalid choice. Please enter a valid number.")
         except ValueError:
-            print("Invalid date format. Please use YYYY-MM-DD.")
+            print("Invalid input. Please enter a number.")
 
-    project = Project(title, details, target_amount,
-                      start_date, end_date, user)
-    projects = load_projects_from_file()
-    projects.append(project)
-    save_projects_to_file(projects)
-    print("Project created successfully!\n")
 
+# show projects a page at a time. fetch(sort, offset, limit) returns the projects of one page and
+# the total, so only the page on screen is built. lists longer than a page can be paged through,
+# sorted again and shown with another page size
+def show_pages(fetch, separator):
+    sort = 'listed'
+    page_size = PAGE_SIZE
+    page = 0
+    while True:
+        projects, total = fetch(sort, page * page_size, page_size)
+        render_projects(projects, separator)
+        pages = max(1, -(-total // page_size))
+        if pages == 1 and page_size == PAGE_SIZE and sort == 'listed':
+            return
+        print(f"Page {page + 1} of {pages} ({total} projects, sorted by {SORT_ORDERS[sort]})")
+        command = input("n: next page, p: previous page, s: sort order, z: page size, q: back to the menu: ")
+        command = command.strip().lower()
+        if command in ('n', ''):
+            if page + 1 < pages:
+                page += 1
+            else:
+                print("This is the last page.")
+        elif command == 'p':
+            if page > 0:
+                page -= 1
+            else:
+                print("This is the first page.")
+        elif command == 's':
+            sort = choose_sort()
+            page = 0
+        elif command == 'z':
+            try:
+                page_size = max(1, int(input("Projects per page: ")))
+                page = 0
+            except ValueError:
+                print("Invalid input. Please enter a number.")
+        elif command == 'q':
+            return
+        else:
+            print("Invalid choice. Please try again.")
 
-# Displays information about all available projects.
+
+# Displays information about all available projects, a page at a time.
+@instrumented
 def view_projects():
     print("View Projects")
-    projects = load_projects_from_file()
-    for project in projects:
-        print(f"Title: {project.title}")
-        print(f"Details: {project.details}")
-        print(f"Target Amount: {project.target_amount}")
-        print(f"Start Date: {project.start_date}")
-        print(f"End Date: {project.end_date}")
-        print(
-            f"Creator: {project.creator['first_name']} {project.creator['last_name']}")
-        print(f"Current Amount: {project.current_amount}")
-        print("Status: Closed" if project.closed else "Status: Open")
-        print("----------------------------------------------------------------")
+    show_pages(storage.projects_page, "----------------------------------------------------------------")
 
 
 # Allows a logged-in user to edit one of their own existing projects only.
+@instrumented
 def edit_project(user):
     print("Edit Project")
-    projects = load_projects_from_file()
 
     # Display user's projects for selection
-    user_projects = [project for project in projects if project.creator ==
-                     user.email and not project.closed]
+    user_projects = [project for project in storage.projects_by_creator(
+        user.email) if not project.closed]
 
     if not user_projects:
         print("You don't have any open projects to edit.")
@@ -314,38 +2875,38 @@ def edit_project(user):
             print("Invalid input. Please enter a number.")
 
     selected_project = user_projects[choice - 1]
+    # the edit is refused if the project changes in another console while the user is typing
+    base_version = selected_project.version
 
     print(f"Editing project: {selected_project.title}")
-    selected_project.title = input(
+    changes = {}
+    changes['title'] = input(
         "Enter new project title (press Enter to keep the current title): ") or selected_project.title
-    selected_project.details = input(
+    changes['details'] = input(
         "Enter new project details (press Enter to keep the current details): ") or selected_project.details
-    selected_project.target_amount = float(input(
+    changes['target_amount'] = float(input(
         "Enter new total Funds targeted (press Enter to keep the current amount): ") or selected_project.target_amount)
 
-    while True:
-        try:
-            new_end_date_str = input(
-                "Enter new end date (YYYY-MM-DD, press Enter to keep the current date): ") or selected_project.end_date.strftime("%Y-%m-%d")
-            sped = datetime.datetime.strptime(
-                new_end_date_str, "%Y-%m-%d").date()
-            selected_project.end_date = sped.strftime('%Y-%m-%d')
-            break
-        except ValueError:
-            print("Invalid date format. Please use YYYY-MM-DD.")
+    changes['end_date'] = input_date(
+        "Enter new end date (YYYY-MM-DD, press Enter to keep the current date): ", selected_project.end_date)
 
-    save_projects_to_file(projects)
+    # also moves the project in the date index
+    try:
+        storage.update_project(selected_project, changes, base_version)
+    except ConflictError as error:
+        print(f"{error}\n")
+        return
     print("Project edited successfully!\n")
 
 
 # Allows a logged-in user to delete one of their existing projects.
+@instrumented
 def delete_project(user):
     print("Delete Project")
-    projects = load_projects_from_file()
 
     # Display user's projects for selection
-    user_projects = [
-        project for project in projects if project.creator['email'] == user.email and not project.closed]
+    user_projects = [project for project in storage.projects_by_creator(
+        user.email) if not project.closed]
 
     if not user_projects:
         print("You don't have any open projects to delete.")
@@ -369,62 +2930,65 @@ def delete_project(user):
     selected_project = user_projects[choice - 1]
 
     print(f"Deleting project: ")
-    projects.remove(selected_project)
-    save_projects_to_file(projects)
+    try:
+        storage.delete_project(selected_project)
+    except ConflictError as error:
+        print(f"{error}\n")
+        return
     print(f"Project '{selected_project.title}' deleted successfully!\n")
 
 
 # Allows users to search for projects by name or date.
+@instrumented
 def search_for_project():
     print("Search Projects")
-    projects = load_projects_from_file()
 
-    search_type = input("Search by (1) Name or (2) Date? Enter 1 or 2: ")
+    search_type = input(
+        "Search by (1) Name, (2) Start date, (3) Started between two dates, (4) Ending in the next days "
+        "or (5) Active on a date? Enter 1-5: ")
 
     if search_type == '1':
         search_name = input("Enter project name to search: ")
-        search_results = [
-            project for project in projects if search_name.lower() in project.title.lower()]
+        search_results = storage.search_title(search_name)
     elif search_type == '2':
+        search_date = input_date("Enter date (YYYY-MM-DD): ")
+        search_results = storage.search_start_date(search_date)
+    elif search_type == '3':
+        first_date = input_date("Enter first date (YYYY-MM-DD): ")
+        last_date = input_date("Enter last date (YYYY-MM-DD): ")
+        search_results = storage.search_started_between(first_date, last_date)
+    elif search_type == '4':
         while True:
             try:
-                search_date_str = input("Enter date (YYYY-MM-DD): ")
-                sd = datetime.datetime.strptime(
-                    search_date_str, "%Y-%m-%d").date()
-                search_date = sd.strftime('%Y-%m-%d')
+                days = int(input("Enter the number of days: "))
                 break
-
             except ValueError:
-                print("Invalid date format. Please use YYYY-MM-DD.")
-        search_results = [
-            project for project in projects if search_date == project.start_date]
+                print("Invalid input. Please enter a number.")
+        today = datetime.date.today()
+        search_results = storage.search_ending_between(
+            today.strftime('%Y-%m-%d'), (today + datetime.timedelta(days=days)).strftime('%Y-%m-%d'))
+    elif search_type == '5':
+        search_date = input_date("Enter date (YYYY-MM-DD): ")
+        search_results = storage.search_active_on(search_date)
     else:
-        print("Invalid choice. Please enter 1 or 2.")
+        print("Invalid choice. Please enter a number from 1 to 5.")
         return
 
     if search_results:
         print("Search Results:")
-        for project in search_results:
-            print(f"Title: {project.title}")
-            print(f"Details: {project.details}")
-            print(f"Target Amount: {project.target_amount}")
-            print(f"Start Date: {project.start_date}")
-            print(f"End Date: {project.end_date}")
-            print(f"Creator: {project.creator}")
-            print(f"Current Amount: {project.current_amount}")
-            print("Status: Closed" if project.closed else "Status: Open")
-            print("===")
+        show_pages(lambda sort, offset, limit: (page_of(search_results, sort, offset, limit), len(search_results)),
+                   "===")
     else:
         print("No matching projects found.")
 
 
 # Allows a logged-in user to donate to an open project.
+@instrumented
 def donate_to_project(user):
     print("Donate to Project")
-    projects = load_projects_from_file()
 
     # Display open projects for selection
-    open_projects = [project for project in projects if not project.closed]
+    open_projects = storage.open_projects()
 
     if not open_projects:
         print("There are no open projects to donate to.")
@@ -451,19 +3015,98 @@ def donate_to_project(user):
     amount = float(input("Enter the donation amount: "))
 
     if amount > 0:
-        selected_project.current_amount += amount
-        selected_project.backers.append(user.email)
+        # a journal line or a single-row update, never a rewrite of every project
+        try:
+            storage.donate(selected_project, user.email, amount)
+        except ConflictError as error:
+            print(f"{error}\n")
+            return
         print(f"Donation of {amount} EGP successful!\n")
     else:
         print("Invalid donation amount. Please enter a positive amount.\n")
 
-    save_projects_to_file(projects)
+
+# Shows the leaderboards, the amount raised today and by the user's own projects.
+@instrumented
+def show_leaderboards(user):
+    print("Leaderboards")
+    print("Top projects by percentage funded:")
+    for i, project in enumerate(storage.top_funded(LEADERBOARD_SIZE), start=1):
+        print(f"{i}. {project.title}: {funded_ratio(project):.0%} of {project.target_amount} EGP")
+    print("Projects with the most backers:")
+    for i, (project, backers) in enumerate(storage.top_backed(LEADERBOARD_SIZE), start=1):
+        print(f"{i}. {project.title}: {backers} backers")
+    print("Creators who raised the most:")
+    for i, (email, total) in enumerate(storage.top_creators(LEADERBOARD_SIZE), start=1):
+        print(f"{i}. {email}: {total} EGP")
+    print(f"Raised on the platform today: {storage.raised_on(datetime.date.today().isoformat())} EGP")
+    print(f"Raised by your projects: {storage.creator_total(user.email)} EGP\n")
 
 
 def main():
-    # Load existing user and project data from files
-    users = load_users_from_file()
-    projects = load_projects_from_file()
+    parser = argparse.ArgumentParser(description="Crowdfunding console")
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default='json',
+                        help="where users and projects are stored (default: json)")
+    parser.add_argument('--migrate', action='store_true',
+                        help="copy users.json and projects.json into the SQLite database and exit")
+    parser.add_argument('--snapshot', action='store_true',
+                        help="start from the binary snapshot when it is up to date, and write it on exit (json storage)")
+    parser.add_argument('--stream', action='store_true',
+                        help="read the projects from projects.json a page at a time instead of loading them all, "
+                             "for files too big for memory (json storage)")
+    parser.add_argument('--profile', action='store_true',
+                        help=f"record the time, I/O and memory of every action in {METRICS_FILE} "
+                             f"(also turned on by the {PROFILE_VARIABLE} environment variable)")
+    args = parser.parse_args()
+
+    if args.profile or os.environ.get(PROFILE_VARIABLE):
+        metrics.enable()
+        print(f"Profiling: every action is recorded in {METRICS_FILE}.")
+        if hasattr(signal, 'SIGUSR1'):
+            print(f"Run 'kill -USR1 {os.getpid()}' to start a cProfile run, and again to write it to {PROFILE_FILE}.")
+
+    if args.migrate:
+        migrate_json_to_sqlite()
+        return
+    if args.storage == 'sqlite':
+        use_storage(SqliteStorage())
+    elif args.stream:
+        use_storage(StreamingStorage())
+    elif args.snapshot:
+        load_snapshot()
+
+    # Load existing user and project data, with the JSON backend they stay
+    # cached in memory and are only parsed again if the files change on disk.
+    # when streaming, the projects are only loaded for a change
+    load_users_from_file()
+    if not isinstance(storage, StreamingStorage):
+        load_projects_from_file()
+
+        # projects whose end date passed while the program was not running
+        closed = storage.close_expired()
+        if closed:
+            successful = sum(project.successful for project in closed)
+            print(f"{len(closed)} projects reached their end date and were closed: "
+                  f"{successful} successful, {len(closed) - successful} failed.")
+
+    # with the JSON backend, the journal is compacted into the files in the background
+    if isinstance(storage, JsonStorage):
+        saver.start()
+    try:
+        run_menu()
+    finally:
+        # write the changes that are still waiting before leaving, also after Ctrl+C or an error
+        saver.stop()
+
+    # the next start can skip parsing the JSON files
+    if args.snapshot and isinstance(storage, JsonStorage):
+        save_snapshot()
+    # writes the cProfile run if one is still going
+    metrics.disable()
+
+
+# the main menu, until the user chooses Exit
+def run_menu():
     logged_in_user = None
 
     while True:
@@ -475,7 +3118,8 @@ def main():
             print("4. Delete Project")
             print("5. Search for Projects")
             print("6. Donate to Project")
-            print("7. Exit")
+            print("7. Leaderboards")
+            print("8. Exit")
         else:
             print("1. Register")
             print("2. Login")
@@ -485,7 +3129,8 @@ def main():
 
         if not logged_in_user:
             if choice == '1':
-                register_user()
+                # choosing to log in instead of registering an email that is taken logs the user in
+                logged_in_user = register_user()
             elif choice == '2':
                 logged_in_user = login_user()
             elif choice == '3':
@@ -507,6 +3152,8 @@ def main():
             elif choice == '6':
                 donate_to_project(logged_in_user)
             elif choice == '7':
+                show_leaderboards(logged_in_user)
+            elif choice == '8':
                 print("Goodbye!")
                 break
             else:
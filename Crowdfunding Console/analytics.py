@@ -0,0 +1,235 @@
+# Analytics report over the projects and donations, computed with NumPy: the distribution and
+# percentiles of the funding ratio, donations and unique backers per project, daily donation velocity and the projected
+# completion dates of the open projects.
+# The projects are copied once into columns of numbers (the same columns the binary snapshot
+# uses), every figure after that is a vectorized operation instead of a loop over Project
+# objects, so millions of projects take seconds.
+# Run: python analytics.py [--storage sqlite] [--snapshot] [--output report.txt] [--csv projects_report.csv]
+# Needs NumPy: pip install numpy
+
+
+import argparse
+import csv
+import datetime
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit("analytics.py needs NumPy, install it with: pip install numpy")
+
+from Final_Crowdfunding import JsonStorage, SqliteStorage, load_snapshot, project_columns
+
+# upper edges of the funding ratio buckets, the last bucket has no upper edge
+RATIO_BUCKETS = [0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0]
+PERCENTILES = [10, 25, 50, 75, 90, 99]
+# days of daily donation totals looked at, and the days of the moving average
+VELOCITY_DAYS = 30
+AVERAGE_DAYS = 7
+# completion dates further away than this are not projected
+MAX_PROJECTION_DAYS = 36500
+
+
+# the number of different backer ids in the backer list of each project, someone who donated
+# several times counts once: the (project, backer) pairs are sorted and only the first of equal pairs is counted
+def unique_backers(backer_ids, donations):
+    owner = np.repeat(np.arange(len(donations)), donations)
+    order = np.lexsort((backer_ids, owner))
+    owner = owner[order]
+    backer_ids = backer_ids[order]
+    first = np.ones(len(owner), dtype=bool)
+    first[1:] = (owner[1:] != owner[:-1]) | (backer_ids[1:] != backer_ids[:-1])
+    return np.bincount(owner[first], minlength=len(donations))
+
+
+# the project fields as NumPy arrays, one element per project
+class ProjectColumns:
+    def __init__(self, projects):
+        columns = project_columns(projects)
+        self.project_id = np.array(columns['project_id'], dtype=np.int64)
+        self.title = columns['title']
+        self.target_amount = np.array(columns['target_amount'], dtype=np.float64)
+        self.current_amount = np.array(columns['current_amount'], dtype=np.float64)
+        self.start_date = np.array(columns['start_date'], dtype='datetime64[D]')
+        self.end_date = np.array(columns['end_date'], dtype='datetime64[D]')
+        # every donation adds its backer, so the length of a backer list is the number of donations
+        self.donations = np.diff(np.array(columns['backer_ends'], dtype=np.int64), prepend=0)
+        self.backers = unique_backers(np.frombuffer(columns['backers'], dtype=np.int32), self.donations)
+        self.closed = np.frombuffer(columns['closed'], dtype=np.uint8).astype(bool)
+
+    def __len__(self):
+        return len(self.project_id)
+
+    # share of the target amount raised, 0 for projects without a target
+    def funded_ratio(self):
+        return np.divide(self.current_amount, self.target_amount, out=np.zeros(len(self)),
+                         where=self.target_amount > 0)
+
+
+def format_percent(value):
+    return f"{value * 100:.1f}%"
+
+
+def percentile_line(name, values, formatter=str):
+    if len(values) == 0:
+        return f"{name}: no data"
+    parts = [f"p{percent} {formatter(value)}"
+             for percent, value in zip(PERCENTILES, np.percentile(values, PERCENTILES))]
+    return f"{name}: " + ", ".join(parts)
+
+
+def overview(columns):
+    successful = columns.closed & (columns.current_amount >= columns.target_amount)
+    closed = int(columns.closed.sum())
+    return [
+        "Projects",
+        f"  {len(columns)} projects: {len(columns) - closed} open, {closed} closed "
+        f"({int(successful.sum())} successful, {closed - int(successful.sum())} failed)",
+        f"  target {columns.target_amount.sum():.2f} EGP, raised {columns.current_amount.sum():.2f} EGP",
+        f"  {int(columns.donations.sum())} donations, "
+        f"{int((columns.donations == 0).sum())} projects without any"
+    ]
+
+
+def ratio_distribution(columns, ratio):
+    edges = [0.0] + RATIO_BUCKETS + [np.inf]
+    counts, _ = np.histogram(ratio, bins=edges)
+    lines = ["Funding ratio distribution"]
+    for low, high, count in zip(edges, edges[1:], counts):
+        if high == np.inf:
+            label = f"{format_percent(low)} and more"
+        else:
+            label = f"{format_percent(low)} - {format_percent(high)}"
+        share = count / len(columns) if len(columns) else 0.0
+        lines.append(f"  {label:>18}: {count:>10} {format_percent(share):>7} {'#' * int(share * 50)}")
+    lines.append("  " + percentile_line("funding ratio", ratio, format_percent))
+    lines.append("  " + percentile_line("raised (EGP)", columns.current_amount, lambda value: f"{value:.2f}"))
+    lines.append("  " + percentile_line("donations", columns.donations, lambda value: f"{value:.0f}"))
+    lines.append("  " + percentile_line("backers", columns.backers, lambda value: f"{value:.0f}"))
+    return lines
+
+
+# amounts donated on each of the last VELOCITY_DAYS days, with a moving average over AVERAGE_DAYS
+def donation_velocity(daily_totals, today):
+    first_day = today - np.timedelta64(VELOCITY_DAYS + AVERAGE_DAYS - 2, 'D')
+    days = np.array(list(daily_totals), dtype='datetime64[D]')
+    amounts = np.array(list(daily_totals.values()), dtype=np.float64)
+    inside = (days >= first_day) & (days <= today)
+    series = np.bincount((days[inside] - first_day).astype(np.int64), weights=amounts[inside],
+                         minlength=VELOCITY_DAYS + AVERAGE_DAYS - 1)
+    average = np.convolve(series, np.ones(AVERAGE_DAYS) / AVERAGE_DAYS, mode='valid')
+    series = series[AVERAGE_DAYS - 1:]
+
+    lines = [f"Donation velocity (last {VELOCITY_DAYS} days)"]
+    if not series.any():
+        lines.append("  no donations with a date in this period")
+        return lines
+    best = int(series.argmax())
+    lines.append(f"  {series.sum():.2f} EGP raised, {series.mean():.2f} EGP per day, "
+                 f"best day {today - np.timedelta64(VELOCITY_DAYS - 1 - best, 'D')} with {series[best]:.2f} EGP")
+    lines.append(f"  {AVERAGE_DAYS}-day average: {average[-1]:.2f} EGP per day now, "
+                 f"{average[0]:.2f} EGP per day {VELOCITY_DAYS - 1} days ago")
+    for offset in range(VELOCITY_DAYS - 1, -1, -1):
+        day = today - np.timedelta64(offset, 'D')
+        index = VELOCITY_DAYS - 1 - offset
+        lines.append(f"  {day}: {series[index]:>14.2f} EGP  ({AVERAGE_DAYS}-day average {average[index]:.2f})")
+    return lines
+
+
+# every open project is assumed to keep raising money at its average rate since it started.
+# returns the daily rate, the projected completion date (NaT when it can't be projected) and
+# whether that date is before the end date
+def projections(columns, today):
+    elapsed = (today - columns.start_date).astype(np.int64) + 1
+    started = elapsed > 0
+    rate = np.divide(columns.current_amount, elapsed, out=np.zeros(len(columns)), where=started)
+    remaining = columns.target_amount - columns.current_amount
+    days_needed = np.full(len(columns), np.inf)
+    np.divide(remaining, rate, out=days_needed, where=rate > 0)
+    days_needed = np.where(remaining <= 0, 0.0, np.ceil(days_needed))
+
+    projected = np.full(len(columns), np.datetime64('NaT'), dtype='datetime64[D]')
+    can_project = ~columns.closed & started & (days_needed <= MAX_PROJECTION_DAYS)
+    projected[can_project] = today + days_needed[can_project].astype(np.int64).astype('timedelta64[D]')
+    on_track = can_project & (projected <= columns.end_date)
+    return rate, projected, on_track, days_needed
+
+
+def projection_summary(columns, today, rate, on_track, days_needed):
+    open_projects = ~columns.closed
+    funded = open_projects & (columns.current_amount >= columns.target_amount)
+    not_started = open_projects & (columns.start_date > today)
+    no_donations = open_projects & ~not_started & (rate == 0) & ~funded
+    pending = open_projects & ~funded & ~not_started & ~no_donations
+    return [
+        "Projected completion of the open projects (at their average daily rate so far)",
+        f"  {int(funded.sum())} already funded",
+        f"  {int((on_track & pending).sum())} on track to reach the target by their end date",
+        f"  {int((pending & ~on_track).sum())} behind",
+        f"  {int(no_donations.sum())} without donations yet, {int(not_started.sum())} not started yet",
+        "  " + percentile_line("days to the target", days_needed[pending & np.isfinite(days_needed)],
+                               lambda value: f"{value:.0f}")
+    ]
+
+
+# one row per project with the computed figures
+def write_csv(file_name, columns, ratio, rate, projected, on_track):
+    status = np.where(~columns.closed, 'open',
+                      np.where(columns.current_amount >= columns.target_amount, 'successful', 'failed'))
+    projected_text = np.where(np.isnat(projected), '', np.datetime_as_string(projected))
+    with open(file_name, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['project_id', 'title', 'target_amount', 'current_amount', 'funded_ratio', 'donations',
+                         'backers', 'status', 'daily_rate', 'projected_completion', 'on_track'])
+        writer.writerows(zip(columns.project_id.tolist(), columns.title, columns.target_amount.tolist(),
+                             columns.current_amount.tolist(), np.round(ratio, 4).tolist(),
+                             columns.donations.tolist(), columns.backers.tolist(), status.tolist(),
+                             np.round(rate, 2).tolist(), projected_text.tolist(), on_track.tolist()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analytics report over the crowdfunding data")
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--snapshot', action='store_true', help="start from the binary snapshot when it is up to date")
+    parser.add_argument('--output', help="write the report to this file instead of printing it")
+    parser.add_argument('--csv', help="write the figures of every project to this CSV file")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.storage == 'sqlite':
+        storage = SqliteStorage()
+    else:
+        storage = JsonStorage()
+        if args.snapshot:
+            load_snapshot()
+    columns = ProjectColumns(storage.load_projects())
+    daily_totals = storage.daily_totals()
+    loaded = time.perf_counter()
+
+    today = np.datetime64(datetime.date.today(), 'D')
+    ratio = columns.funded_ratio()
+    rate, projected, on_track, days_needed = projections(columns, today)
+    lines = [f"Crowdfunding report for {today}", ""]
+    lines += overview(columns) + [""]
+    lines += ratio_distribution(columns, ratio) + [""]
+    lines += donation_velocity(daily_totals, today) + [""]
+    lines += projection_summary(columns, today, rate, on_track, days_needed) + [""]
+    computed = time.perf_counter()
+    lines.append(f"Loaded in {loaded - started:.2f} s, computed in {computed - loaded:.2f} s.")
+
+    report = "\n".join(lines) + "\n"
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(report)
+        print(f"Report written to {args.output}.")
+    else:
+        sys.stdout.write(report)
+    if args.csv:
+        write_csv(args.csv, columns, ratio, rate, projected, on_track)
+        print(f"Figures of {len(columns)} projects written to {args.csv} "
+              f"in {time.perf_counter() - computed:.2f} s.")
+
+
+if __name__ == "__main__":
+    main()
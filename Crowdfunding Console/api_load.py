@@ -0,0 +1,146 @@
+# Load generator for crowdfunding_api.py. Many concurrent keep-alive connections send a mix of
+# searches, project listings and donations, then the throughput (requests/sec) and the latency
+# percentiles are reported, with p99 the one to watch. Only successful (2xx) responses count
+# towards them, the other ones are listed apart and make the run fail.
+# Start the server first (python crowdfunding_api.py), then:
+# Run: python api_load.py --connections 50 --requests 20000 --donations 0.2
+
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from urllib.parse import quote
+
+
+# a minimal HTTP/1.1 client on one keep-alive connection
+class Connection:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    # send one request and return (status, decoded JSON body)
+    async def request(self, method, path, body=None, token=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(data)}\r\n"
+        if token is not None:
+            head += f"Authorization: Bearer {token}\r\n"
+        self.writer.write(head.encode() + b"\r\n" + data)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    def close(self):
+        self.writer.close()
+
+
+# value below which this percentage of the sorted latencies fall (nearest rank)
+def percentile(latencies, percent):
+    return latencies[max(0, math.ceil(percent / 100 * len(latencies)) - 1)]
+
+
+# register (or reuse) the load test user, log in and collect project ids and search words
+async def prepare(host, port):
+    connection = Connection(host, port)
+    await connection.open()
+    user = {'first_name': 'load', 'last_name': 'test', 'email': 'load.test@example.com',
+            'password': 'load-test', 'mobile_phone': '+201000000000'}
+    status, body = await connection.request('POST', '/register', user)
+    if status not in (201, 409):
+        raise SystemExit(f"Could not register the load test user: {status} {body}")
+    status, body = await connection.request('POST', '/login', {'email': user['email'], 'password': user['password']})
+    if status != 200:
+        raise SystemExit(f"Could not log in: {status} {body}")
+    token = body['token']
+    status, body = await connection.request('GET', '/projects?limit=500')
+    connection.close()
+    projects = [project for project in body['projects'] if not project['closed']]
+    if not projects:
+        raise SystemExit("The server has no open projects to work with.")
+    words = sorted({word for project in projects for word in project['title'].lower().split() if len(word) >= 3})
+    return token, [project['project_id'] for project in projects], words
+
+
+# one client connection sending requests until the shared budget is used up
+async def client(host, port, token, project_ids, words, donation_ratio, budget, latencies, statuses, errors, rng):
+    connection = Connection(host, port)
+    await connection.open()
+    try:
+        while budget[0] > 0:
+            budget[0] -= 1
+            roll = rng.random()
+            if roll < donation_ratio:
+                method, path, body = 'POST', f'/projects/{rng.choice(project_ids)}/donate', {'amount': 1}
+            elif roll < donation_ratio + (1 - donation_ratio) / 2 and words:
+                # titles contain words like '#12', they are quoted or the '#' would start a fragment
+                method, path, body = 'GET', f'/projects/search?q={quote(rng.choice(words), safe="")}&limit=20', None
+            else:
+                method, path, body = 'GET', f'/projects?offset={rng.randrange(len(project_ids))}&limit=20', None
+            started = time.perf_counter()
+            status, response = await connection.request(method, path, body, token)
+            if 200 <= status < 300:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors.setdefault(status, f"{method} {path}: {response.get('error')}")
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        connection.close()
+
+
+async def run(args):
+    token, project_ids, words = await prepare(args.host, args.port)
+    latencies = []
+    statuses = {}
+    errors = {}  # status -> the first failed request with that status
+    budget = [args.requests]
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    await asyncio.gather(*(client(args.host, args.port, token, project_ids, words, args.donations, budget,
+                                  latencies, statuses, errors, random.Random(rng.random()))
+                           for _ in range(args.connections)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"{len(latencies)} successful requests over {args.connections} connections in {elapsed:.2f} s: "
+          f"{len(latencies) / elapsed:.0f} requests/s")
+    if latencies:
+        print("latency: " + ", ".join(f"p{percent} {percentile(latencies, percent) * 1000:.1f} ms"
+                                      for percent in (50, 90, 99)) + f", max {latencies[-1] * 1000:.1f} ms")
+    print("statuses: " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items())))
+    if errors:
+        for status, example in sorted(errors.items()):
+            print(f"FAILED: {statuses[status]} requests answered {status}, for example {example}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test crowdfunding_api.py")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--connections', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=20000, help="requests sent in total")
+    parser.add_argument('--donations', type=float, default=0.2,
+                        help="share of the requests that are donations, the rest are searches and listings")
+    parser.add_argument('--seed', type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
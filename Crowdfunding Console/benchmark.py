@@ -0,0 +1,184 @@
+# Benchmark suite for the console. Data of the requested size is generated with generate_data.py
+# in a temporary directory, then the console functions themselves are run: their input() prompts
+# are answered from a script and what they print is thrown away.
+# Every operation is timed over several runs and the median is reported. Its peak memory is
+# measured in one more run under tracemalloc, which slows the code down too much to time it.
+# Results can be saved as a baseline, later runs compared with it fail when an operation got
+# slower or needs more memory than the tolerance allows.
+# Run: python benchmark.py --scale 10000 --save-baseline baseline.json
+#      python benchmark.py --scale 10000 --compare baseline.json [--tolerance 0.25]
+
+
+import argparse
+import builtins
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import Final_Crowdfunding
+import generate_data
+
+# changes smaller than these are noise, operations that take microseconds vary by more than any tolerance
+NOISE_SECONDS = 0.001
+NOISE_BYTES = 64 * 1024
+
+
+# answers the input() prompts of a console function in order, a prompt nobody expected
+# fails the benchmark instead of waiting for a keyboard
+@contextlib.contextmanager
+def scripted_input(answers):
+    answers = iter(answers)
+
+    def fake_input(prompt=''):
+        try:
+            return next(answers)
+        except StopIteration:
+            raise RuntimeError(f"unexpected prompt: {prompt!r}")
+
+    original = builtins.input
+    builtins.input = fake_input
+    try:
+        yield
+    finally:
+        builtins.input = original
+
+
+# forget the cached users and projects, so the next load reads the files again
+def forget_cache():
+    for repository in (Final_Crowdfunding.users_repository, Final_Crowdfunding.projects_repository):
+        repository.items = None
+        repository.signature = None
+
+
+# the operations measured: name -> (setup run before every run, the operation, its answers to input())
+def operations(user):
+    return {
+        'load_projects_from_file': (forget_cache, lambda: (Final_Crowdfunding.load_users_from_file(),
+                                                           Final_Crowdfunding.load_projects_from_file()), []),
+        'save_projects_to_file': (None, lambda: Final_Crowdfunding.save_projects_to_file(
+            Final_Crowdfunding.load_projects_from_file()), []),
+        'login_user': (None, Final_Crowdfunding.login_user, ['user1@example.com', 'password1']),
+        'search_for_project': (None, Final_Crowdfunding.search_for_project, ['1', 'school cairo', 'q']),
+        'view_projects': (None, Final_Crowdfunding.view_projects, ['q']),
+        'donate_to_project': (None, lambda: Final_Crowdfunding.donate_to_project(user), ['1', '10'])
+    }
+
+
+def run_once(setup, operation, answers, output):
+    if setup is not None:
+        setup()
+    with scripted_input(answers), contextlib.redirect_stdout(output):
+        started = time.perf_counter()
+        operation()
+        return time.perf_counter() - started
+
+
+# (median seconds, fastest seconds, peak bytes allocated) of an operation
+def measure(setup, operation, answers, repeat, output):
+    times = [run_once(setup, operation, answers, output) for _ in range(repeat)]
+    tracemalloc.start()
+    try:
+        if setup is not None:
+            setup()
+        tracemalloc.reset_peak()
+        run_once(None, operation, answers, output)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return statistics.median(times), min(times), peak
+
+
+# names of the operations that got worse than the baseline allows, and a note for each line
+def compare(results, baseline, tolerance):
+    regressions = []
+    notes = {}
+    for name, result in results.items():
+        base = baseline['operations'].get(name)
+        if base is None:
+            notes[name] = "new"
+            continue
+        time_change = result['seconds'] / base['seconds'] - 1 if base['seconds'] else 0.0
+        memory_change = result['peak_bytes'] / base['peak_bytes'] - 1 if base['peak_bytes'] else 0.0
+        notes[name] = f"time {time_change:+.0%}, memory {memory_change:+.0%}"
+        slower = time_change > tolerance and result['seconds'] - base['seconds'] > NOISE_SECONDS
+        bigger = memory_change > tolerance and result['peak_bytes'] - base['peak_bytes'] > NOISE_BYTES
+        if slower or bigger:
+            regressions.append(name)
+            notes[name] += "  REGRESSION"
+    return regressions, notes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the console functions on generated data")
+    parser.add_argument('--scale', type=int, default=10000, help="projects and users generated (default: 10000)")
+    parser.add_argument('--donations', type=int, help="default: five times the scale")
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs of every operation")
+    parser.add_argument('--only', nargs='+', help="run only these operations")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save-baseline', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="compare the results with this baseline file")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown or memory growth over the baseline (default: 0.25 = 25%%)")
+    parser.add_argument('--keep', action='store_true', help="keep the generated data directory")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline['scale'] != args.scale or baseline['storage'] != args.storage:
+            sys.exit(f"{args.compare} was measured with --scale {baseline['scale']} "
+                     f"--storage {baseline['storage']}, run with the same options.")
+
+    directory = tempfile.mkdtemp(prefix='crowdfunding_benchmark_')
+    working_directory = os.getcwd()
+    results = {}
+    try:
+        donations = args.donations if args.donations is not None else 5 * args.scale
+        # the data is thrown away afterwards, hashing every password would take longer than the benchmark
+        generate_data.generate(directory, args.scale, args.scale, donations, args.seed, plain_passwords=True)
+        os.chdir(directory)
+        with open(os.devnull, 'w') as output:
+            if args.storage == 'sqlite':
+                with contextlib.redirect_stdout(output):
+                    Final_Crowdfunding.use_storage(Final_Crowdfunding.migrate_json_to_sqlite())
+            user = Final_Crowdfunding.storage.find_user('user1@example.com')
+            for name, (setup, operation, answers) in operations(user).items():
+                if args.only and name not in args.only:
+                    continue
+                seconds, fastest, peak = measure(setup, operation, answers, args.repeat, output)
+                results[name] = {'seconds': seconds, 'fastest': fastest, 'peak_bytes': peak}
+    finally:
+        os.chdir(working_directory)
+        if args.keep:
+            print(f"data kept in {directory}")
+        else:
+            shutil.rmtree(directory)
+
+    regressions, notes = compare(results, baseline, args.tolerance) if baseline else ([], {})
+    print(f"{args.scale} projects and users, {args.storage} storage, median of {args.repeat} runs")
+    print(f"{'operation':<26}{'median':>12}{'fastest':>12}{'peak memory':>14}")
+    for name, result in results.items():
+        print(f"{name:<26}{result['seconds'] * 1000:>9.1f} ms{result['fastest'] * 1000:>9.1f} ms"
+              f"{result['peak_bytes'] / 2 ** 20:>11.1f} MB  {notes.get(name, '')}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump({'scale': args.scale, 'storage': args.storage, 'python': platform.python_version(),
+                       'operations': results}, file, indent=4)
+        print(f"Baseline saved to {args.save_baseline}.")
+    if regressions:
+        print(f"FAILED: {', '.join(regressions)} got worse than the baseline by more than {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+# Bulk import and export of users, projects and donations as JSONL or CSV files.
+# Rows are read and written one at a time, so files with millions of rows never have to fit in memory.
+# Imported rows are validated a chunk at a time: first each row on its own (phone numbers, amounts,
+# dates and timestamps), then the whole chunk against the email index in one go. Rows that fail are reported with
+# their row number and skipped, the other rows of the chunk are committed together.
+# Run: python bulk_data.py import users partner_users.csv [--errors errors.jsonl] [--plain-passwords]
+#      python bulk_data.py export projects projects.jsonl [--storage sqlite]
+#
+# users:      first_name, last_name, email, password, mobile_phone
+# projects:   title, details, target_amount, start_date, end_date, creator (email of a registered user),
+#             and optionally project_id, current_amount and closed
+# donations:  project_id, backer (email of a registered user), amount, and optionally timestamp
+# Exported projects include their totals, so import either those totals or the donations, not both.
+# Donations can only be exported from the SQLite storage, the JSON storage keeps only the totals.
+# Plain text passwords are hashed during the import, one thread per core, and the cost is reported:
+# a good part of a second of CPU per password, days for millions of users. Hashes (from an export)
+# are imported as they are. --plain-passwords stores plain text passwords as they are, only for
+# throwaway benchmark data; each one is replaced by its hash the first time the user logs in.
+
+
+import argparse
+import concurrent.futures
+import csv
+import datetime
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+from Final_Crowdfunding import (JsonStorage, PendingDonation, Project, SqliteStorage, User, hash_password,
+                                is_password_hash, is_valid_egyptian_number, parse_date, saver)
+
+# columns of the exported files, and of the CSV header
+FIELDS = {
+    'users': ['user_id', 'first_name', 'last_name', 'email', 'password', 'mobile_phone'],
+    'projects': ['project_id', 'title', 'details', 'target_amount', 'start_date', 'end_date', 'creator',
+                 'current_amount', 'closed'],
+    'donations': ['project_id', 'backer', 'amount', 'timestamp']
+}
+
+
+# a row that can't be imported, the message says why
+class RowError(Exception):
+    pass
+
+
+# csv or jsonl, from --format or else the file extension
+def file_format(file_name, given):
+    if given:
+        return given
+    return 'csv' if file_name.lower().endswith('.csv') else 'jsonl'
+
+
+# (row number, record) for every row of the file, a JSONL line that is not an object gives None
+def read_rows(file, data_format):
+    if data_format == 'csv':
+        yield from enumerate(csv.DictReader(file), start=1)
+        return
+    for number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield number, record if isinstance(record, dict) else None
+
+
+# field readers, CSV gives every value as text while JSONL can give numbers and booleans
+def text(row, name, required=True):
+    value = row.get(name)
+    if value is None or value == '':
+        if required:
+            raise RowError(f"{name} is missing")
+        return None
+    return str(value)
+
+
+def number(row, name, required=True, default=None):
+    value = text(row, name, required)
+    if value is None:
+        return default
+    try:
+        value = float(value)
+    except ValueError:
+        raise RowError(f"{name} is not a number: {row[name]!r}")
+    # float() takes 'nan' and 'inf', they would stay in the totals for good
+    if not math.isfinite(value):
+        raise RowError(f"{name} is not a finite number: {row[name]!r}")
+    if value < 0:
+        raise RowError(f"{name} must not be negative")
+    return value
+
+
+def date(row, name):
+    value = text(row, name)
+    try:
+        return parse_date(value)
+    except ValueError:
+        raise RowError(f"{name} is not a date (YYYY-MM-DD): {value!r}")
+
+
+# an optional ISO date or date and time, written the way the donations made in the console are
+# ('YYYY-MM-DDTHH:MM:SS', local time), the day it starts with goes into the daily totals
+def timestamp(row, name):
+    value = text(row, name, required=False)
+    if value is None:
+        return None
+    try:
+        moment = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise RowError(f"{name} is not a date or date and time (YYYY-MM-DD[THH:MM:SS]): {value!r}")
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment.isoformat(timespec='seconds')
+
+
+def flag(row, name):
+    return str(row.get(name, '')).lower() in ('true', '1', 'yes')
+
+
+class Importer:
+    def __init__(self, storage, kind, chunk_size, errors_file=None, hash_passwords=True):
+        self.storage = storage
+        self.kind = kind
+        self.chunk_size = chunk_size
+        self.errors_file = errors_file
+        self.hash_passwords = hash_passwords
+        self.imported = 0
+        self.plain_passwords = 0  # plain text passwords seen, hashed unless hash_passwords is off
+        self.hashing_seconds = 0.0
+        self.refused = 0
+        self.shown_errors = []  # the first few errors, printed at the end
+        self.seen = set()  # emails or project ids already imported from this file
+
+    def error(self, number, message, row):
+        self.refused += 1
+        if len(self.shown_errors) < 20:
+            self.shown_errors.append(f"row {number}: {message}")
+        if self.errors_file is not None:
+            self.errors_file.write(json.dumps({'row': number, 'error': message, 'data': row}) + '\n')
+
+    def run(self, rows):
+        chunk = []
+        for number, row in rows:
+            chunk.append((number, row))
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+
+    # validate the rows one by one, then the emails of the whole chunk at once, then commit it
+    def import_chunk(self, chunk):
+        parsed = []
+        parse = getattr(self, f'parse_{self.kind[:-1]}')
+        for number, row in chunk:
+            if row is None:
+                self.error(number, "not a JSON object", None)
+                continue
+            try:
+                parsed.append((number, row, parse(row)))
+            except RowError as error:
+                self.error(number, str(error), row)
+        getattr(self, f'commit_{self.kind}')(parsed)
+
+    def parse_user(self, row):
+        email = text(row, 'email')
+        if '@' not in email:
+            raise RowError(f"invalid email address {email!r}")
+        mobile_phone = text(row, 'mobile_phone')
+        if not is_valid_egyptian_number(mobile_phone):
+            raise RowError(f"invalid Egyptian mobile phone number {mobile_phone!r}")
+        return (text(row, 'first_name'), text(row, 'last_name'), email, text(row, 'password'), mobile_phone)
+
+    def parse_project(self, row):
+        start_date = date(row, 'start_date')
+        end_date = date(row, 'end_date')
+        if end_date < start_date:
+            raise RowError("end_date is before start_date")
+        target_amount = number(row, 'target_amount')
+        if target_amount == 0:
+            raise RowError("target_amount must be positive")
+        project_id = number(row, 'project_id', required=False)
+        return (text(row, 'title'), text(row, 'details', required=False) or '', target_amount, start_date,
+                end_date, text(row, 'creator'), number(row, 'current_amount', required=False, default=0.0),
+                flag(row, 'closed'), int(project_id) if project_id is not None else None)
+
+    def parse_donation(self, row):
+        project_id = number(row, 'project_id')
+        amount = number(row, 'amount')
+        if amount == 0:
+            raise RowError("amount must be positive")
+        return (int(project_id), text(row, 'backer'), amount, timestamp(row, 'timestamp'))
+
+    def commit_users(self, parsed):
+        registered = self.storage.registered_emails(fields[2] for _, _, fields in parsed)
+        accepted = []
+        for number, row, fields in parsed:
+            key = fields[2].casefold()
+            if key in registered or key in self.seen:
+                self.error(number, f"email {fields[2]} is already registered", row)
+                continue
+            self.seen.add(key)
+            accepted.append((number, row, fields))
+        passwords = [fields[3] for _, _, fields in accepted]
+        plain = [index for index, password in enumerate(passwords) if not is_password_hash(password)]
+        self.plain_passwords += len(plain)
+        if self.hash_passwords and plain:
+            started = time.perf_counter()
+            # hashlib lets go of the GIL while hashing, so the threads hash on every core
+            with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as hashers:
+                for index, password_hash in zip(plain, hashers.map(hash_password, [passwords[i] for i in plain])):
+                    passwords[index] = password_hash
+            self.hashing_seconds += time.perf_counter() - started
+        users = []
+        rows = {}
+        for (number, row, fields), password in zip(accepted, passwords):
+            first_name, last_name, email, _, mobile_phone = fields
+            user = User(first_name, last_name, email, password, mobile_phone)
+            users.append(user)
+            rows[id(user)] = (number, row)
+        # another process may have registered some of the emails since the check
+        refused = self.storage.add_users(users)
+        for user in refused:
+            number, row = rows[id(user)]
+            self.error(number, f"email {user.email} is already registered", row)
+        self.imported += len(users) - len(refused)
+
+    def commit_projects(self, parsed):
+        registered = self.storage.registered_emails(fields[5] for _, _, fields in parsed)
+        projects = []
+        for number, row, fields in parsed:
+            title, details, target_amount, start_date, end_date, creator, current_amount, closed, project_id = fields
+            if creator.casefold() not in registered:
+                self.error(number, f"creator {creator} is not a registered user", row)
+                continue
+            if project_id is not None and (project_id in self.seen or self.storage.find_project(project_id)):
+                self.error(number, f"project_id {project_id} is already used", row)
+                continue
+            self.seen.add(project_id)
+            projects.append(Project(title, details, target_amount, start_date, end_date, creator,
+                                    current_amount, None, closed, project_id))
+        self.storage.add_projects(projects)
+        self.imported += len(projects)
+
+    def commit_donations(self, parsed):
+        registered = self.storage.registered_emails(fields[1] for _, _, fields in parsed)
+        donations = []
+        rows = []
+        for number, row, fields in parsed:
+            if fields[1].casefold() not in registered:
+                self.error(number, f"backer {fields[1]} is not a registered user", row)
+                continue
+            donations.append(PendingDonation(*fields))
+            rows.append((number, row))
+        self.storage.add_donations(donations)
+        for donation, (number, row) in zip(donations, rows):
+            if donation.error is not None:
+                self.error(number, f"project {donation.project_id} does not exist or is closed", row)
+            else:
+                self.imported += 1
+
+
+# write the records to the file, one row at a time
+def export(records, kind, file, data_format):
+    count = 0
+    if data_format == 'csv':
+        writer = csv.DictWriter(file, FIELDS[kind], extrasaction='ignore')
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+            count += 1
+    else:
+        for record in records:
+            file.write(json.dumps(record) + '\n')
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import or export users, projects and donations as JSONL or CSV")
+    parser.add_argument('action', choices=['import', 'export'])
+    parser.add_argument('kind', choices=['users', 'projects', 'donations'])
+    parser.add_argument('file')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help="default: from the file extension")
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--chunk', type=int, default=50000, help="rows validated and committed together")
+    parser.add_argument('--errors', help="write every refused row to this JSONL file")
+    parser.add_argument('--plain-passwords', action='store_true',
+                        help="store plain text passwords unhashed until the first login, "
+                             "only for throwaway benchmark data")
+    args = parser.parse_args()
+
+    storage = SqliteStorage() if args.storage == 'sqlite' else JsonStorage()
+    data_format = file_format(args.file, args.format)
+    started = time.perf_counter()
+
+    if args.action == 'export':
+        # the storage refuses what it can't export before the file is created
+        try:
+            records = getattr(storage, f'export_{args.kind}')()
+        except ValueError as error:
+            sys.exit(str(error))
+        with open(args.file, 'w', newline='', encoding='utf-8') as file:
+            count = export(records, args.kind, file, data_format)
+        elapsed = time.perf_counter() - started
+        print(f"Exported {count} {args.kind} to {args.file} in {elapsed:.1f} s "
+              f"({count / max(elapsed, 1e-9):.0f} rows/s).")
+        return
+
+    # with the JSON backend the chunks go to the journal, which is compacted once at the end
+    # instead of again and again while it grows
+    if isinstance(storage, JsonStorage):
+        saver.interval = threading.TIMEOUT_MAX
+        saver.threshold = math.inf
+        saver.start()
+    errors_file = open(args.errors, 'w', encoding='utf-8') if args.errors else None
+    importer = Importer(storage, args.kind, args.chunk, errors_file, not args.plain_passwords)
+    try:
+        with open(args.file, newline='', encoding='utf-8') as file:
+            importer.run(read_rows(file, data_format))
+    finally:
+        saver.stop()
+        if errors_file is not None:
+            errors_file.close()
+
+    elapsed = time.perf_counter() - started
+    rows = importer.imported + importer.refused
+    print(f"Imported {importer.imported} of {rows} {args.kind} in {elapsed:.1f} s "
+          f"({rows / max(elapsed, 1e-9):.0f} rows/s), {importer.refused} refused.")
+    if importer.plain_passwords and not args.plain_passwords:
+        print(f"Hashed {importer.plain_passwords} passwords in {importer.hashing_seconds:.1f} s "
+              f"({importer.plain_passwords / max(importer.hashing_seconds, 1e-9):.1f} per second "
+              f"with {os.cpu_count()} hashing threads).")
+    elif importer.plain_passwords:
+        print(f"Warning: {importer.plain_passwords} passwords are stored in plain text until the user's "
+              f"first login.")
+    for message in importer.shown_errors:
+        print(message)
+    if importer.refused > len(importer.shown_errors):
+        print(f"... and {importer.refused - len(importer.shown_errors)} more"
+              + (f", see {args.errors}" if args.errors else ", use --errors to list them all"))
+    if importer.refused:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+# HTTP/JSON service over the crowdfunding data, for clients that don't use the console.
+# One asyncio event loop serves every connection from the in-memory state of the JSON backend.
+# Reads run in a reader thread pool, since a read can block: it reads projects.json again after
+# another process compacted the journal, builds the title index the first time, and waits for the
+# data lock while a writer applies its change. Writes (register, donate) run in a small thread pool so the
+# disk writes never stop the loop; they are serialized by the file lock, and donations made at
+# the same time share one journal write and fsync (group commit). The fsync runs without the data
+# lock, so it doesn't hold up the readers either. Password hashing (register,
+# login) runs in its own pool, hashlib releases the GIL meanwhile. Requests after the login are
+# checked against the session cache, without hashing again.
+# Run: python crowdfunding_api.py --port 8080
+#
+# POST /register                {"first_name", "last_name", "email", "password", "mobile_phone"}
+# POST /login                   {"email", "password"} -> {"token"}
+# POST /logout                  with the header "Authorization: Bearer <token>"
+# GET  /projects                ?offset=0&limit=50&sort=listed|title|end_date|funded|raised
+# GET  /projects/<id>
+# GET  /projects/search         ?q=words  or  ?start=YYYY-MM-DD&end=YYYY-MM-DD  or  ?active_on=YYYY-MM-DD
+# POST /projects/<id>/donate    {"amount"}, with the header "Authorization: Bearer <token>"
+# GET  /leaderboards/funded     ?limit=10, also /leaderboards/backers and /leaderboards/creators
+# GET  /stats                   ?date=YYYY-MM-DD&creator=email, the amount raised that day (default
+#                               today) and by the creator's projects
+
+
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import math
+import os
+import traceback
+from urllib.parse import parse_qs, urlsplit
+
+from Final_Crowdfunding import (LEADERBOARD_SIZE, SORT_ORDERS, ConflictError, JsonStorage, SessionCache, User,
+                                check_credentials, funded_ratio, hash_password, is_valid_egyptian_number,
+                                load_snapshot, parse_date, saver)
+
+# largest request body accepted, and the most projects returned by one listing
+MAX_BODY = 1 << 20
+MAX_LIMIT = 500
+REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 401: 'Unauthorized', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+# a request that is answered with an error status and {"error": message}
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# what clients see of a project: the creator email and the number of backers instead of user ids
+def project_to_json(project):
+    return {
+        'project_id': project.project_id,
+        'title': project.title,
+        'details': project.details,
+        'target_amount': project.target_amount,
+        'start_date': project.start_date,
+        'end_date': project.end_date,
+        'creator': project.creator,
+        'current_amount': project.current_amount,
+        'backers': len(project.backers),
+        'closed': project.closed,
+        'successful': project.successful if project.closed else None
+    }
+
+
+# the values of the given keys of a JSON object body, all of them required
+def required(data, *keys):
+    missing = [key for key in keys if not isinstance(data.get(key), str) or not data[key]]
+    if missing:
+        raise HttpError(400, f"Missing fields: {', '.join(missing)}.")
+    return [data[key] for key in keys]
+
+
+# a non-negative integer query parameter
+def int_parameter(query, name, default):
+    try:
+        value = int(query.get(name, default))
+    except ValueError:
+        raise HttpError(400, f"{name} must be a number.")
+    if value < 0:
+        raise HttpError(400, f"{name} must not be negative.")
+    return value
+
+
+# the date query parameter, checked by the same helper the console uses
+def date_parameter(query, name):
+    try:
+        return parse_date(query[name])
+    except ValueError:
+        raise HttpError(400, f"{name} must be a date (YYYY-MM-DD).")
+
+
+# offset and limit of the page a request asks for
+def page_bounds(query):
+    return int_parameter(query, 'offset', 0), min(int_parameter(query, 'limit', 50), MAX_LIMIT)
+
+
+# one page of the project listing in the requested order, only that page is sorted out of the projects
+def sorted_page(query, storage):
+    sort = query.get('sort', 'listed')
+    if sort not in SORT_ORDERS:
+        raise HttpError(400, f"sort must be one of: {', '.join(SORT_ORDERS)}.")
+    offset, limit = page_bounds(query)
+    projects, total = storage.projects_page(sort, offset, limit)
+    return {'total': total, 'offset': offset, 'projects': [project_to_json(project) for project in projects]}
+
+
+# one page of projects, with the total so clients can ask for the next page
+def page(query, projects):
+    offset, limit = page_bounds(query)
+    return {'total': len(projects), 'offset': offset,
+            'projects': [project_to_json(project) for project in projects[offset:offset + limit]]}
+
+
+# NaN, Infinity and -Infinity are not JSON, json.loads() only refuses them with this as parse_constant
+def reject_constant(name):
+    raise ValueError(f"{name} is not allowed")
+
+
+class CrowdfundingApi:
+    def __init__(self, storage, write_threads=8, read_threads=4):
+        self.storage = storage
+        self.sessions = SessionCache()  # login token -> email
+        self.readers = concurrent.futures.ThreadPoolExecutor(read_threads, thread_name_prefix='api-reader')
+        # several writer threads, so donations arriving together can be committed as one group
+        self.writers = concurrent.futures.ThreadPoolExecutor(write_threads, thread_name_prefix='api-writer')
+        # a password hash takes a good part of a second of CPU, one thread per core
+        self.hashers = concurrent.futures.ThreadPoolExecutor(os.cpu_count(), thread_name_prefix='api-hasher')
+
+    # run a storage read in the reader threads, it may have to reload the files or build an index first
+    async def read(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.readers, function, *args)
+
+    # run a storage change in the writer threads and wait for it without blocking the loop
+    async def write(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.writers, function, *args)
+
+    async def hash(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.hashers, function, *args)
+
+    # one client connection, kept open for more requests (HTTP/1.1 keep-alive)
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self.respond(writer, 400, {'error': "Malformed request line."}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                try:
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.respond(writer, 400, {'error': "Invalid Content-Length."}, False)
+                    break
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {'error': "Request body too large."}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, payload = await self.dispatch(method, target, headers, body)
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        data = json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                     f"Content-Type: application/json\r\n"
+                     f"Content-Length: {len(data)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+        await writer.drain()
+
+    # route a request to its handler, errors become JSON error responses
+    async def dispatch(self, method, target, headers, body):
+        url = urlsplit(target)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+        try:
+            if parts == ['register']:
+                self.expect(method, 'POST')
+                return await self.register(self.json_body(body))
+            if parts == ['login']:
+                self.expect(method, 'POST')
+                return await self.login(self.json_body(body))
+            if parts == ['logout']:
+                self.expect(method, 'POST')
+                return self.logout(headers)
+            if parts == ['projects']:
+                self.expect(method, 'GET')
+                return 200, await self.read(sorted_page, query, self.storage)
+            if parts == ['projects', 'search']:
+                self.expect(method, 'GET')
+                return 200, await self.read(lambda: page(query, self.search(query)))
+            if len(parts) == 2 and parts[0] == 'projects':
+                self.expect(method, 'GET')
+                return 200, await self.read(lambda: project_to_json(self.find_project(parts[1])))
+            if len(parts) == 2 and parts[0] == 'leaderboards':
+                self.expect(method, 'GET')
+                return 200, await self.read(self.leaderboard, parts[1], query)
+            if parts == ['stats']:
+                self.expect(method, 'GET')
+                return 200, await self.read(self.stats, query)
+            if len(parts) == 3 and parts[0] == 'projects' and parts[2] == 'donate':
+                self.expect(method, 'POST')
+                return await self.donate(headers, parts[1], self.json_body(body))
+            raise HttpError(404, "No such resource.")
+        except HttpError as error:
+            return error.status, {'error': error.message}
+        except ConflictError as error:
+            return 409, {'error': str(error)}
+        except Exception:
+            traceback.print_exc()
+            return 500, {'error': "Internal error."}
+
+    def expect(self, method, allowed):
+        if method != allowed:
+            raise HttpError(405, f"Use {allowed}.")
+
+    def json_body(self, body):
+        try:
+            data = json.loads(body, parse_constant=reject_constant)
+        except ValueError:
+            raise HttpError(400, "The body must be a JSON object.")
+        if not isinstance(data, dict):
+            raise HttpError(400, "The body must be a JSON object.")
+        return data
+
+    def bearer_token(self, headers):
+        scheme, _, token = headers.get('authorization', '').partition(' ')
+        return token if scheme.lower() == 'bearer' else None
+
+    # the email of the logged-in user sending the request
+    def authenticate(self, headers):
+        token = self.bearer_token(headers)
+        email = self.sessions.get(token) if token else None
+        if email is None:
+            raise HttpError(401, "Log in first and send the token as 'Authorization: Bearer <token>'.")
+        return email
+
+    def find_project(self, project_id):
+        try:
+            project = self.storage.find_project(int(project_id))
+        except ValueError:
+            project = None
+        if project is None:
+            raise HttpError(404, "No such project.")
+        return project
+
+    async def register(self, data):
+        first_name, last_name, email, password, mobile_phone = required(
+            data, 'first_name', 'last_name', 'email', 'password', 'mobile_phone')
+        if not is_valid_egyptian_number(mobile_phone):
+            raise HttpError(400, "Invalid mobile phone number. Please enter a valid Egyptian number.")
+        password_hash = await self.hash(hash_password, password)
+        user = await self.write(self.add_user, first_name, last_name, email, password_hash, mobile_phone)
+        return 201, {'user_id': user.user_id, 'email': user.email}
+
+    # runs in a writer thread, creating the User gives out a user id
+    def add_user(self, first_name, last_name, email, password_hash, mobile_phone):
+        user = User(first_name, last_name, email, password_hash, mobile_phone)
+        self.storage.add_user(user)
+        return user
+
+    async def login(self, data):
+        email, password = required(data, 'email', 'password')
+        user = await self.hash(check_credentials, self.storage, email, password)
+        if user is None:
+            raise HttpError(401, "Invalid email or password.")
+        return 200, {'token': self.sessions.create(user.email), 'first_name': user.first_name}
+
+    def logout(self, headers):
+        token = self.bearer_token(headers)
+        if not token or self.sessions.get(token) is None:
+            raise HttpError(401, "Not logged in.")
+        self.sessions.remove(token)
+        return 200, {}
+
+    def search(self, query):
+        if 'q' in query:
+            return self.storage.search_title(query['q'])
+        if 'start' in query and 'end' in query:
+            return self.storage.search_started_between(date_parameter(query, 'start'), date_parameter(query, 'end'))
+        if 'active_on' in query:
+            return self.storage.search_active_on(date_parameter(query, 'active_on'))
+        raise HttpError(400, "Search with q, start and end, or active_on.")
+
+    # the top entries of a leaderboard, kept up to date by the storage so this reads only those
+    def leaderboard(self, name, query):
+        limit = min(int_parameter(query, 'limit', LEADERBOARD_SIZE), MAX_LIMIT)
+        if name == 'funded':
+            entries = [{**project_to_json(project), 'funded': funded_ratio(project)}
+                       for project in self.storage.top_funded(limit)]
+        elif name == 'backers':
+            entries = [{**project_to_json(project), 'unique_backers': backers}
+                       for project, backers in self.storage.top_backed(limit)]
+        elif name == 'creators':
+            entries = [{'creator': email, 'raised': total} for email, total in self.storage.top_creators(limit)]
+        else:
+            raise HttpError(404, "No such leaderboard, use funded, backers or creators.")
+        return {'leaderboard': name, 'entries': entries}
+
+    def stats(self, query):
+        date = date_parameter(query, 'date') if 'date' in query else datetime.date.today().isoformat()
+        result = {'date': date, 'raised': self.storage.raised_on(date)}
+        if 'creator' in query:
+            result['creator'] = query['creator']
+            result['creator_raised'] = self.storage.creator_total(query['creator'])
+        return result
+
+    async def donate(self, headers, project_id, data):
+        email = self.authenticate(headers)
+        project = await self.read(self.find_project, project_id)
+        amount = data.get('amount')
+        # a number too large for a float, like 1e400, is read as infinity
+        if (isinstance(amount, bool) or not isinstance(amount, (int, float)) or not math.isfinite(amount)
+                or amount <= 0):
+            raise HttpError(400, "Invalid donation amount. Please enter a positive amount.")
+        await self.write(self.storage.donate, project, email, float(amount))
+        return 200, {'project_id': project.project_id, 'current_amount': project.current_amount}
+
+
+async def serve(host, port, use_snapshot):
+    api = CrowdfundingApi(JsonStorage())
+    if use_snapshot:
+        load_snapshot()
+    api.storage.load_users()
+    api.storage.load_projects()
+    saver.start()
+    server = await asyncio.start_server(api.handle_connection, host, port, backlog=1024)
+    print(f"Serving on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        api.readers.shutdown()
+        api.writers.shutdown()
+        api.hashers.shutdown()
+        saver.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP/JSON service for the crowdfunding data")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--snapshot', action='store_true', help="start from the binary snapshot when it is up to date")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.snapshot))
+    except KeyboardInterrupt:
+        print("Stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# Stress test of the donation path with several processes sharing the same data.
+# Every process donates to random projects from a few threads at once. When they are done, a fresh
+# process reads the totals back and compares them with what the workers donated: a lost update,
+# a journal line written twice or a torn write shows up as a wrong total or backer count.
+# The amounts are whole numbers, so the expected totals are exact.
+# Run: python donation_stress.py --processes 8 --threads 4 --donations 500 [--storage sqlite] [--no-saver]
+# --no-saver leaves the write-behind saver stopped, like when another script uses the module: the
+# thread that fills up the journal then compacts it right away.
+# The JSON backend relies on fcntl file locks, so run it on Linux or macOS.
+
+
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import Final_Crowdfunding
+
+
+def make_storage(storage_name):
+    if storage_name == 'sqlite':
+        return Final_Crowdfunding.SqliteStorage()
+    return Final_Crowdfunding.JsonStorage()
+
+
+# the users and projects every worker donates to, in a new directory
+def create_data(directory, storage_name, project_count, user_count):
+    os.chdir(directory)
+    storage = make_storage(storage_name)
+    users = [Final_Crowdfunding.User(f"first{i}", f"last{i}", f"user{i}@example.com", f"password{i}",
+                                     f"+2010{i:08d}") for i in range(user_count)]
+    storage.save_users(users)
+    projects = [Final_Crowdfunding.Project(f"project {i}", f"details of project {i}", 1000000.0, '2024-01-01',
+                                           '2099-12-31', users[i % user_count].user_id, project_id=i + 1)
+                for i in range(project_count)]
+    storage.save_projects(projects)
+
+
+# one worker process: donations from several threads, the saver compacts the journal meanwhile
+# like it does in the console, or the donating threads do without it. sends back what was donated to each project
+def donate_worker(directory, storage_name, threads, donations, user_count, seed, compact_every, use_saver,
+                  barrier, results):
+    os.chdir(directory)
+    Final_Crowdfunding.COMPACT_EVERY = compact_every
+    storage = make_storage(storage_name)
+    projects = storage.load_projects()
+    if storage_name == 'json' and use_saver:
+        Final_Crowdfunding.saver.start()
+
+    totals = {}  # project id -> [amount, number of donations]
+    totals_lock = threading.Lock()
+
+    def run(thread_number):
+        rng = random.Random(seed * 1000 + thread_number)
+        for _ in range(donations):
+            project = rng.choice(projects)
+            amount = float(rng.randint(1, 100))
+            storage.donate(project, f"user{rng.randrange(user_count)}@example.com", amount)
+            with totals_lock:
+                total = totals.setdefault(project.project_id, [0.0, 0])
+                total[0] += amount
+                total[1] += 1
+
+    workers = [threading.Thread(target=run, args=(number,)) for number in range(threads)]
+    barrier.wait()  # every process starts donating at the same time
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    finished = time.perf_counter()
+    Final_Crowdfunding.saver.stop()
+    results.put((totals, finished - started))
+
+
+# the totals and backer counts as a fresh process reads them
+def read_totals(directory, storage_name, results):
+    os.chdir(directory)
+    projects = make_storage(storage_name).load_projects()
+    results.put({project.project_id: [project.current_amount, len(project.backers)] for project in projects})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Donate from several processes at once and check the totals")
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4, help="donating threads in each process")
+    parser.add_argument('--donations', type=int, default=500, help="donations made by each thread")
+    parser.add_argument('--projects', type=int, default=50)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--compact-every', type=int, default=Final_Crowdfunding.COMPACT_EVERY,
+                        help="journal entries before a compaction (json storage)")
+    parser.add_argument('--no-saver', action='store_true',
+                        help="don't start the saver thread, the journal is compacted by the donating threads")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help="keep the data directory")
+    args = parser.parse_args()
+
+    # new processes import the module again instead of copying this process's cached data
+    context = multiprocessing.get_context('spawn')
+    directory = tempfile.mkdtemp(prefix='donation_stress_')
+    try:
+        create_data(directory, args.storage, args.projects, args.users)
+        barrier = context.Barrier(args.processes)
+        results = context.Queue()
+        processes = [context.Process(target=donate_worker, args=(
+            directory, args.storage, args.threads, args.donations, args.users, args.seed * 100 + number,
+            args.compact_every, not args.no_saver, barrier, results)) for number in range(args.processes)]
+        for process in processes:
+            process.start()
+        worker_results = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        expected = {}
+        for totals, _ in worker_results:
+            for project_id, (amount, count) in totals.items():
+                total = expected.setdefault(project_id, [0.0, 0])
+                total[0] += amount
+                total[1] += count
+        reader = context.Process(target=read_totals, args=(directory, args.storage, results))
+        reader.start()
+        actual = results.get()
+        reader.join()
+    finally:
+        os.chdir(os.path.dirname(directory))
+        if args.keep:
+            print(f"data kept in {directory}")
+        else:
+            shutil.rmtree(directory)
+
+    donation_count = args.processes * args.threads * args.donations
+    elapsed = max(seconds for _, seconds in worker_results)
+    print(f"{args.processes} processes x {args.threads} threads x {args.donations} donations = "
+          f"{donation_count} donations in {elapsed:.2f} s: {donation_count / elapsed:.0f} donations/s "
+          f"({args.storage} storage{', no saver' if args.no_saver else ''})")
+
+    wrong = [project_id for project_id in actual
+             if actual[project_id] != expected.get(project_id, [0.0, 0])]
+    if wrong or len(actual) != args.projects:
+        for project_id in wrong[:10]:
+            print(f"project {project_id}: expected {expected.get(project_id, [0.0, 0])} "
+                  f"(amount, backers), found {actual[project_id]}")
+        print(f"FAILED: {len(wrong)} of {args.projects} projects have wrong totals")
+        sys.exit(1)
+    print(f"OK: the totals and backers of all {args.projects} projects are exact")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# Seeded generator of realistic users, projects and donations for benchmarks and load tests.
+# The same seed always gives the same data. users.json and projects.json are written in the
+# current file format one record at a time, so even 10^7 records never have to fit in memory.
+# Donations are spread unevenly, a few popular projects get most of them, and are folded into
+# the totals and backers of the projects like a compacted journal.
+# Run: python generate_data.py --scale 100000 [--directory data] [--seed 1] [--plain-passwords]
+#      python generate_data.py --users 5000 --projects 20000 --donations 1000000
+# Every generated user can log in with the email userN@example.com and the password passwordN.
+# The passwords are hashed one thread per core, which takes hours for millions of users.
+# --plain-passwords writes them in plain text, only for throwaway benchmark data; each one is
+# replaced by its hash the first time the user logs in.
+
+
+import argparse
+import concurrent.futures
+import datetime
+import itertools
+import json
+import os
+import random
+import time
+
+from Final_Crowdfunding import (FORMAT_VERSION, JOURNAL_FILE, PROJECTS_FILE, SNAPSHOT_FILE, USERS_FILE,
+                                hash_password, write_atomically)
+
+FIRST_NAMES = ['Ahmed', 'Mohamed', 'Mahmoud', 'Omar', 'Youssef', 'Mostafa', 'Karim', 'Hassan', 'Ali', 'Tarek',
+               'Nada', 'Mariam', 'Fatma', 'Salma', 'Nour', 'Hana', 'Aya', 'Yasmin', 'Laila', 'Dina']
+LAST_NAMES = ['Fayd', 'Hossam', 'Ibrahim', 'Mostafa', 'Abdelrahman', 'Saleh', 'Kamal', 'Fathy', 'Ramadan',
+              'Soliman', 'Gamal', 'Nasser', 'Farouk', 'Adel', 'Samir']
+CAUSES = ['school', 'clinic', 'water well', 'library', 'farm', 'bakery', 'workshop', 'solar panels', 'playground',
+          'orphanage', 'food bank', 'mosque', 'church', 'hospital wing', 'computer lab', 'sewing class']
+PLACES = ['Cairo', 'Giza', 'Alexandria', 'Aswan', 'Luxor', 'Mansoura', 'Tanta', 'Assiut', 'Minya', 'Sohag',
+          'Fayoum', 'Ismailia', 'Suez', 'Port Said', 'Damietta', 'Qena', 'Beni Suef', 'Zagazig']
+MOBILE_PREFIXES = ['10', '11', '12', '15']
+# users whose passwords are hashed together, so only that many are held in memory
+HASH_BATCH = 10000
+
+
+# the list of records of a file in the current format, one record per line, written as it is
+# generated. header keys go after the list because some of them are only known at the end
+def records_file(records_key, records, header=lambda: {}):
+    yield f'{{"version": {FORMAT_VERSION}, "{records_key}": [\n'
+    separator = ''
+    for record in records:
+        yield separator + json.dumps(record)
+        separator = ',\n'
+    yield '\n]' + ''.join(f', "{key}": {json.dumps(value)}' for key, value in header().items()) + '}\n'
+
+
+def generate_users(count, rng):
+    for user_id in range(1, count + 1):
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        yield {
+            'user_id': user_id,
+            'first_name': first_name,
+            'last_name': last_name,
+            'email': f"user{user_id}@example.com",
+            'password': f"password{user_id}",
+            'mobile_phone': f"+20{MOBILE_PREFIXES[user_id % 4]}{user_id % 100000000:08d}"
+        }
+
+
+# the users with their passwords replaced by hashes. hashlib lets go of the GIL while hashing,
+# so the threads hash on every core
+def hash_passwords(users):
+    with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as hashers:
+        while True:
+            batch = list(itertools.islice(users, HASH_BATCH))
+            if not batch:
+                return
+            passwords = [user['password'] for user in batch]
+            for user, password_hash in zip(batch, hashers.map(hash_password, passwords)):
+                user['password'] = password_hash
+                yield user
+
+
+# projects of the last two years, each running one to six months. donations per project follow
+# a Pareto distribution around the requested average, the amounts a log-normal one around 200 EGP.
+# the amount donated per day is added up into raised_by_day
+def generate_projects(count, user_count, donation_count, rng, today, raised_by_day):
+    average = donation_count / count if count else 0
+    for project_id in range(1, count + 1):
+        start = today - datetime.timedelta(days=rng.randint(0, 730))
+        end = start + datetime.timedelta(days=rng.randint(30, 180))
+        # the Pareto distribution with shape 2 has a mean of 2, the random rounding keeps the average
+        donations = int(rng.paretovariate(2) * average / 2 + rng.random())
+        backers = [rng.randint(1, user_count) for _ in range(donations)]
+        current_amount = 0.0
+        last_day = min(end, today)
+        days = (last_day - start).days
+        for _ in range(donations):
+            amount = float(max(10, round(rng.lognormvariate(5.3, 1.0))))
+            current_amount += amount
+            day = (start + datetime.timedelta(days=rng.randint(0, days))).isoformat()
+            raised_by_day[day] = raised_by_day.get(day, 0.0) + amount
+        yield {
+            'title': f"{rng.choice(CAUSES).capitalize()} in {rng.choice(PLACES)} #{project_id}",
+            'details': f"Help us build a {rng.choice(CAUSES)} for the people of {rng.choice(PLACES)}.",
+            'target_amount': float(round(10 ** rng.uniform(3, 6), -2)),
+            'start_date': start.isoformat(),
+            'end_date': end.isoformat(),
+            'creator_id': rng.randint(1, user_count),
+            'current_amount': current_amount,
+            'backers': backers,
+            'closed': end < today,
+            'project_id': project_id,
+            'version': 0
+        }
+
+
+# write users.json and projects.json into the directory, replacing what is there.
+# returns the number of donations, which is only about the requested number
+def generate(directory, user_count, project_count, donation_count, seed=1, plain_passwords=False):
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    os.makedirs(directory, exist_ok=True)
+    # the journal and the snapshot belong to the data being replaced
+    for file_name in (JOURNAL_FILE, SNAPSHOT_FILE):
+        try:
+            os.remove(os.path.join(directory, file_name))
+        except FileNotFoundError:
+            pass
+
+    users = generate_users(max(user_count, 1), rng)
+    if not plain_passwords:
+        users = hash_passwords(users)
+    write_atomically(os.path.join(directory, USERS_FILE), records_file('users', users))
+    raised_by_day = {}
+    donations = [0]
+
+    def projects():
+        for project in generate_projects(project_count, max(user_count, 1), donation_count, rng, today,
+                                         raised_by_day):
+            donations[0] += len(project['backers'])
+            yield project
+
+    write_atomically(os.path.join(directory, PROJECTS_FILE),
+                     records_file('projects', projects(),
+                                  lambda: {'journal_seq': 0, 'raised_by_day': dict(sorted(raised_by_day.items()))}))
+    return donations[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate users, projects and donations")
+    parser.add_argument('--scale', type=int, default=1000,
+                        help="number of projects and users, with five donations per project (default: 1000)")
+    parser.add_argument('--users', type=int, help="default: the scale")
+    parser.add_argument('--projects', type=int, help="default: the scale")
+    parser.add_argument('--donations', type=int, help="default: five times the scale")
+    parser.add_argument('--directory', default='.', help="where users.json and projects.json are written")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--plain-passwords', action='store_true',
+                        help="write the passwords unhashed until the first login, only for throwaway benchmark data")
+    args = parser.parse_args()
+
+    users = args.users if args.users is not None else args.scale
+    projects = args.projects if args.projects is not None else args.scale
+    donations = args.donations if args.donations is not None else 5 * args.scale
+    started = time.perf_counter()
+    donation_count = generate(args.directory, users, projects, donations, args.seed, args.plain_passwords)
+    print(f"Generated {users} users, {projects} projects and {donation_count} donations in {args.directory} "
+          f"in {time.perf_counter() - started:.1f} s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Measures how much memory the projects take once they are loaded.
+# The same generated version 1 projects.json data is loaded twice: once into dict-backed objects
+# the way the console used to keep them (a copy of the creator record in every project
+# and a list of email strings for the backers), and once into the compact Project class
+# (__slots__, interned creator id and an array of backer ids).
+# Run: python memory_benchmark.py --projects 10000 --users 50000 --donations 1000000
+
+
+import argparse
+import json
+import random
+import tracemalloc
+
+from Final_Crowdfunding import Project
+
+
+# the dict-backed project class used before the compact representation
+class LegacyProject:
+    def __init__(self, title, details, target_amount, start_date, end_date, creator, current_amount=0, backers=None, closed=False, project_id=None):
+        self.title = title
+        self.details = details
+        self.target_amount = target_amount
+        self.start_date = start_date
+        self.end_date = end_date
+        self.creator = creator
+        self.current_amount = current_amount
+        self.backers = backers if backers is not None else []
+        self.closed = closed
+        self.project_id = project_id
+
+
+# projects.json text in the version 1 file format, with the donations spread over random projects
+def generate_projects_json(project_count, user_count, donation_count, seed):
+    rng = random.Random(seed)
+    users = [{
+        'first_name': f"first{i}",
+        'last_name': f"last{i}",
+        'email': f"user{i}@example.com",
+        'password': f"password{i}",
+        'mobile_phone': f"+2010{i:08d}"
+    } for i in range(user_count)]
+
+    projects = [{
+        'title': f"project {i}",
+        'details': f"details of project {i}",
+        'target_amount': float(rng.randint(1000, 100000)),
+        'start_date': '2024-01-01',
+        'end_date': '2024-12-31',
+        'creator': rng.choice(users),
+        'current_amount': 0.0,
+        'backers': [],
+        'closed': False,
+        'project_id': i + 1
+    } for i in range(project_count)]
+
+    for _ in range(donation_count):
+        project = rng.choice(projects)
+        project['current_amount'] += 10.0
+        project['backers'].append(rng.choice(users)['email'])
+    return json.dumps(projects)
+
+
+# memory held by the objects built from the parsed file, once the parsed dictionaries are gone
+def measure(model, text):
+    tracemalloc.start()
+    projects = [model(**data) for data in json.loads(text)]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(projects), current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the memory used by legacy and compact projects")
+    parser.add_argument('--projects', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--donations', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    text = generate_projects_json(args.projects, args.users, args.donations, args.seed)
+    print(f"{args.projects} projects, {args.users} users, {args.donations} donations "
+          f"({len(text) / 2 ** 20:.1f} MiB of JSON)")
+
+    results = []
+    for name, model in (('legacy', LegacyProject), ('compact', Project)):
+        count, current, peak = measure(model, text)
+        results.append(current)
+        print(f"{name:8} {count} projects: {current / 2 ** 20:8.1f} MiB resident, "
+              f"{peak / 2 ** 20:8.1f} MiB peak while loading")
+    print(f"compact uses {results[1] / results[0]:.1%} of the legacy memory")
+
+
+if __name__ == "__main__":
+    main()
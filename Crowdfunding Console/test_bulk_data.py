@@ -0,0 +1,113 @@
+# Tests of the row validation of the bulk importer in bulk_data.py. The chunks are committed to a
+# stub storage that records them, so no files are written.
+# Run: python -m unittest test_bulk_data  (or python -m pytest test_bulk_data.py)
+
+
+import json
+import unittest
+
+import bulk_data
+from Final_Crowdfunding import hash_password, is_password_hash, verify_password
+
+
+# the storage methods the importer calls, every email is registered and every donation accepted
+class StubStorage:
+    def __init__(self):
+        self.donations = []
+        self.projects = []
+        self.users = []
+
+    def registered_emails(self, emails):
+        return {email.casefold() for email in emails}
+
+    def find_project(self, project_id):
+        return None
+
+    def add_donations(self, donations):
+        self.donations.extend(donations)
+
+    def add_projects(self, projects):
+        self.projects.extend(projects)
+
+    def add_users(self, users):
+        self.users.extend(users)
+        return []
+
+
+# nobody is registered yet, so every user can be imported
+class EmptyStorage(StubStorage):
+    def registered_emails(self, emails):
+        return set()
+
+
+class ImportTest(unittest.TestCase):
+    def import_rows(self, kind, rows, storage=None, **options):
+        storage = storage or StubStorage()
+        importer = bulk_data.Importer(storage, kind, chunk_size=100, **options)
+        importer.run(bulk_data.read_rows([json.dumps(row) + '\n' for row in rows], 'jsonl'))
+        return storage, importer
+
+    def donation(self, amount, timestamp=None):
+        return {'project_id': 1, 'backer': 'backer@example.com', 'amount': amount, 'timestamp': timestamp}
+
+    def test_valid_donation(self):
+        storage, importer = self.import_rows('donations', [self.donation(5), self.donation("2.5", "2024-03-01")])
+        self.assertEqual(importer.refused, 0)
+        self.assertEqual([donation.amount for donation in storage.donations], [5.0, 2.5])
+        self.assertEqual(storage.donations[1].timestamp, '2024-03-01T00:00:00')
+
+    def test_amount_must_be_finite(self):
+        rows = [self.donation(value) for value in ["nan", "NaN", "inf", "-inf", "Infinity", float('nan')]]
+        storage, importer = self.import_rows('donations', rows)
+        self.assertEqual(storage.donations, [])
+        self.assertEqual(importer.refused, len(rows))
+        self.assertTrue(all("not a finite number" in message for message in importer.shown_errors))
+
+    def test_amount_must_be_positive(self):
+        storage, importer = self.import_rows('donations', [self.donation(0), self.donation(-3), self.donation("x")])
+        self.assertEqual(storage.donations, [])
+        self.assertEqual(importer.refused, 3)
+
+    def test_timestamp_must_be_a_date(self):
+        storage, importer = self.import_rows('donations', [self.donation(5, "soon")])
+        self.assertEqual(storage.donations, [])
+        self.assertIn("timestamp is not a date", importer.shown_errors[0])
+
+    def test_target_amount_must_be_finite(self):
+        project = {'title': 't', 'details': 'd', 'start_date': '2024-01-01', 'end_date': '2024-02-01',
+                   'creator': 'creator@example.com'}
+        storage, importer = self.import_rows('projects', [{**project, 'target_amount': "inf"},
+                                                          {**project, 'target_amount': 100,
+                                                           'current_amount': "nan"},
+                                                          {**project, 'target_amount': 100}])
+        self.assertEqual(importer.refused, 2)
+        self.assertEqual(len(storage.projects), 1)
+
+    def user(self, number, password):
+        return {'first_name': 'First', 'last_name': 'Last', 'email': f"user{number}@example.com",
+                'password': password, 'mobile_phone': '+201012345678'}
+
+    def test_passwords_are_hashed(self):
+        exported = hash_password('secret2', iterations=1000)
+        storage, importer = self.import_rows('users', [self.user(1, 'secret1'), self.user(2, exported)],
+                                             EmptyStorage())
+        self.assertEqual(importer.plain_passwords, 1)
+        first, second = storage.users
+        self.assertTrue(is_password_hash(first.password))
+        self.assertTrue(verify_password(first.password, 'secret1'))
+        # a hash from an export is kept as it is
+        self.assertEqual(second.password, exported)
+
+    def test_plain_passwords_only_when_asked(self):
+        storage, importer = self.import_rows('users', [self.user(1, 'secret1')], EmptyStorage(),
+                                             hash_passwords=False)
+        self.assertEqual(storage.users[0].password, 'secret1')
+        self.assertEqual(importer.plain_passwords, 1)
+
+    def test_damaged_hash_matches_no_password(self):
+        for damaged in ['pbkdf2_sha256$', 'pbkdf2_sha256$many$salt$digest', 'pbkdf2_sha256$0$00$00']:
+            self.assertFalse(verify_password(damaged, 'secret1'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,42 +4,136 @@
 # We define tasks using the @task decorator and then connect to each host to execute the tasks.
 # The connect_kwargs parameter is used to provide the password for connecting to the remote hosts.
 # Replace 'user@host1', 'user@host2' and 'password' with actual SSH login information for your remote hosts.
+#
+# The hosts are worked on in parallel, at most --workers at a time, so a run over the whole fleet takes about as long
+# as the slowest host instead of the sum of all hosts. Each host runs the tasks one after the other in its own thread,
+# since a task can depend on an earlier one. Fabric's ThreadingGroup runs a single command on all hosts at once,
+# here every host runs a whole list of tasks, so a thread pool runs run_host() per host instead.
+# A failing task or host doesn't stop the others. The results of every host are kept apart, the output of its
+# commands is shown when the host is done and a summary table of all hosts and tasks is printed at the end.
+# connect(host) makes the connections, run_on_hosts() takes another factory to run the tasks against a local
+# SSH server (localhost sshd or a paramiko test server).
+#
+# Every c.run() or c.put() waits for a round-trip to the host, so the round-trips are cut down:
+# a ConnectionPool keeps one connection per host open (with SSH keepalives) for all the tasks and runs, instead of
+# connecting again, and the SFTP session of the connection is reused by every transfer. Independent commands go
+# through run_commands(): in 'batch' mode they are sent as one script over one channel and their outputs are split
+# again, in 'pipeline' mode each one gets its own channel on the same connection and they all run at once,
+# 'serial' runs them one after the other like before. execute_script runs chmod and the script in one go.
+# Run: python 1.py [--hosts user@host1 user@host2] [--tasks run_command copy_file] [--workers 10]
+#                  [--mode batch|pipeline|serial] [--no-pool]
 
 
-from fabric import Connection, task
+import argparse
+import concurrent.futures
+import secrets
+import threading
+import time
+
+from fabric import Config, Connection, task
 
 # Define hosts and user
 hosts = ['user@host1', 'user@host2']
 password = 'password'
+# hosts worked on at the same time
+WORKERS = 10
+# seconds between the SSH keepalives of the pooled connections, so idle connections are not dropped
+KEEPALIVE = 30
+# channels open at once on one connection in 'pipeline' mode, sshd allows 10 sessions by default
+PIPELINE_CHANNELS = 8
+# how run_commands() sends independent commands: 'batch', 'pipeline' or 'serial'
+command_mode = 'batch'
+
+
+# the result of one command of run_commands(), with the stdout and exit code like the Result of c.run()
+class CommandResult:
+    def __init__(self, command, stdout, exited):
+        self.command = command
+        self.stdout = stdout
+        self.exited = exited
+
+    @property
+    def ok(self):
+        return self.exited == 0
+
+
+# raised by run_commands() when commands exited with an error, after all of them ran
+class CommandsFailed(Exception):
+    def __init__(self, results):
+        self.results = results
+        super().__init__(", ".join(f"'{result.command}' exited with {result.exited}"
+                                   for result in results if not result.ok))
+
+
+# the commands as one shell script, run over a single channel. every command runs in a subshell, so an
+# exit or cd doesn't reach the next one, and its exit code is printed behind a random marker, where the
+# output is split again. stderr is merged into the output
+def run_batched(c, commands):
+    marker = f"--batch-{secrets.token_hex(8)}--"
+    script = ''.join(f"( {command}\n) 2>&1; printf '\\n%s %d\\n' '{marker}' \"$?\"\n" for command in commands)
+    parts = c.run(script, hide=True, warn=True).stdout.split(f"\n{marker} ")
+    results = []
+    output = parts[0]
+    for command, part in zip(commands, parts[1:]):
+        exited, _, rest = part.partition('\n')
+        results.append(CommandResult(command, output, int(exited)))
+        output = rest
+    # the script stopped early (the connection dropped), the commands left did not run
+    for command in commands[len(results):]:
+        results.append(CommandResult(command, '', -1))
+    return results
+
+
+# every command on its own channel of the same connection, all at once, so they take as long as the
+# slowest one instead of the sum. paramiko opens the channels on the one transport from several threads
+def run_pipelined(c, commands):
+    c.open()
+    with concurrent.futures.ThreadPoolExecutor(min(len(commands), PIPELINE_CHANNELS)) as pool:
+        runs = list(pool.map(lambda command: c.run(command, hide=True, warn=True), commands))
+    return [CommandResult(command, run.stdout + run.stderr, run.exited) for command, run in zip(commands, runs)]
+
+
+# run independent commands in the command_mode, raises CommandsFailed if any of them failed
+def run_commands(c, commands, mode=None):
+    mode = mode or command_mode
+    if mode == 'batch':
+        results = run_batched(c, commands)
+    elif mode == 'pipeline':
+        results = run_pipelined(c, commands)
+    else:
+        results = [CommandResult(command, run.stdout + run.stderr, run.exited)
+                   for command, run in ((command, c.run(command, warn=True)) for command in commands)]
+    if not all(result.ok for result in results):
+        raise CommandsFailed(results)
+    return results
 
 # Example 1: Run a command on remote hosts
 
 
 @task
 def run_command(c):
-    c.run('uname -a')
+    return c.run('uname -a')
 
 # Example 2: Run multiple commands sequentially
 
 
 @task
 def run_multiple_commands(c):
-    c.run('ls -l')
-    c.run('df -h')
+    return run_commands(c, ['ls -l', 'df -h'])
 
 # Example 3: Copy a file from local to remote hosts
 
 
 @task
 def copy_file(c):
-    c.put('local_file.txt', '/remote/path/file.txt')
+    return c.put('local_file.txt', '/remote/path/file.txt')
 
 # Example 4: Copy a file from remote to local host
 
 
 @task
 def copy_file_from_remote(c):
-    c.get('/remote/path/file.txt', 'local_file.txt')
+    return c.get('/remote/path/file.txt', 'local_file.txt')
 
 # Example 5: Execute a script on remote hosts
 
@@ -47,18 +141,174 @@ def copy_file_from_remote(c):
 @task
 def execute_script(c):
     c.put('local_script.sh', '/remote/path/script.sh')
-    c.run('chmod +x /remote/path/script.sh')
-    c.run('/remote/path/script.sh')
+    # chmod and the script depend on each other, one command line saves a round-trip
+    return c.run('chmod +x /remote/path/script.sh && /remote/path/script.sh')
+
+
+# the tasks run on every host, in this order
+TASKS = [run_command, run_multiple_commands, copy_file, copy_file_from_remote, execute_script]
+
+
+# the connection to a host. the output of the commands is hidden and kept in the results instead,
+# the output of hosts running at the same time would be mixed up on the screen
+def connect(host):
+    return Connection(host, connect_kwargs={"password": password}, config=Config(overrides={'run': {'hide': True}}))
+
+
+# open connections by host, kept for every task and run instead of connecting again each time.
+# a host's connection is only used by the thread working on that host
+class ConnectionPool:
+    def __init__(self, connect=connect, keepalive=KEEPALIVE):
+        self.connect = connect
+        self.keepalive = keepalive
+        self.connections = {}
+        self.lock = threading.Lock()
+
+    # the open connection to the host, connecting (again) if there is none or it was dropped
+    def get(self, host):
+        with self.lock:
+            conn = self.connections.get(host)
+            if conn is None:
+                conn = self.connect(host)
+                self.connections[host] = conn
+        if not conn.is_connected:
+            conn.open()
+            conn.transport.set_keepalive(self.keepalive)
+        return conn
+
+    def close_all(self):
+        with self.lock:
+            connections = list(self.connections.values())
+            self.connections.clear()
+        for conn in connections:
+            conn.close()
+
+
+# the outcome of one task on one host
+class TaskResult:
+    def __init__(self, host, task_name, status, seconds, output='', error=None):
+        self.host = host
+        self.task_name = task_name
+        self.status = status  # 'ok', 'failed' or 'skipped'
+        self.seconds = seconds
+        self.output = output
+        self.error = error
+
+
+# the text printed by what a task returned: the output of its commands, nothing for file transfers
+def task_output(result):
+    if isinstance(result, list):
+        return ''.join(task_output(item) for item in result)
+    return getattr(result, 'stdout', '') or ''
+
+
+# run the tasks on one host one after the other, a failing task doesn't stop the next ones.
+# once the host can't be reached, the tasks left are skipped instead of waiting for the timeout again.
+# with a pool, its connection is used and left open for the next run
+def run_host(host, tasks, connect=connect, pool=None):
+    results = []
+    conn = None
+    reachable = True
+    try:
+        conn = pool.get(host) if pool is not None else connect(host)
+        for task_function in tasks:
+            name = task_function.__name__
+            if not reachable:
+                results.append(TaskResult(host, name, 'skipped', 0.0, error="host not reachable"))
+                continue
+            started = time.perf_counter()
+            try:
+                output = task_output(task_function(conn))
+                results.append(TaskResult(host, name, 'ok', time.perf_counter() - started, output))
+            except Exception as error:
+                results.append(TaskResult(host, name, 'failed', time.perf_counter() - started,
+                                          error=f"{type(error).__name__}: {error}"))
+                reachable = getattr(conn, 'is_connected', True)
+    except Exception as error:
+        # the connection factory itself failed
+        results.append(TaskResult(host, 'connect', 'failed', 0.0, error=f"{type(error).__name__}: {error}"))
+    finally:
+        if conn is not None and pool is None:
+            conn.close()
+    return results
+
+
+# everything a host printed and the errors of its tasks, as one block
+def host_report(host, results):
+    lines = [f"Running tasks on {host}:"]
+    for result in results:
+        lines.append(f"  {result.task_name}: {result.status} ({result.seconds:.2f} s)")
+        lines.extend(f"    {line}" for line in result.output.splitlines())
+        if result.error:
+            lines.append(f"    {result.error}")
+    return '\n'.join(lines) + '\n'
+
+
+# run the tasks on all hosts on a pool of at most workers threads. the report of every host is
+# printed as soon as it is done, returns host -> its task results, in the order of the hosts.
+# the connections come from the connection pool if there is one, else from connect()
+def run_on_hosts(hosts, tasks=TASKS, connect=connect, workers=WORKERS, connection_pool=None):
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max(1, min(workers, len(hosts))), thread_name_prefix='fabric') as pool:
+        futures = {pool.submit(run_host, host, tasks, connect, connection_pool): host for host in hosts}
+        for future in concurrent.futures.as_completed(futures):
+            host = futures[future]
+            results[host] = future.result()
+            print(host_report(host, results[host]), flush=True)
+    return {host: results[host] for host in hosts}
+
+
+# a table with a line per host and a column per task, and the time the run took
+def summary_table(results, elapsed):
+    task_names = []
+    for host_results in results.values():
+        for result in host_results:
+            if result.task_name not in task_names:
+                task_names.append(result.task_name)
+    width = max([len("host")] + [len(host) for host in results])
+    columns = [max(len(name), 7) for name in task_names]
+    lines = ["  ".join([f"{'host':<{width}}"] + [f"{name:<{column}}" for name, column in zip(task_names, columns)]
+                       + ["seconds"])]
+    failed_hosts = 0
+    total_seconds = 0.0
+    for host, host_results in results.items():
+        status = {result.task_name: result.status for result in host_results}
+        seconds = sum(result.seconds for result in host_results)
+        total_seconds += seconds
+        failed_hosts += any(result.status != 'ok' for result in host_results)
+        lines.append("  ".join([f"{host:<{width}}"]
+                               + [f"{status.get(name, '-'):<{column}}" for name, column in zip(task_names, columns)]
+                               + [f"{seconds:.2f}"]))
+    lines.append(f"{len(results) - failed_hosts} of {len(results)} hosts ran every task without errors, "
+                 f"in {elapsed:.2f} s ({total_seconds:.2f} s one host after the other)")
+    return '\n'.join(lines)
+
+
+def main():
+    global command_mode
+    parser = argparse.ArgumentParser(description="Run the administration tasks on several hosts in parallel")
+    parser.add_argument('--hosts', nargs='+', default=hosts, help="user@host of every host")
+    parser.add_argument('--tasks', nargs='+', choices=[task_function.__name__ for task_function in TASKS],
+                        help="the tasks to run, by default all of them")
+    parser.add_argument('--workers', type=int, default=WORKERS, help=f"hosts at the same time (default: {WORKERS})")
+    parser.add_argument('--mode', choices=['batch', 'pipeline', 'serial'], default=command_mode,
+                        help=f"how independent commands are sent (default: {command_mode})")
+    parser.add_argument('--no-pool', action='store_true', help="connect again for every run instead of keeping "
+                                                               "the connections open")
+    args = parser.parse_args()
 
+    command_mode = args.mode
+    tasks = [task_function for task_function in TASKS if not args.tasks or task_function.__name__ in args.tasks]
+    connection_pool = None if args.no_pool else ConnectionPool()
+    # Connect to hosts and execute tasks
+    started = time.perf_counter()
+    try:
+        results = run_on_hosts(args.hosts, tasks, workers=args.workers, connection_pool=connection_pool)
+    finally:
+        if connection_pool is not None:
+            connection_pool.close_all()
+    print(summary_table(results, time.perf_counter() - started))
 
-# Connect to hosts and execute tasks
-for host in hosts:
-    conn = Connection(host, connect_kwargs={"password": password})
 
-    print(f"Running tasks on {host}:")
-    run_command(conn)
-    run_multiple_commands(conn)
-    copy_file(conn)
-    copy_file_from_remote(conn)
-    execute_script(conn)
-    print()
+if __name__ == "__main__":
+    main()
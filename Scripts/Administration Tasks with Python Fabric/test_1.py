@@ -0,0 +1,252 @@
+# Tests of the parallel runs, the connection pool and the command batching of 1.py, with fake connections that
+# record every command and transfer in place of SSH connections, so they run offline and without any host.
+# Commands of the fake connections run in a local shell, so the output of a batch is split like over SSH.
+# Run: python -m unittest test_1  (or python -m pytest test_1.py)
+
+
+import contextlib
+import importlib.util
+import io
+import os
+import subprocess
+import threading
+import time
+import unittest
+
+if importlib.util.find_spec('fabric') is None:
+    raise unittest.SkipTest("fabric is not installed")
+
+from invoke import Context
+
+# 1.py is not a valid module name, so it is loaded from its path
+spec = importlib.util.spec_from_file_location('fabric_tasks', os.path.join(os.path.dirname(__file__), '1.py'))
+fabric_tasks = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(fabric_tasks)
+
+
+# what c.run() returns, with the fields the tasks read
+class FakeResult:
+    def __init__(self, stdout, stderr, exited):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exited = exited
+
+
+class FakeTransport:
+    def __init__(self):
+        self.keepalive = None
+
+    def set_keepalive(self, interval):
+        self.keepalive = interval
+
+
+# a connection to a host that records what is done with it. every command waits delay seconds like a round-trip,
+# a command containing 'fail' exits with 1, and once the connection is dropped every command and transfer raises.
+# the tasks check that they get an invoke Context, like fabric's Connection. a Context turns new attributes
+# into config keys, so they are made with _set() like fabric does
+class FakeConnection(Context):
+    def __init__(self, host, delay=0.0):
+        super().__init__()
+        self._set(host=host, delay=delay, commands=[], transfers=[], threads=set(), transport=FakeTransport(),
+                  is_connected=False, opened=0, closed=0)
+
+    def open(self):
+        self.opened += 1
+        self.is_connected = True
+
+    def close(self):
+        self.closed += 1
+        self.is_connected = False
+
+    def drop(self):
+        self.is_connected = False
+
+    def check_connected(self):
+        if self.opened and not self.is_connected:
+            raise ConnectionResetError(f"connection to {self.host} dropped")
+
+    def run(self, command, hide=None, warn=False):
+        self.check_connected()
+        self.commands.append(command)
+        self.threads.add(threading.current_thread().name)
+        time.sleep(self.delay)
+        if 'fail' in command:
+            completed = subprocess.CompletedProcess(command, 1, '', f"{command}: failed\n")
+        else:
+            completed = subprocess.run(['sh', '-c', command], capture_output=True, text=True)
+        if completed.returncode and not warn:
+            raise RuntimeError(f"'{command}' exited with {completed.returncode}")
+        return FakeResult(completed.stdout, completed.stderr, completed.returncode)
+
+    def put(self, local, remote):
+        self.check_connected()
+        self.transfers.append(('put', local, remote))
+
+    def get(self, remote, local):
+        self.check_connected()
+        self.transfers.append(('get', remote, local))
+
+
+# the connection factory: makes a FakeConnection per call and keeps them all. hosts in unreachable can't be
+# connected to, the connections to hosts in dropping drop after their first command
+class FakeConnector:
+    def __init__(self, delay=0.0, unreachable=(), dropping=()):
+        self.delay = delay
+        self.unreachable = set(unreachable)
+        self.dropping = set(dropping)
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def __call__(self, host):
+        if host in self.unreachable:
+            raise TimeoutError(f"{host} timed out")
+        conn = FakeConnection(host, self.delay)
+        if host in self.dropping:
+            run = conn.run
+
+            def run_and_drop(command, **options):
+                try:
+                    return run(command, **options)
+                finally:
+                    conn.drop()
+            conn.run = run_and_drop
+        with self.lock:
+            self.connections.append(conn)
+        return conn
+
+    def of(self, host):
+        return [conn for conn in self.connections if conn.host == host]
+
+
+def echo(c):
+    return c.run(f"echo {c.host}")
+
+
+def failing(c):
+    return c.run('fail now')
+
+
+def upload(c):
+    return c.put('local_file.txt', '/remote/path/file.txt')
+
+
+# runs run_on_hosts() with the host reports it prints kept in self.printed
+class HostsTest(unittest.TestCase):
+    def run_on_hosts(self, hosts, tasks, connect, **options):
+        printed = io.StringIO()
+        with contextlib.redirect_stdout(printed):
+            results = fabric_tasks.run_on_hosts(hosts, tasks, connect, **options)
+        self.printed = printed.getvalue()
+        return results
+
+    def test_hosts_run_in_parallel(self):
+        hosts = [f"user@host{number}" for number in range(8)]
+        connector = FakeConnector(delay=0.2)
+        started = time.perf_counter()
+        results = self.run_on_hosts(hosts, [echo, echo], connector, workers=8)
+        elapsed = time.perf_counter() - started
+        # 8 hosts with two commands of 0.2 s each take 3.2 s one host after the other
+        self.assertLess(elapsed, 1.6)
+        self.assertEqual(list(results), hosts)
+        for host in hosts:
+            self.assertEqual([result.status for result in results[host]], ['ok', 'ok'])
+            self.assertEqual(results[host][0].output, f"{host}\n")
+            conn, = connector.of(host)
+            self.assertEqual(conn.commands, [f"echo {host}"] * 2)
+            # the tasks of a host run one after the other in one thread, and its connection is closed after them
+            self.assertEqual(len(conn.threads), 1)
+            self.assertEqual(conn.closed, 1)
+            self.assertIn(f"Running tasks on {host}:", self.printed)
+
+    def test_workers_limit_the_hosts_at_once(self):
+        hosts = [f"user@host{number}" for number in range(4)]
+        connector = FakeConnector(delay=0.2)
+        started = time.perf_counter()
+        self.run_on_hosts(hosts, [echo], connector, workers=2)
+        self.assertGreaterEqual(time.perf_counter() - started, 0.4)
+
+    def test_pool_reuses_the_connections(self):
+        hosts = ['user@host1', 'user@host2']
+        connector = FakeConnector()
+        pool = fabric_tasks.ConnectionPool(connect=connector, keepalive=15)
+        for _ in range(3):
+            self.run_on_hosts(hosts, [echo, upload], connector, connection_pool=pool)
+        # one connection per host for all the runs, opened once with keepalives and left open
+        self.assertEqual(len(connector.connections), 2)
+        for host in hosts:
+            conn, = connector.of(host)
+            self.assertEqual(conn.opened, 1)
+            self.assertEqual(conn.closed, 0)
+            self.assertEqual(conn.transport.keepalive, 15)
+            self.assertEqual(len(conn.commands), 3)
+            self.assertEqual(len(conn.transfers), 3)
+
+        # a dropped connection is opened again instead of making a new one
+        connector.of('user@host1')[0].drop()
+        self.run_on_hosts(hosts, [echo], connector, connection_pool=pool)
+        self.assertEqual(len(connector.connections), 2)
+        self.assertEqual(connector.of('user@host1')[0].opened, 2)
+
+        pool.close_all()
+        self.assertTrue(all(conn.closed == 1 for conn in connector.connections))
+
+    def test_failures_are_reported_per_host(self):
+        hosts = ['user@good', 'user@down', 'user@dropping']
+        connector = FakeConnector(unreachable={'user@down'}, dropping={'user@dropping'})
+        pool = fabric_tasks.ConnectionPool(connect=connector)
+        results = self.run_on_hosts(hosts, [failing, echo, upload], connector, connection_pool=pool)
+
+        # a failing task doesn't stop the next ones on a host that can still be reached
+        good = results['user@good']
+        self.assertEqual([result.status for result in good], ['failed', 'ok', 'ok'])
+        self.assertEqual(good[0].error, "RuntimeError: 'fail now' exited with 1")
+        # a host that can't be connected to gets a single failed connect
+        down, = results['user@down']
+        self.assertEqual((down.task_name, down.status), ('connect', 'failed'))
+        self.assertEqual(down.error, "TimeoutError: user@down timed out")
+        # once the connection dropped, the tasks left are skipped instead of waiting for it
+        self.assertEqual([result.status for result in results['user@dropping']], ['failed', 'skipped', 'skipped'])
+        self.assertEqual(connector.of('user@dropping')[0].commands, ['fail now'])
+
+        table = fabric_tasks.summary_table(results, 1.0).splitlines()
+        self.assertEqual(table[0].split(), ['host', 'failing', 'echo', 'upload', 'connect', 'seconds'])
+        self.assertEqual(table[1].split()[:4], ['user@good', 'failed', 'ok', 'ok'])
+        self.assertEqual(table[2].split()[:5], ['user@down', '-', '-', '-', 'failed'])
+        self.assertTrue(table[-1].startswith("0 of 3 hosts ran every task without errors"))
+        self.assertIn("TimeoutError: user@down timed out", self.printed)
+
+
+class CommandsTest(unittest.TestCase):
+    def test_batch_is_one_command(self):
+        conn = FakeConnection('user@host1')
+        results = fabric_tasks.run_commands(conn, ['echo one', 'cd /; pwd', 'pwd; echo two >&2'], mode='batch')
+        self.assertEqual(len(conn.commands), 1)
+        self.assertEqual([result.stdout for result in results], ["one\n", "/\n", f"{os.getcwd()}\ntwo\n"])
+        self.assertTrue(all(result.ok for result in results))
+
+    def test_batch_keeps_running_after_a_failure(self):
+        conn = FakeConnection('user@host1')
+        with self.assertRaises(fabric_tasks.CommandsFailed) as raised:
+            fabric_tasks.run_commands(conn, ['echo one', 'exit 3', 'echo three'], mode='batch')
+        results = raised.exception.results
+        self.assertEqual([result.exited for result in results], [0, 3, 0])
+        self.assertEqual(results[2].stdout, "three\n")
+        self.assertEqual(str(raised.exception), "'exit 3' exited with 3")
+
+    def test_pipeline_runs_the_commands_at_once(self):
+        conn = FakeConnection('user@host1', delay=0.2)
+        started = time.perf_counter()
+        results = fabric_tasks.run_commands(conn, [f"echo {number}" for number in range(4)], mode='pipeline')
+        self.assertLess(time.perf_counter() - started, 0.6)
+        self.assertEqual([result.stdout for result in results], [f"{number}\n" for number in range(4)])
+        self.assertEqual(sorted(conn.commands), [f"echo {number}" for number in range(4)])
+
+    def test_serial(self):
+        conn = FakeConnection('user@host1')
+        results = fabric_tasks.run_commands(conn, ['echo one', 'echo two'], mode='serial')
+        self.assertEqual(conn.commands, ['echo one', 'echo two'])
+        self.assertEqual([result.stdout for result in results], ["one\n", "two\n"])
+
+
+if __name__ == "__main__":
+    unittest.main()
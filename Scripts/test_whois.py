@@ -0,0 +1,168 @@
+# Tests of the bulk WHOIS lookups and the WHOIS cache in whois.py, with a local stub in place of the real whois query,
+# so they run offline and without the whois library. The stub sleeps nothing: the backoff delays
+# are recorded by the sleep function given to audit().
+# Run: python -m unittest test_whois  (or python -m pytest test_whois.py)
+
+
+import datetime
+import importlib.util
+import os
+import tempfile
+import threading
+import unittest
+
+# whois.py has the name of the library it wraps, so it is loaded from its path under another name
+spec = importlib.util.spec_from_file_location('whois_audit', os.path.join(os.path.dirname(__file__), 'whois.py'))
+whois_audit = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(whois_audit)
+
+
+# what whois.query() returns for a registered domain, with the fields domain_record() reads
+class StubRecord:
+    def __init__(self, domain):
+        self.name = domain
+        self.registrar = 'Example Registrar'
+        self.creation_date = datetime.datetime(2000, 1, 2, 3, 4, 5)
+        self.expiration_date = datetime.datetime(2030, 1, 2, 3, 4, 5)
+        self.last_updated = None
+        self.name_servers = {'ns2.example.net', 'ns1.example.net'}
+        self.status = 'active'
+        self.emails = []
+
+
+# the lookup function: registered domains return a record, 'free.*' isn't registered, 'broken.*'
+# raises a hard error, and the domains in flaky fail with a temporary error that many times first
+class StubLookup:
+    def __init__(self, flaky=None):
+        self.flaky = dict(flaky or {})
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, domain):
+        with self.lock:
+            self.calls.append(domain)
+            failures = self.flaky.get(domain, 0)
+            if failures:
+                self.flaky[domain] = failures - 1
+        if failures:
+            raise whois_audit.TemporaryLookupError("WhoisQuotaExceeded: try again later")
+        if domain.startswith('free.'):
+            return None
+        if domain.startswith('broken.'):
+            raise ValueError("unexpected answer")
+        return StubRecord(domain)
+
+
+# runs audit() with the delays recorded instead of slept
+class StubAudit:
+    def setUp(self):
+        self.delays = []
+
+    def sleep(self, seconds):
+        self.delays.append(seconds)
+
+    # the records of an audit by domain. rate 0 turns the rate limit off, so every delay is a backoff
+    def audit(self, domains, lookup, **options):
+        options = {'workers': 4, 'rate': 0, 'retries': 3, 'backoff': 1.0, 'sleep': self.sleep, **options}
+        return {record['domain']: record for record in whois_audit.audit(domains, lookup=lookup, **options)}
+
+
+class AuditTest(StubAudit, unittest.TestCase):
+    def test_registered_domain(self):
+        records = self.audit(['example.com'], StubLookup())
+        record = records['example.com']
+        self.assertEqual(record['error'], None)
+        self.assertEqual(record['attempts'], 1)
+        self.assertEqual(record['registrar'], 'Example Registrar')
+        self.assertEqual(record['expiration_date'], '2030-01-02T03:04:05')
+        self.assertEqual(record['name_servers'], ['ns1.example.net', 'ns2.example.net'])
+        self.assertEqual(self.delays, [])
+
+    def test_retry_with_exponential_backoff(self):
+        lookup = StubLookup(flaky={'flaky.com': 2})
+        record = self.audit(['flaky.com'], lookup, backoff=0.5)['flaky.com']
+        self.assertEqual(record['error'], None)
+        self.assertEqual(record['attempts'], 3)
+        self.assertEqual(lookup.calls, ['flaky.com'] * 3)
+        # 0.5 s then 1 s, each with up to 50% jitter either way
+        self.assertEqual(len(self.delays), 2)
+        for delay, base in zip(self.delays, [0.5, 1.0]):
+            self.assertGreaterEqual(delay, base * 0.5)
+            self.assertLessEqual(delay, base * 1.5)
+
+    def test_gives_up_after_the_retries(self):
+        lookup = StubLookup(flaky={'down.com': 10})
+        record = self.audit(['down.com'], lookup, retries=2)['down.com']
+        self.assertTrue(record['error'].startswith("gave up: WhoisQuotaExceeded"))
+        self.assertEqual(record['attempts'], 3)
+        self.assertEqual(len(lookup.calls), 3)
+        self.assertEqual(len(self.delays), 2)
+
+    def test_not_registered(self):
+        record = self.audit(['free.com'], StubLookup())['free.com']
+        self.assertEqual(record['error'], "not registered")
+        self.assertEqual(record['registrar'], None)
+        self.assertEqual(record['attempts'], 1)
+
+    def test_hard_error_is_not_retried(self):
+        lookup = StubLookup()
+        record = self.audit(['broken.com'], lookup)['broken.com']
+        self.assertEqual(record['error'], "ValueError: unexpected answer")
+        self.assertEqual(record['attempts'], 1)
+        self.assertEqual(lookup.calls, ['broken.com'])
+        self.assertEqual(self.delays, [])
+
+    def test_many_domains(self):
+        domains = [f"domain{number}.org" for number in range(50)]
+        lookup = StubLookup(flaky={'domain7.org': 1})
+        records = self.audit(domains, lookup)
+        self.assertEqual(sorted(records), sorted(domains))
+        self.assertTrue(all(record['error'] is None for record in records.values()))
+        self.assertEqual(len(lookup.calls), 51)
+
+
+class CacheTest(StubAudit, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.now = 1000000.0
+        self.cache = whois_audit.WhoisCache(os.path.join(self.directory.name, 'whois_cache.db'), ttl=3600,
+                                            clock=lambda: self.now)
+
+    def tearDown(self):
+        self.cache.close()
+        self.directory.cleanup()
+
+    def test_cache_hit_has_no_attempts(self):
+        domains = ['example.com', 'free.com', 'broken.com']
+        first = self.audit(domains, StubLookup(), cache=self.cache)
+        self.assertEqual(first['example.com']['attempts'], 1)
+
+        lookup = StubLookup()
+        second = self.audit(domains, lookup, cache=self.cache)
+        # the records and the not registered domain come from the cache, the error is looked up again
+        self.assertEqual(lookup.calls, ['broken.com'])
+        self.assertEqual(second['example.com']['attempts'], 0)
+        self.assertEqual(second['free.com']['attempts'], 0)
+        self.assertEqual(second['free.com']['error'], "not registered")
+        self.assertEqual(second['broken.com']['attempts'], 1)
+        self.assertEqual({**second['example.com'], 'attempts': 1}, first['example.com'])
+
+    def test_stale_record_is_looked_up_again(self):
+        self.audit(['example.com'], StubLookup(), cache=self.cache)
+        self.now += 3600
+        lookup = StubLookup()
+        record = self.audit(['example.com'], lookup, cache=self.cache)['example.com']
+        self.assertEqual(lookup.calls, ['example.com'])
+        self.assertEqual(record['attempts'], 1)
+
+    def test_expiring(self):
+        self.audit(['example.com', 'free.com'], StubLookup(), cache=self.cache)
+        self.cache.commit()
+        expiring = list(self.cache.expiring(30, today=datetime.date(2029, 12, 20)))
+        self.assertEqual([record['domain'] for record in expiring], ['example.com'])
+        self.assertEqual(list(self.cache.expiring(30, today=datetime.date(2029, 1, 1))), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
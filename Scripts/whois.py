@@ -1,12 +1,367 @@
 # "pip install whois" to install the whois library
 
-import whois
-w = whois.query('google.com')
-print(w.name)
-print(w.registrar)
-print(w.creation_date)
-print(w.expiration_date)
-print(w.last_updated)
-print(w.name_servers)
-print(w.status)
-print(w.emails)
+# Bulk WHOIS lookups for domain expiry audits.
+# Domains are read from the command line, a file or stdin (one per line, # starts a comment) and looked up
+# on a bounded thread pool. Every registry (the top-level domain) has its own rate limit, and lookups that
+# fail with a temporary error (quota, timeout, network) are retried with exponential backoff.
+# Results are written as JSONL or CSV while the lookups finish, with the fields the single lookup printed:
+# name, registrar, creation/expiration/last updated dates, name servers, status and emails.
+# The lookup function is a parameter of audit(), so it can be replaced by a local stub.
+# Records are kept in a SQLite cache (whois_cache.db) for --ttl days, so a re-run of an audit only looks up
+# the domains that are new or stale; cached records have 0 attempts. The least recently used records are
+# dropped past --cache-size, and the expiration dates are indexed to list the domains expiring soon.
+# Run: python whois.py google.com example.org
+#      python whois.py --input domains.txt --output results.jsonl --workers 16 --rate 1 --registry-rate com=4
+#      cat domains.txt | python whois.py --format csv > results.csv
+#      python whois.py --expiring 30
+
+
+import argparse
+import concurrent.futures
+import csv
+import datetime
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+
+# fields of every result, in the order of the CSV columns
+FIELDS = ['domain', 'name', 'registrar', 'creation_date', 'expiration_date', 'last_updated', 'name_servers',
+          'status', 'emails', 'error', 'attempts']
+# exceptions of the whois library that are worth trying again
+TEMPORARY_ERROR_NAMES = ['WhoisCommandFailed', 'WhoisQuotaExceeded', 'WhoisCommandTimeout']
+CACHE_FILE = 'whois_cache.db'
+# days a cached record is used before it is looked up again, and the records kept at most
+CACHE_TTL_DAYS = 7
+CACHE_SIZE = 1000000
+# cached records written by one transaction
+CACHE_COMMIT_EVERY = 500
+
+
+# raised by a lookup function when the lookup should be tried again later
+class TemporaryLookupError(Exception):
+    pass
+
+
+# the whois library. this file is called whois.py too, so its own directory is taken off the
+# module path first, or the script would import itself instead of the library
+def whois_library():
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:] = [path for path in sys.path if os.path.abspath(path or '.') != here]
+    import whois
+    return whois
+
+
+# Example 1: the default lookup, whois.query() with its temporary errors turned into TemporaryLookupError.
+# returns None for a domain that is not registered
+def query_whois(domain):
+    whois = whois_library()
+    exceptions = getattr(whois, 'exceptions', None)
+    temporary = tuple(getattr(exceptions, name) for name in TEMPORARY_ERROR_NAMES if hasattr(exceptions, name))
+    try:
+        return whois.query(domain)
+    except temporary + (OSError,) as error:
+        raise TemporaryLookupError(f"{type(error).__name__}: {error}")
+
+
+# the registry answering for a domain: its top-level domain
+def registry_of(domain):
+    return domain.rsplit('.', 1)[-1]
+
+
+# spaces the lookups to one registry at most rate per second. every caller reserves the next
+# free slot under the lock and sleeps until it comes, so threads never wake up at the same time
+class RateLimiter:
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = self.clock()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            self.sleep(slot - now)
+
+
+# one RateLimiter per registry, created the first time the registry is seen
+class RegistryLimits:
+    def __init__(self, rate, registry_rates=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.registry_rates = registry_rates or {}
+        self.clock = clock
+        self.sleep = sleep
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def wait(self, registry):
+        with self.lock:
+            limiter = self.limiters.get(registry)
+            if limiter is None:
+                limiter = RateLimiter(self.registry_rates.get(registry, self.rate), self.clock, self.sleep)
+                self.limiters[registry] = limiter
+        limiter.wait()
+
+
+# text of a field value: dates in ISO format, sets and lists of name servers, status or emails as sorted lists
+def field_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset, list, tuple)):
+        return sorted(str(item) for item in value)
+    return value
+
+
+# the result record of a domain from what the lookup returned
+def domain_record(domain, result, error=None, attempts=1):
+    record = {'domain': domain}
+    for field in FIELDS[1:-2]:
+        record[field] = field_value(getattr(result, field, None)) if result is not None else None
+    if result is None and error is None:
+        error = "not registered"
+    record['error'] = error
+    record['attempts'] = attempts
+    return record
+
+
+# WHOIS records on disk, by domain. a record is fresh for ttl seconds after it was looked up, the least
+# recently used records are deleted once there are more than max_entries. reads only mark records as used
+# in memory, the marks are written with the next batch of records. used from one thread, the one running audit()
+class WhoisCache:
+    def __init__(self, file_name=CACHE_FILE, ttl=CACHE_TTL_DAYS * 86400, max_entries=CACHE_SIZE, clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.connection = sqlite3.connect(file_name)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS records (
+                domain TEXT PRIMARY KEY,
+                record TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                expiration_date TEXT
+            );
+            CREATE INDEX IF NOT EXISTS records_expiration_date ON records (expiration_date);
+            CREATE INDEX IF NOT EXISTS records_last_used ON records (last_used);
+        ''')
+        self.entries = self.connection.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+        self.used = {}  # domain -> time it was last read, not written yet
+        self.unsaved = 0
+
+    # the fresh record of a domain, or None when it is missing or stale
+    def get(self, domain):
+        now = self.clock()
+        row = self.connection.execute('SELECT record, fetched_at FROM records WHERE domain = ?', (domain,)).fetchone()
+        if row is None or row[1] + self.ttl <= now:
+            return None
+        self.used[domain] = now
+        return json.loads(row[0])
+
+    # store the record of a lookup. lookups that failed are not stored, they are tried again next time
+    def put(self, record):
+        if record['error'] not in (None, "not registered"):
+            return
+        now = self.clock()
+        if self.connection.execute('SELECT 1 FROM records WHERE domain = ?', (record['domain'],)).fetchone() is None:
+            self.entries += 1
+        self.connection.execute(
+            'INSERT OR REPLACE INTO records (domain, record, fetched_at, last_used, expiration_date) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (record['domain'], json.dumps(record), now, now, record['expiration_date']))
+        self.unsaved += 1
+        if self.unsaved >= CACHE_COMMIT_EVERY:
+            self.commit()
+
+    # write the marks of use, drop the least recently used records past max_entries
+    def commit(self):
+        self.connection.executemany('UPDATE records SET last_used = ? WHERE domain = ?',
+                                    [(used, domain) for domain, used in self.used.items()])
+        self.used.clear()
+        if self.entries > self.max_entries:
+            self.connection.execute(
+                'DELETE FROM records WHERE domain IN (SELECT domain FROM records ORDER BY last_used LIMIT ?)',
+                (self.entries - self.max_entries,))
+            self.entries = self.max_entries
+        self.connection.commit()
+        self.unsaved = 0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    # the cached records whose expiration date is within the next days, soonest first, read from the
+    # expiration date index. stale records are included, expiration dates rarely change
+    def expiring(self, days, today=None):
+        today = today or datetime.date.today()
+        rows = self.connection.execute(
+            'SELECT record FROM records WHERE expiration_date >= ? AND expiration_date < ? ORDER BY expiration_date',
+            (today.isoformat(), (today + datetime.timedelta(days=days + 1)).isoformat()))
+        for (record,) in rows:
+            yield json.loads(record)
+
+
+# Example 2: look up one domain, waiting for its registry's rate limit before every attempt and
+# backing off exponentially (with jitter) after a temporary error. never raises, errors are part of the record
+def lookup_domain(domain, lookup, limits, retries, backoff, sleep=time.sleep):
+    registry = registry_of(domain)
+    for attempt in range(1, retries + 2):
+        limits.wait(registry)
+        try:
+            return domain_record(domain, lookup(domain), attempts=attempt)
+        except TemporaryLookupError as error:
+            if attempt > retries:
+                return domain_record(domain, None, f"gave up: {error}", attempt)
+            sleep(backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+        except Exception as error:
+            return domain_record(domain, None, f"{type(error).__name__}: {error}", attempt)
+
+
+# Example 3: look up many domains on a pool of worker threads and yield the records as they finish.
+# at most a few times workers domains are waiting at once, so the domains can come from a stream.
+# with a cache, fresh records are given right away without waiting for the rate limit, and the
+# records looked up are stored
+def audit(domains, lookup=query_whois, workers=8, rate=1.0, registry_rates=None, retries=4, backoff=1.0,
+          sleep=time.sleep, cache=None):
+    limits = RegistryLimits(rate, registry_rates, sleep=sleep)
+    with concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='whois') as pool:
+        pending = set()
+        for domain in domains:
+            record = cache.get(domain) if cache is not None else None
+            if record is not None:
+                record['attempts'] = 0
+                yield record
+                continue
+            pending.add(pool.submit(lookup_domain, domain, lookup, limits, retries, backoff, sleep))
+            if len(pending) >= workers * 4:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                yield from finished(done, cache)
+        yield from finished(concurrent.futures.as_completed(pending), cache)
+
+
+def finished(futures, cache):
+    for future in futures:
+        record = future.result()
+        if cache is not None:
+            cache.put(record)
+        yield record
+
+
+# the domains of the lines, lowercased, without blank lines, comments and repeats
+def read_domains(lines):
+    seen = set()
+    for line in lines:
+        domain = line.split('#', 1)[0].strip().lower().rstrip('.')
+        if domain and domain not in seen:
+            seen.add(domain)
+            yield domain
+
+
+# Example 4: write the records as JSON lines or CSV rows (lists joined by spaces), flushed one by one
+def write_records(records, file, output_format):
+    writer = None
+    if output_format == 'csv':
+        writer = csv.DictWriter(file, FIELDS)
+        writer.writeheader()
+    count = 0
+    failed = 0
+    for record in records:
+        if writer is not None:
+            writer.writerow({field: ' '.join(value) if isinstance(value, list) else value
+                             for field, value in record.items()})
+        else:
+            file.write(json.dumps(record) + '\n')
+        file.flush()
+        count += 1
+        failed += record['error'] is not None
+    return count, failed
+
+
+# 'com=4' -> ('com', 4.0)
+def registry_rate(text):
+    registry, _, rate = text.partition('=')
+    try:
+        return registry.lower().lstrip('.'), float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected REGISTRY=RATE, got {text!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up the WHOIS records of many domains")
+    parser.add_argument('domains', nargs='*', help="domains to look up, else they are read from --input or stdin")
+    parser.add_argument('--input', help="file with one domain per line")
+    parser.add_argument('--output', help="write the results to this file instead of stdout")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help="default: from the --output extension, else jsonl")
+    parser.add_argument('--workers', type=int, default=8, help="lookups running at the same time (default: 8)")
+    parser.add_argument('--rate', type=float, default=1.0, help="lookups per second to each registry (default: 1)")
+    parser.add_argument('--registry-rate', type=registry_rate, action='append', default=[], metavar='REGISTRY=RATE',
+                        help="another rate for one registry, for example com=4")
+    parser.add_argument('--retries', type=int, default=4, help="attempts after a temporary error (default: 4)")
+    parser.add_argument('--backoff', type=float, default=1.0,
+                        help="seconds before the first retry, doubled for every next one (default: 1)")
+    parser.add_argument('--cache', default=CACHE_FILE, help=f"SQLite cache of the records (default: {CACHE_FILE})")
+    parser.add_argument('--no-cache', action='store_true', help="look up every domain, without the cache")
+    parser.add_argument('--ttl', type=float, default=CACHE_TTL_DAYS,
+                        help=f"days a cached record is used (default: {CACHE_TTL_DAYS})")
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE,
+                        help=f"records kept in the cache, the least recently used go first (default: {CACHE_SIZE})")
+    parser.add_argument('--expiring', type=int, metavar='DAYS',
+                        help="only list the cached domains expiring within this many days, without lookups")
+    args = parser.parse_args()
+
+    output_format = args.format or ('csv' if (args.output or '').lower().endswith('.csv') else 'jsonl')
+    cache = None if args.no_cache else WhoisCache(args.cache, args.ttl * 86400, args.cache_size)
+
+    if args.expiring is not None:
+        if cache is None:
+            sys.exit("--expiring answers from the cache, it can't be used with --no-cache")
+        output = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+        try:
+            count, _ = write_records(cache.expiring(args.expiring), output, output_format)
+        finally:
+            cache.close()
+            if output is not sys.stdout:
+                output.close()
+        print(f"{count} cached domains expire within {args.expiring} days.", file=sys.stderr)
+        return
+
+    try:
+        whois_library()
+    except ImportError:
+        sys.exit("whois.py needs the whois library, install it with: pip install whois")
+
+    if args.domains:
+        lines = args.domains
+    elif args.input:
+        lines = open(args.input, encoding='utf-8')
+    else:
+        lines = sys.stdin
+    output = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+
+    started = time.perf_counter()
+    try:
+        records = audit(read_domains(lines), workers=args.workers, rate=args.rate,
+                        registry_rates=dict(args.registry_rate), retries=args.retries, backoff=args.backoff,
+                        cache=cache)
+        count, failed = write_records(records, output, output_format)
+    finally:
+        if cache is not None:
+            cache.close()
+        if output is not sys.stdout:
+            output.close()
+        if lines is not args.domains and lines is not sys.stdin:
+            lines.close()
+    print(f"Looked up {count} domains in {time.perf_counter() - started:.1f} s, {failed} without a record.",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()